@@ -0,0 +1,142 @@
+import argparse
+import time
+
+from database import (
+    delete_document_chunks_from,
+    find_documents_to_backfill,
+    load_document_chunk_state,
+    load_extracted_text,
+)
+from document_indexing import (
+    DOCUMENT_EMBEDDING_MODEL,
+    changed_chunk_records,
+    iter_chunk_records,
+    reusable_chunk_embeddings,
+    save_changed_chunks,
+)
+from embedding_pool import iter_pool_embeddings
+from rag_pipeline import split_extracted_sections
+from vector_store import (
+    chunks_to_embed,
+    embed_chunks_reusing,
+    embedding_throughput,
+    new_embedding_stats,
+)
+
+
+def backfill_documents(documents, *, max_workers=None):
+    """Chunk and embed stored extractions on a pool of embedding workers.
+
+    ``documents`` holds ``(document_id, file_name)`` pairs. Each document's
+    text is chunked with pages and offsets as during processing and indexed
+    incrementally: rows that already hold the same chunk are left alone,
+    stored embeddings of identical text are reused, and only the remaining
+    texts are sent to the pool. Changed chunks are saved as soon as the pool
+    returns their embeddings. Returns ``(saved_chunk_count, embedding_stats)``.
+    """
+
+    pending_documents = {}
+    file_names = dict(documents)
+    embedding_stats = new_embedding_stats()
+    saved_chunk_count = 0
+
+    def embedding_jobs():
+        for document_id, _file_name in documents:
+            extracted_text = load_extracted_text(document_id) or ""
+            chunk_records = list(
+                iter_chunk_records(split_extracted_sections(extracted_text))
+            )
+            stored_chunks = load_document_chunk_state(document_id)
+            changed_records = changed_chunk_records(chunk_records, stored_chunks)
+            reusable_embeddings = reusable_chunk_embeddings(stored_chunks)
+            missing_hashes = chunks_to_embed(
+                [record["text"] for _, record, _ in changed_records],
+                [content_hash for _, _, content_hash in changed_records],
+                reusable_embeddings,
+            )
+            pending_documents[document_id] = (
+                len(chunk_records),
+                stored_chunks,
+                changed_records,
+                reusable_embeddings,
+                missing_hashes,
+            )
+            yield document_id, list(missing_hashes.values())
+
+    for document_id, new_embeddings in iter_pool_embeddings(
+        embedding_jobs(),
+        max_workers=max_workers,
+        embedding_stats=embedding_stats,
+    ):
+        (
+            chunk_count,
+            stored_chunks,
+            changed_records,
+            reusable_embeddings,
+            missing_hashes,
+        ) = pending_documents.pop(document_id)
+        if changed_records:
+            reusable_embeddings.update(zip(missing_hashes, new_embeddings))
+            embeddings, _ = embed_chunks_reusing(
+                [record["text"] for _, record, _ in changed_records],
+                [content_hash for _, _, content_hash in changed_records],
+                reusable_embeddings,
+            )
+            save_changed_chunks(document_id, changed_records, embeddings)
+        if any(stored_index >= chunk_count for stored_index in stored_chunks):
+            delete_document_chunks_from(document_id, chunk_count)
+        saved_chunk_count += len(changed_records)
+        print(
+            f"Indexed document {document_id} ({file_names[document_id]}): "
+            f"{len(changed_records)} of {chunk_count} chunk(s) saved, "
+            f"{len(missing_hashes)} embedded"
+        )
+
+    return saved_chunk_count, embedding_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Embed processed documents that have no chunks or no embeddings "
+            "from the current model."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of embedding worker processes.",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Backfill at most this many documents.",
+    )
+    arguments = parser.parse_args()
+
+    documents = find_documents_to_backfill(
+        embedding_model=DOCUMENT_EMBEDDING_MODEL,
+        limit=arguments.limit,
+    )
+    print(f"Found {len(documents)} document(s) to backfill.")
+
+    started_at = time.perf_counter()
+    saved_chunk_count, embedding_stats = backfill_documents(
+        documents,
+        max_workers=arguments.workers,
+    )
+    elapsed_seconds = time.perf_counter() - started_at
+    throughput = embedding_throughput(embedding_stats)
+    print(
+        f"Saved {saved_chunk_count} chunk(s) in {elapsed_seconds:.1f}s "
+        f"({saved_chunk_count / max(elapsed_seconds, 1e-9):.1f} chunks/s); "
+        f"encoded {throughput['encoded_chunks']} at "
+        f"{throughput['chunks_per_second']:g} chunks/s per worker, "
+        f"{throughput['padding_ratio']:.0%} padding."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,107 @@
+import hashlib
 import os
+import threading
 
+import numpy as np
 import psycopg
 import streamlit as st
 from dotenv import load_dotenv
 from pgvector import Vector
+from psycopg.types.json import Jsonb
 
 from pgvector.psycopg import register_vector
 
+from vector_storage import (
+    chunk_embedding_model,
+    embedding_storage_column,
+    embedding_storage_schema_updates,
+    full_embedding_from_storage,
+    to_storage_vector,
+)
+
 
 load_dotenv()
 
 
+# Cache tables are trimmed to this share of their row cap once they have
+# grown past it. Their exact size is counted on the first write of each
+# process and then once every CACHE_EVICTION_CHECK_INTERVAL writes.
+CACHE_EVICTION_TARGET_RATIO = 0.9
+CACHE_EVICTION_CHECK_INTERVAL = 100
+
+_cache_write_counts = {}
+
+# Additive, idempotent changes to the hosted schema. They are applied once per
+# process before the first query that depends on them.
+SCHEMA_UPDATES = (
+    "alter table documents add column if not exists extraction_metadata jsonb;",
+    "alter table documents add column if not exists extractor_version text;",
+    """
+        create table if not exists vision_transcription_cache (
+            cache_key text primary key,
+            model text not null,
+            prompt_version text not null,
+            transcription text not null,
+            created_at timestamptz not null default now(),
+            last_used_at timestamptz not null default now()
+        );
+    """,
+    """
+        create index if not exists vision_transcription_cache_last_used_idx
+        on vision_transcription_cache (last_used_at);
+    """,
+    """
+        create table if not exists vision_jobs (
+            document_hash text primary key,
+            file_name text,
+            page_count integer not null,
+            status text not null default 'running',
+            last_error text,
+            created_at timestamptz not null default now(),
+            updated_at timestamptz not null default now()
+        );
+    """,
+    """
+        create table if not exists vision_job_pages (
+            document_hash text not null
+                references vision_jobs (document_hash) on delete cascade,
+            page_number integer not null,
+            page_text text not null,
+            completed_at timestamptz not null default now(),
+            primary key (document_hash, page_number)
+        );
+    """,
+    "alter table vision_jobs add column if not exists job_version text;",
+    "alter table document_chunks add column if not exists page_start integer;",
+    "alter table document_chunks add column if not exists page_end integer;",
+    "alter table document_chunks add column if not exists start_offset integer;",
+    "alter table document_chunks add column if not exists end_offset integer;",
+    """
+        create index if not exists document_chunks_page_idx
+        on document_chunks (document_id, page_start, page_end);
+    """,
+    "alter table document_chunks add column if not exists content_hash text;",
+    "alter table policy_chunks add column if not exists content_hash text;",
+    """
+        create table if not exists embedding_cache (
+            embedding_model text not null,
+            text_hash text not null,
+            embedding vector not null,
+            created_at timestamptz not null default now(),
+            last_used_at timestamptz not null default now(),
+            primary key (embedding_model, text_hash)
+        );
+    """,
+    """
+        create index if not exists embedding_cache_last_used_idx
+        on embedding_cache (last_used_at);
+    """,
+)
+
+_schema_lock = threading.Lock()
+_schema_updated = False
+
+
 def get_database_url():
     """Return the configured PostgreSQL connection URL."""
 
@@ -39,6 +130,26 @@ def test_database_connection():
             cursor.execute("SELECT version();")
             return cursor.fetchone()[0]
 
+def apply_schema_updates():
+    """Apply SCHEMA_UPDATES and the embedding storage columns once per process."""
+    global _schema_updated
+
+    if _schema_updated:
+        return
+
+    with _schema_lock:
+        if _schema_updated:
+            return
+
+        with psycopg.connect(get_database_url()) as connection:
+            with connection.cursor() as cursor:
+                for statement in SCHEMA_UPDATES + embedding_storage_schema_updates():
+                    cursor.execute(statement)
+            connection.commit()
+
+        _schema_updated = True
+
+
 def upsert_document(
     *,
     document_hash,
@@ -53,6 +164,8 @@ def upsert_document(
     extracted_word_count=None,
     extracted_character_count=None,
     extracted_text=None,
+    extraction_metadata=None,
+    extractor_version=None,
     processing_status="uploaded",
     processing_error=None,
 ):
@@ -60,6 +173,7 @@ def upsert_document(
     """Insert a document record, or update it if the document hash already exists."""
 
     database_url = get_database_url()
+    apply_schema_updates()
 
     query = """
         insert into documents (
@@ -75,6 +189,8 @@ def upsert_document(
             extracted_word_count,
             extracted_character_count,
             extracted_text,
+            extraction_metadata,
+            extractor_version,
             processing_status,
             processing_error,
             processed_at
@@ -92,6 +208,8 @@ def upsert_document(
             %(extracted_word_count)s,
             %(extracted_character_count)s,
             %(extracted_text)s,
+            %(extraction_metadata)s,
+            %(extractor_version)s,
             %(processing_status)s,
             %(processing_error)s,
             case
@@ -113,6 +231,8 @@ def upsert_document(
             extracted_word_count = excluded.extracted_word_count,
             extracted_character_count = excluded.extracted_character_count,
             extracted_text = excluded.extracted_text,
+            extraction_metadata = excluded.extraction_metadata,
+            extractor_version = excluded.extractor_version,
             processing_status = excluded.processing_status,
             processing_error = excluded.processing_error,
             processed_at = excluded.processed_at
@@ -132,6 +252,12 @@ def upsert_document(
         "extracted_word_count": extracted_word_count,
         "extracted_character_count": extracted_character_count,
         "extracted_text": extracted_text,
+        "extraction_metadata": (
+            Jsonb(extraction_metadata)
+            if extraction_metadata is not None
+            else None
+        ),
+        "extractor_version": extractor_version,
         "processing_status": processing_status,
         "processing_error": processing_error,
     }
@@ -145,30 +271,633 @@ def upsert_document(
     return document_id
 
 
+def start_document_processing(
+    *,
+    document_hash,
+    original_file_name,
+    s3_object_key,
+    content_type=None,
+    size_bytes=None,
+):
+    """Mark a document as processing and return its id, creating the record.
+
+    An existing record keeps its extracted text and metadata, and a processed
+    record also keeps its status until the new extraction is saved, so the
+    earlier extraction stays reusable if reprocessing fails or stops.
+    """
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = """
+        insert into documents (
+            document_hash,
+            original_file_name,
+            s3_object_key,
+            content_type,
+            size_bytes,
+            processing_status
+        )
+        values (
+            %(document_hash)s,
+            %(original_file_name)s,
+            %(s3_object_key)s,
+            %(content_type)s,
+            %(size_bytes)s,
+            'processing'
+        )
+        on conflict (document_hash)
+        do update set
+            processing_status = case
+                when documents.processing_status = 'processed' then 'processed'
+                else 'processing'
+            end,
+            processing_error = null
+        returning id;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                query,
+                {
+                    "document_hash": document_hash,
+                    "original_file_name": original_file_name,
+                    "s3_object_key": s3_object_key,
+                    "content_type": content_type,
+                    "size_bytes": size_bytes,
+                },
+            )
+            document_id = cursor.fetchone()[0]
+            connection.commit()
+
+    return document_id
+
+
+def mark_document_failed(document_id, error):
+    """Record that processing a document failed, keeping its stored data.
+
+    A document processed earlier stays processed, with the error recorded.
+    """
+
+    database_url = get_database_url()
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    update documents
+                    set processing_status = case
+                            when processing_status = 'processed' then 'processed'
+                            else 'failed'
+                        end,
+                        processing_error = %s
+                    where id = %s;
+                """,
+                (error, document_id),
+            )
+        connection.commit()
+
+
+def find_processed_document(document_hash):
+    """Return the stored extraction for a document hash, or None."""
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = """
+        select
+            id,
+            s3_object_key,
+            extracted_text,
+            extraction_metadata,
+            extractor_version
+        from documents
+        where document_hash = %s
+          and processing_status = 'processed'
+          and extracted_text is not null;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, (document_hash,))
+            row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    document_id, s3_object_key, extracted_text, metadata, version = row
+    return {
+        "document_id": document_id,
+        "s3_object_key": s3_object_key,
+        "extracted_text": extracted_text,
+        "extraction_metadata": metadata,
+        "extractor_version": version,
+    }
+
+
+def load_document_chunks(document_id):
+    """Return the stored chunk texts of a document in chunk order."""
+
+    database_url = get_database_url()
+
+    query = """
+        select chunk_text
+        from document_chunks
+        where document_id = %s
+        order by chunk_index;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, (document_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+
+def _evict_cache_rows(cursor, *, table, key_columns, max_rows):
+    """Trim a cache table once it holds more than ``max_rows`` rows.
+
+    Rows are counted exactly, but only every CACHE_EVICTION_CHECK_INTERVAL
+    writes, so most writes skip the check. Over the cap, the least recently
+    used rows are deleted down to CACHE_EVICTION_TARGET_RATIO of it, so one
+    sort of the table pays for many later writes. Returns the number of
+    deleted rows.
+    """
+    write_count = _cache_write_counts.get(table, 0)
+    _cache_write_counts[table] = write_count + 1
+    if write_count % CACHE_EVICTION_CHECK_INTERVAL:
+        return 0
+
+    cursor.execute(f"select count(*) from {table};")
+    if cursor.fetchone()[0] <= max_rows:
+        return 0
+
+    cursor.execute(
+        f"""
+            delete from {table}
+            where ({key_columns}) in (
+                select {key_columns}
+                from {table}
+                order by last_used_at desc
+                offset %s
+            );
+        """,
+        (int(max_rows * CACHE_EVICTION_TARGET_RATIO),),
+    )
+    return cursor.rowcount
+
+
+def find_vision_transcription(cache_key):
+    """Return a cached vision transcription and mark it as recently used."""
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = """
+        update vision_transcription_cache
+        set last_used_at = now()
+        where cache_key = %s
+        returning transcription;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, (cache_key,))
+            row = cursor.fetchone()
+        connection.commit()
+
+    return row[0] if row else None
+
+
+def save_vision_transcription(
+    *,
+    cache_key,
+    model,
+    prompt_version,
+    transcription,
+    max_rows,
+):
+    """Cache a vision transcription, evicting old rows once over the cap."""
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    insert_query = """
+        insert into vision_transcription_cache (
+            cache_key,
+            model,
+            prompt_version,
+            transcription
+        )
+        values (
+            %(cache_key)s,
+            %(model)s,
+            %(prompt_version)s,
+            %(transcription)s
+        )
+        on conflict (cache_key)
+        do update set
+            transcription = excluded.transcription,
+            last_used_at = now();
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                insert_query,
+                {
+                    "cache_key": cache_key,
+                    "model": model,
+                    "prompt_version": prompt_version,
+                    "transcription": transcription,
+                },
+            )
+            _evict_cache_rows(
+                cursor,
+                table="vision_transcription_cache",
+                key_columns="cache_key",
+                max_rows=max_rows,
+            )
+        connection.commit()
+
+
+def find_cached_embeddings(*, embedding_model, text_hashes):
+    """Return ``{text_hash: embedding}`` cached for the model and mark them used."""
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = """
+        update embedding_cache
+        set last_used_at = now()
+        where embedding_model = %s
+          and text_hash = any(%s)
+        returning text_hash, embedding;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        register_vector(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, (embedding_model, list(text_hashes)))
+            rows = cursor.fetchall()
+        connection.commit()
+
+    return dict(rows)
+
+
+def save_cached_embeddings(*, embedding_model, embeddings_by_hash, max_rows):
+    """Cache chunk embeddings, evicting old rows once over the cap."""
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    insert_query = """
+        insert into embedding_cache (embedding_model, text_hash, embedding)
+        values (%(embedding_model)s, %(text_hash)s, %(embedding)s)
+        on conflict (embedding_model, text_hash)
+        do update set
+            embedding = excluded.embedding,
+            last_used_at = now();
+    """
+
+    with psycopg.connect(database_url) as connection:
+        register_vector(connection)
+
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                insert_query,
+                [
+                    {
+                        "embedding_model": embedding_model,
+                        "text_hash": text_hash,
+                        "embedding": Vector(embedding),
+                    }
+                    for text_hash, embedding in embeddings_by_hash.items()
+                ],
+            )
+            _evict_cache_rows(
+                cursor,
+                table="embedding_cache",
+                key_columns="embedding_model, text_hash",
+                max_rows=max_rows,
+            )
+        connection.commit()
+
+
+def load_embedding_sample(*, embedding_model, limit):
+    """Return up to ``limit`` random cached embeddings of a model as an array."""
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = """
+        select embedding
+        from embedding_cache
+        where embedding_model = %s
+        order by random()
+        limit %s;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        register_vector(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, (embedding_model, limit))
+            rows = cursor.fetchall()
+
+    return np.array([embedding for (embedding,) in rows], dtype=np.float32)
+
+
+def start_vision_job(*, document_hash, file_name, page_count, job_version):
+    """Create or resume a vision job and return its completed page texts.
+
+    Pages saved under another ``job_version`` (extractor, vision model, or
+    prompt) are discarded, so they are transcribed again.
+    """
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    stale_pages_query = """
+        delete from vision_job_pages p
+        using vision_jobs j
+        where p.document_hash = j.document_hash
+          and j.document_hash = %s
+          and j.job_version is distinct from %s;
+    """
+
+    job_query = """
+        insert into vision_jobs (
+            document_hash, file_name, page_count, status, job_version
+        )
+        values (
+            %(document_hash)s, %(file_name)s, %(page_count)s, 'running',
+            %(job_version)s
+        )
+        on conflict (document_hash)
+        do update set
+            file_name = excluded.file_name,
+            page_count = excluded.page_count,
+            status = 'running',
+            job_version = excluded.job_version,
+            last_error = null,
+            updated_at = now();
+    """
+
+    pages_query = """
+        select page_number, page_text
+        from vision_job_pages
+        where document_hash = %s
+        order by page_number;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(stale_pages_query, (document_hash, job_version))
+            cursor.execute(
+                job_query,
+                {
+                    "document_hash": document_hash,
+                    "file_name": file_name,
+                    "page_count": page_count,
+                    "job_version": job_version,
+                },
+            )
+            cursor.execute(pages_query, (document_hash,))
+            completed_pages = dict(cursor.fetchall())
+        connection.commit()
+
+    return completed_pages
+
+
+def save_vision_job_page(*, document_hash, page_number, page_text):
+    """Persist one finished page of a vision job as soon as it completes."""
+
+    database_url = get_database_url()
+
+    query = """
+        insert into vision_job_pages (document_hash, page_number, page_text)
+        values (%(document_hash)s, %(page_number)s, %(page_text)s)
+        on conflict (document_hash, page_number)
+        do update set
+            page_text = excluded.page_text,
+            completed_at = now();
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                query,
+                {
+                    "document_hash": document_hash,
+                    "page_number": page_number,
+                    "page_text": page_text,
+                },
+            )
+            cursor.execute(
+                "update vision_jobs set updated_at = now() where document_hash = %s;",
+                (document_hash,),
+            )
+        connection.commit()
+
+
+def finish_vision_job(*, document_hash, status, error=None):
+    """Mark a vision job as completed or failed."""
+
+    database_url = get_database_url()
+
+    query = """
+        update vision_jobs
+        set status = %(status)s,
+            last_error = %(error)s,
+            updated_at = now()
+        where document_hash = %(document_hash)s;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                query,
+                {
+                    "document_hash": document_hash,
+                    "status": status,
+                    "error": error,
+                },
+            )
+        connection.commit()
+
+
+def get_vision_job_progress(document_hash):
+    """Return a vision job's status and page counts, or None."""
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = """
+        select
+            j.status,
+            j.page_count,
+            count(p.page_number),
+            j.last_error
+        from vision_jobs j
+        left join vision_job_pages p
+            on p.document_hash = j.document_hash
+        where j.document_hash = %s
+        group by j.document_hash;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, (document_hash,))
+            row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    status, page_count, completed_page_count, last_error = row
+    return {
+        "status": status,
+        "page_count": page_count,
+        "completed_page_count": completed_page_count,
+        "last_error": last_error,
+    }
+
+
+def chunk_content_hash(chunk):
+    """Return the hash that identifies a chunk's text across re-indexing."""
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def load_document_chunk_state(document_id):
+    """Return stored chunks of a document for incremental re-indexing.
+
+    The result maps each chunk index to its ``content_hash``,
+    ``embedding_model``, ``embedding``, character offsets, and pages. The
+    embedding is None when it is stored projected to fewer dimensions.
+    """
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = f"""
+        select
+            chunk_index,
+            content_hash,
+            embedding_model,
+            {embedding_storage_column()},
+            start_offset,
+            end_offset,
+            page_start,
+            page_end
+        from document_chunks
+        where document_id = %s;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        register_vector(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, (document_id,))
+            rows = cursor.fetchall()
+
+    return {
+        chunk_index: {
+            "content_hash": content_hash,
+            "embedding_model": embedding_model,
+            "embedding": full_embedding_from_storage(embedding),
+            "start_offset": start_offset,
+            "end_offset": end_offset,
+            "page_start": page_start,
+            "page_end": page_end,
+        }
+        for (
+            chunk_index,
+            content_hash,
+            embedding_model,
+            embedding,
+            start_offset,
+            end_offset,
+            page_start,
+            page_end,
+        ) in rows
+    }
+
+
+def delete_document_chunks_from(document_id, chunk_count):
+    """Delete a document's chunks past ``chunk_count``; return how many."""
+
+    database_url = get_database_url()
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    delete from document_chunks
+                    where document_id = %s
+                      and chunk_index >= %s;
+                """,
+                (document_id, chunk_count),
+            )
+            deleted_count = cursor.rowcount
+        connection.commit()
+
+    return deleted_count
+
+
 def save_document_chunks(
     *,
     document_id,
     chunks,
     embeddings,
     embedding_model,
+    start_index=0,
+    chunk_indexes=None,
+    chunk_offsets=None,
+    chunk_pages=None,
 ):
-    """Persist document chunks and their embeddings in PostgreSQL."""
+    """Persist document chunks and their embeddings in PostgreSQL.
+
+    ``start_index`` is the chunk index of the first chunk, so a document can
+    be saved in consecutive batches while it is still being extracted;
+    ``chunk_indexes`` instead gives the index of every chunk, so only changed
+    chunks need to be saved. ``chunk_offsets`` holds ``(start, end)``
+    character offsets into the extracted text and ``chunk_pages``
+    ``(page_start, page_end)`` for each chunk; either may be omitted or
+    contain ``None`` values. Each chunk is stored with its content hash.
+    """
 
     if len(chunks) != len(embeddings):
         raise ValueError(
             "The number of chunks must match the number of embeddings."
         )
 
+    chunk_indexes = chunk_indexes or range(start_index, start_index + len(chunks))
+
+    chunk_offsets = chunk_offsets or [(None, None)] * len(chunks)
+    chunk_pages = chunk_pages or [(None, None)] * len(chunks)
+    if not len(chunk_indexes) == len(chunk_offsets) == len(chunk_pages) == len(chunks):
+        raise ValueError(
+            "Chunk indexes, offsets, and pages must be given for every chunk."
+        )
+
     database_url = get_database_url()
+    apply_schema_updates()
 
-    query = """
+    embedding_column = embedding_storage_column()
+    query = f"""
         insert into document_chunks (
             document_id,
             chunk_index,
             chunk_text,
             character_count,
-            embedding,
-            embedding_model
+            {embedding_column},
+            embedding_model,
+            content_hash,
+            page_start,
+            page_end,
+            start_offset,
+            end_offset
         )
         values (
             %(document_id)s,
@@ -176,77 +905,176 @@ def save_document_chunks(
             %(chunk_text)s,
             %(character_count)s,
             %(embedding)s,
-            %(embedding_model)s
+            %(embedding_model)s,
+            %(content_hash)s,
+            %(page_start)s,
+            %(page_end)s,
+            %(start_offset)s,
+            %(end_offset)s
         )
         on conflict (document_id, chunk_index)
         do update set
             chunk_text = excluded.chunk_text,
             character_count = excluded.character_count,
-            embedding = excluded.embedding,
-            embedding_model = excluded.embedding_model;
+            {embedding_column} = excluded.{embedding_column},
+            embedding_model = excluded.embedding_model,
+            content_hash = excluded.content_hash,
+            page_start = excluded.page_start,
+            page_end = excluded.page_end,
+            start_offset = excluded.start_offset,
+            end_offset = excluded.end_offset;
     """
 
     with psycopg.connect(database_url) as connection:
         register_vector(connection)
 
         with connection.cursor() as cursor:
-            for chunk_index, (chunk, embedding) in enumerate(
-                zip(chunks, embeddings)
-            ):
-                cursor.execute(
-                    query,
+            cursor.executemany(
+                query,
+                [
                     {
                         "document_id": document_id,
                         "chunk_index": chunk_index,
                         "chunk_text": chunk,
                         "character_count": len(chunk),
-                        "embedding": Vector(embedding),
+                        "embedding": to_storage_vector(embedding),
                         "embedding_model": embedding_model,
-                    },
-                )
+                        "content_hash": chunk_content_hash(chunk),
+                        "page_start": page_start,
+                        "page_end": page_end,
+                        "start_offset": start_offset,
+                        "end_offset": end_offset,
+                    }
+                    for (
+                        chunk_index,
+                        chunk,
+                        embedding,
+                        (start_offset, end_offset),
+                        (page_start, page_end),
+                    ) in zip(
+                        chunk_indexes,
+                        chunks,
+                        embeddings,
+                        chunk_offsets,
+                        chunk_pages,
+                    )
+                ],
+            )
 
         connection.commit()
 
 
 def document_has_embeddings(document_id):
-    """Return whether PostgreSQL has an embedded chunk for this document."""
+    """Return whether PostgreSQL has a chunk of this document embedded as searched."""
 
     database_url = get_database_url()
+    apply_schema_updates()
 
-    query = """
+    query = f"""
         select exists (
             select 1
             from document_chunks
             where document_id = %s
-              and embedding is not null
+              and embedding_model = %s
+              and {embedding_storage_column()} is not null
         );
     """
 
     with psycopg.connect(database_url) as connection:
         with connection.cursor() as cursor:
-            cursor.execute(query, (document_id,))
+            cursor.execute(query, (document_id, chunk_embedding_model()))
             return cursor.fetchone()[0]
 
 
+def find_documents_to_backfill(*, embedding_model, limit=None):
+    """Return ``(id, file_name)`` of processed documents that need embedding.
+
+    A document needs embedding when it has no chunks yet, or when any chunk
+    lacks an embedding from ``embedding_model``.
+    """
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = f"""
+        select d.id, d.original_file_name
+        from documents d
+        where d.processing_status = 'processed'
+          and d.extracted_text is not null
+          and (
+              not exists (
+                  select 1
+                  from document_chunks c
+                  where c.document_id = d.id
+              )
+              or exists (
+                  select 1
+                  from document_chunks c
+                  where c.document_id = d.id
+                    and (
+                        c.{embedding_storage_column()} is null
+                        or c.embedding_model is distinct from %(embedding_model)s
+                    )
+              )
+          )
+        order by d.id
+        limit %(limit)s;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                query,
+                {"embedding_model": embedding_model, "limit": limit},
+            )
+            return cursor.fetchall()
+
+
+def load_extracted_text(document_id):
+    """Return the stored extracted text of a document, or None."""
+
+    database_url = get_database_url()
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "select extracted_text from documents where id = %s;",
+                (document_id,),
+            )
+            row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
 def search_document_chunks(
     *,
     document_id,
     query_embedding,
     limit=4,
 ):
-    """Return the document chunks most semantically similar to a query."""
+    """Return the document chunks most semantically similar to a query.
+
+    Rows are ``(chunk_index, chunk_text, similarity, page_start, page_end)``;
+    the pages are None for text without page markers. Only chunks embedded
+    with the current model and storage mode are searched.
+    """
 
     database_url = get_database_url()
+    apply_schema_updates()
 
-    query = """
+    embedding_column = embedding_storage_column()
+    query = f"""
         select
             chunk_index,
             chunk_text,
-            1 - (embedding <=> %(query_embedding)s) as similarity
+            1 - ({embedding_column} <=> %(query_embedding)s) as similarity,
+            page_start,
+            page_end
         from document_chunks
         where document_id = %(document_id)s
-          and embedding is not null
-        order by embedding <=> %(query_embedding)s
+          and embedding_model = %(embedding_model)s
+          and {embedding_column} is not null
+        order by {embedding_column} <=> %(query_embedding)s
         limit %(limit)s;
     """
 
@@ -258,7 +1086,8 @@ def search_document_chunks(
                 query,
                 {
                     "document_id": document_id,
-                    "query_embedding": Vector(query_embedding),
+                    "query_embedding": to_storage_vector(query_embedding),
+                    "embedding_model": chunk_embedding_model(),
                     "limit": limit,
                 },
             )
@@ -267,30 +1096,129 @@ def search_document_chunks(
 
     return rows
 
+
+def load_document_page_chunks(*, document_id, page_number, limit=8):
+    """Return the chunks that cover one page, in chunk order.
+
+    Rows are ``(chunk_index, chunk_text, page_start, page_end)``. This is an
+    indexed lookup, so no query embedding is needed.
+    """
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = """
+        select chunk_index, chunk_text, page_start, page_end
+        from document_chunks
+        where document_id = %(document_id)s
+          and page_start <= %(page_number)s
+          and page_end >= %(page_number)s
+        order by chunk_index
+        limit %(limit)s;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                query,
+                {
+                    "document_id": document_id,
+                    "page_number": page_number,
+                    "limit": limit,
+                },
+            )
+            return cursor.fetchall()
+
+def load_policy_chunk_state(policy_id):
+    """Return ``{chunk_index: {...}}`` of stored policy chunks for re-indexing.
+
+    Each value holds the chunk's ``content_hash``, ``embedding_model``, and
+    ``embedding``; the embedding is None when it is stored projected.
+    """
+
+    database_url = get_database_url()
+    apply_schema_updates()
+
+    query = f"""
+        select chunk_index, content_hash, embedding_model, {embedding_storage_column()}
+        from policy_chunks
+        where policy_id = %s;
+    """
+
+    with psycopg.connect(database_url) as connection:
+        register_vector(connection)
+
+        with connection.cursor() as cursor:
+            cursor.execute(query, (policy_id,))
+            rows = cursor.fetchall()
+
+    return {
+        chunk_index: {
+            "content_hash": content_hash,
+            "embedding_model": embedding_model,
+            "embedding": full_embedding_from_storage(embedding),
+        }
+        for chunk_index, content_hash, embedding_model, embedding in rows
+    }
+
+
+def delete_policy_chunks_from(policy_id, chunk_count):
+    """Delete a policy's chunks past ``chunk_count``; return how many."""
+
+    database_url = get_database_url()
+
+    with psycopg.connect(database_url) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                    delete from policy_chunks
+                    where policy_id = %s
+                      and chunk_index >= %s;
+                """,
+                (policy_id, chunk_count),
+            )
+            deleted_count = cursor.rowcount
+        connection.commit()
+
+    return deleted_count
+
+
 def save_policy_chunks(
     *,
     policy_id,
     chunks,
     embeddings,
     embedding_model,
+    chunk_indexes=None,
 ):
-    """Persist policy chunks and their embeddings in PostgreSQL."""
+    """Persist policy chunks and their embeddings in PostgreSQL.
+
+    ``chunk_indexes`` gives the index of every chunk when only changed chunks
+    are saved; by default chunks are numbered from 0.
+    """
 
     if len(chunks) != len(embeddings):
         raise ValueError(
             "The number of chunks must match the number of embeddings."
         )
 
+    chunk_indexes = chunk_indexes or range(len(chunks))
+    if len(chunk_indexes) != len(chunks):
+        raise ValueError("A chunk index must be given for every chunk.")
+
     database_url = get_database_url()
+    apply_schema_updates()
 
-    query = """
+    embedding_column = embedding_storage_column()
+    query = f"""
         insert into policy_chunks (
             policy_id,
             chunk_index,
             chunk_text,
             character_count,
-            embedding,
-            embedding_model
+            {embedding_column},
+            embedding_model,
+            content_hash
         )
         values (
             %(policy_id)s,
@@ -298,55 +1226,64 @@ def save_policy_chunks(
             %(chunk_text)s,
             %(character_count)s,
             %(embedding)s,
-            %(embedding_model)s
+            %(embedding_model)s,
+            %(content_hash)s
         )
         on conflict (policy_id, chunk_index)
         do update set
             chunk_text = excluded.chunk_text,
             character_count = excluded.character_count,
-            embedding = excluded.embedding,
-            embedding_model = excluded.embedding_model;
+            {embedding_column} = excluded.{embedding_column},
+            embedding_model = excluded.embedding_model,
+            content_hash = excluded.content_hash;
     """
 
     with psycopg.connect(database_url) as connection:
         register_vector(connection)
 
         with connection.cursor() as cursor:
-            for chunk_index, (chunk, embedding) in enumerate(
-                zip(chunks, embeddings)
-            ):
-                cursor.execute(
-                    query,
+            cursor.executemany(
+                query,
+                [
                     {
                         "policy_id": policy_id,
                         "chunk_index": chunk_index,
                         "chunk_text": chunk,
                         "character_count": len(chunk),
-                        "embedding": Vector(embedding),
+                        "embedding": to_storage_vector(embedding),
                         "embedding_model": embedding_model,
-                    },
-                )
+                        "content_hash": chunk_content_hash(chunk),
+                    }
+                    for chunk_index, chunk, embedding in zip(
+                        chunk_indexes,
+                        chunks,
+                        embeddings,
+                    )
+                ],
+            )
 
         connection.commit()
 
 
 def policy_has_embeddings(policy_id):
-    """Return whether PostgreSQL has an embedded chunk for this policy."""
+    """Return whether PostgreSQL has a chunk of this policy embedded as searched."""
 
     database_url = get_database_url()
+    apply_schema_updates()
 
-    query = """
+    query = f"""
         select exists (
             select 1
             from policy_chunks
             where policy_id = %s
-              and embedding is not null
+              and embedding_model = %s
+              and {embedding_storage_column()} is not null
         );
     """
 
     with psycopg.connect(database_url) as connection:
         with connection.cursor() as cursor:
-            cursor.execute(query, (policy_id,))
+            cursor.execute(query, (policy_id, chunk_embedding_model()))
             return cursor.fetchone()[0]
 
 
@@ -359,16 +1296,19 @@ def search_policy_chunks(
     """Return the policy chunks most semantically similar to a query."""
 
     database_url = get_database_url()
+    apply_schema_updates()
 
-    query = """
+    embedding_column = embedding_storage_column()
+    query = f"""
         select
             chunk_index,
             chunk_text,
-            1 - (embedding <=> %(query_embedding)s) as similarity
+            1 - ({embedding_column} <=> %(query_embedding)s) as similarity
         from policy_chunks
         where policy_id = %(policy_id)s
-          and embedding is not null
-        order by embedding <=> %(query_embedding)s
+          and embedding_model = %(embedding_model)s
+          and {embedding_column} is not null
+        order by {embedding_column} <=> %(query_embedding)s
         limit %(limit)s;
     """
 
@@ -380,7 +1320,8 @@ def search_policy_chunks(
                 query,
                 {
                     "policy_id": policy_id,
-                    "query_embedding": Vector(query_embedding),
+                    "query_embedding": to_storage_vector(query_embedding),
+                    "embedding_model": chunk_embedding_model(),
                     "limit": limit,
                 },
             )
@@ -0,0 +1,394 @@
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+
+from database import (
+    chunk_content_hash,
+    delete_document_chunks_from,
+    load_document_chunk_state,
+    save_document_chunks,
+)
+from rag_pipeline import (
+    assemble_extraction,
+    iter_document_pages,
+    section_page_number,
+    split_extracted_sections,
+)
+from vector_store import (
+    chunk_token_statistics,
+    embed_chunks_reusing,
+    embedding_throughput,
+    iter_text_chunks,
+    new_embedding_stats,
+)
+from vector_storage import chunk_embedding_model
+
+
+# Includes the storage mode, so switching it re-embeds stored chunks.
+DOCUMENT_EMBEDDING_MODEL = chunk_embedding_model()
+# Chunks that arrive while the previous batch is being embedded are saved
+# together, up to this many at once. A slow scanned page therefore never
+# holds back chunks that are already available.
+INDEX_BATCH_MAX_CHUNKS = int(os.getenv("INDEX_BATCH_MAX_CHUNKS", "32"))
+
+_END_OF_CHUNKS = object()
+# Sent instead of _END_OF_CHUNKS when extraction fails, so stored chunks past
+# the failure are kept rather than deleted as orphans.
+_ABORTED_CHUNKS = object()
+
+# Stored extractions without embeddings are indexed in the background as
+# soon as they are loaded, so the first question only waits for what is left.
+_background_executor = ThreadPoolExecutor(
+    max_workers=2,
+    thread_name_prefix="saidia-index-job",
+)
+_background_jobs = {}
+
+
+def _new_index_stats():
+    return {
+        "indexed_chunks": 0,
+        "embedded_chunks": 0,
+        "reused_chunks": 0,
+        "unchanged_chunks": 0,
+        "deleted_chunks": 0,
+    }
+
+
+def _is_unchanged(stored_chunk, chunk_record, content_hash):
+    """Return whether a stored row already holds exactly this chunk.
+
+    Policy chunks have no offsets or pages, so for them only the content hash
+    and embedding model are compared.
+    """
+    return stored_chunk is not None and (
+        stored_chunk["content_hash"] == content_hash
+        and stored_chunk["embedding_model"] == DOCUMENT_EMBEDDING_MODEL
+        and stored_chunk.get("start_offset") == chunk_record.get("start")
+        and stored_chunk.get("end_offset") == chunk_record.get("end")
+        and stored_chunk.get("page_start") == chunk_record.get("page_start")
+        and stored_chunk.get("page_end") == chunk_record.get("page_end")
+    )
+
+
+def reusable_chunk_embeddings(stored_chunks):
+    """Map content hashes of stored chunks to embeddings that can be reused."""
+    return {
+        stored_chunk["content_hash"]: stored_chunk["embedding"]
+        for stored_chunk in stored_chunks.values()
+        if stored_chunk["content_hash"]
+        and stored_chunk["embedding_model"] == DOCUMENT_EMBEDDING_MODEL
+        and stored_chunk["embedding"] is not None
+    }
+
+
+def changed_chunk_records(chunk_records, stored_chunks, start_index=0):
+    """Return ``(chunk_index, record, content_hash)`` for chunks to save again.
+
+    ``chunk_records`` are numbered from ``start_index`` and need only a
+    ``text``. Records whose stored row already holds the same chunk are left
+    out.
+    """
+    changed_records = []
+    for chunk_index, chunk_record in enumerate(chunk_records, start_index):
+        content_hash = chunk_content_hash(chunk_record["text"])
+        if not _is_unchanged(
+            stored_chunks.get(chunk_index),
+            chunk_record,
+            content_hash,
+        ):
+            changed_records.append((chunk_index, chunk_record, content_hash))
+    return changed_records
+
+
+def _embed_and_save_chunks(
+    chunk_queue,
+    document_id,
+    max_batch_chunks,
+    index_stats,
+    embedding_stats,
+):
+    """Embed and save queued chunks in batches until the end marker arrives.
+
+    Re-indexing is incremental: rows that already hold the same chunk are
+    left alone, chunks whose text was embedded before with the same model
+    reuse that embedding, and rows past the new last chunk are deleted. When
+    the abort marker arrives instead, nothing more is saved or deleted.
+    """
+    stored_chunks = load_document_chunk_state(document_id)
+    reusable_embeddings = reusable_chunk_embeddings(stored_chunks)
+    chunk_index = 0
+    finished = False
+
+    while not finished:
+        batch = [chunk_queue.get()]
+        while len(batch) < max_batch_chunks and batch[-1] not in (
+            _END_OF_CHUNKS,
+            _ABORTED_CHUNKS,
+        ):
+            try:
+                batch.append(chunk_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if batch[-1] is _ABORTED_CHUNKS:
+            return
+        if batch[-1] is _END_OF_CHUNKS:
+            batch.pop()
+            finished = True
+
+        changed_records = changed_chunk_records(batch, stored_chunks, chunk_index)
+        index_stats["unchanged_chunks"] += len(batch) - len(changed_records)
+        chunk_index += len(batch)
+
+        if not changed_records:
+            index_stats["indexed_chunks"] = chunk_index
+            continue
+
+        chunk_texts = [record["text"] for _, record, _ in changed_records]
+        embeddings, embedded_count = embed_chunks_reusing(
+            chunk_texts,
+            [content_hash for _, _, content_hash in changed_records],
+            reusable_embeddings,
+            embedding_stats=embedding_stats,
+        )
+        save_changed_chunks(document_id, changed_records, embeddings)
+        index_stats["embedded_chunks"] += embedded_count
+        index_stats["reused_chunks"] += len(changed_records) - embedded_count
+        index_stats["indexed_chunks"] = chunk_index
+
+    if any(stored_index >= chunk_index for stored_index in stored_chunks):
+        index_stats["deleted_chunks"] = delete_document_chunks_from(
+            document_id,
+            chunk_index,
+        )
+
+
+def save_changed_chunks(document_id, changed_records, embeddings):
+    """Save the chunks returned by ``changed_chunk_records`` with embeddings."""
+    save_document_chunks(
+        document_id=document_id,
+        chunks=[record["text"] for _, record, _ in changed_records],
+        embeddings=embeddings,
+        embedding_model=DOCUMENT_EMBEDDING_MODEL,
+        chunk_indexes=[chunk_index for chunk_index, _, _ in changed_records],
+        chunk_offsets=[
+            (record["start"], record["end"]) for _, record, _ in changed_records
+        ],
+        chunk_pages=[
+            (record["page_start"], record["page_end"])
+            for _, record, _ in changed_records
+        ],
+    )
+
+
+def _chunk_pages(section_starts, section_pages, start, end):
+    """Return ``(page_start, page_end)`` of the sections a chunk overlaps."""
+    first_section = bisect_right(section_starts, start) - 1
+    last_section = bisect_right(section_starts, end - 1) - 1
+    pages = [
+        page_number
+        for page_number in section_pages[first_section : last_section + 1]
+        if page_number is not None
+    ]
+    if not pages:
+        return None, None
+    return min(pages), max(pages)
+
+
+def iter_chunk_records(pages):
+    """Chunk text sections as they arrive and yield one record per chunk.
+
+    Each record holds the chunk ``text``, its ``start`` and ``end`` offsets
+    into the sections joined as ``process_document`` joins them, and the
+    ``page_start`` and ``page_end`` of the ``[Page N]`` sections it overlaps
+    (None for text without page markers).
+    """
+    section_starts = []
+    section_pages = []
+
+    def tracked_pages():
+        section_start = 0
+        for page in pages:
+            section_starts.append(section_start)
+            section_pages.append(section_page_number(page))
+            section_start += len(page) + len("\n\n")
+            yield page
+
+    for chunk in iter_text_chunks(tracked_pages(), separator="\n\n"):
+        page_start, page_end = _chunk_pages(
+            section_starts,
+            section_pages,
+            chunk.start,
+            chunk.end,
+        )
+        yield {
+            "text": chunk.text,
+            "start": chunk.start,
+            "end": chunk.end,
+            "page_start": page_start,
+            "page_end": page_end,
+        }
+
+
+def index_document_pages(
+    pages,
+    *,
+    document_id,
+    max_batch_chunks=None,
+    index_stats=None,
+    embedding_stats=None,
+):
+    """Chunk, embed, and save pages while they are still being produced.
+
+    ``pages`` is any iterable of text sections, normally
+    ``iter_document_pages``. Chunking runs in the calling thread while a
+    single indexing thread embeds and saves each batch, so early pages are
+    searchable before the last page is extracted.
+
+    Returns the records of ``iter_chunk_records`` in chunk-index order. Counts of
+    embedded, reused, unchanged, and deleted chunks are added to
+    ``index_stats`` when a dictionary is supplied, and encoding counters to
+    ``embedding_stats``.
+    """
+    if index_stats is None:
+        index_stats = {}
+    index_stats.update(_new_index_stats())
+    chunk_queue = queue.Queue()
+    chunk_records = []
+
+    with ThreadPoolExecutor(
+        max_workers=1,
+        thread_name_prefix="saidia-index",
+    ) as executor:
+        indexer = executor.submit(
+            _embed_and_save_chunks,
+            chunk_queue,
+            document_id,
+            max_batch_chunks or INDEX_BATCH_MAX_CHUNKS,
+            index_stats,
+            embedding_stats,
+        )
+        try:
+            for chunk_record in iter_chunk_records(pages):
+                if indexer.done():
+                    # The indexer failed; its error is raised below.
+                    break
+                chunk_records.append(chunk_record)
+                chunk_queue.put(chunk_record)
+        except BaseException:
+            chunk_queue.put(_ABORTED_CHUNKS)
+            raise
+        chunk_queue.put(_END_OF_CHUNKS)
+        indexer.result()
+
+    return chunk_records
+
+
+def process_and_index_document(
+    source,
+    *,
+    document_id,
+    file_name=None,
+    vision_checkpoint=None,
+    max_vision_pages=None,
+):
+    """Extract a document and index its pages as they are extracted.
+
+    Returns the ``process_document`` result plus the saved ``chunks``, their
+    ``chunk_offsets`` as ``(start, end)`` character offsets into the text,
+    and their ``chunk_pages`` as ``(page_start, page_end)``, for citations.
+    The metadata also records ``chunk_token_stats``, ``chunk_index_stats``,
+    and the ``embedding_throughput`` of this document's encoding.
+    """
+    metadata = {}
+    sections = []
+
+    def extracted_sections():
+        for section in iter_document_pages(
+            source,
+            file_name=file_name,
+            vision_checkpoint=vision_checkpoint,
+            max_vision_pages=max_vision_pages,
+            metadata=metadata,
+        ):
+            sections.append(section)
+            yield section
+
+    index_stats = {}
+    embedding_stats = new_embedding_stats()
+    chunk_records = index_document_pages(
+        extracted_sections(),
+        document_id=document_id,
+        index_stats=index_stats,
+        embedding_stats=embedding_stats,
+    )
+    result = assemble_extraction(sections, metadata)
+    result["chunks"] = [record["text"] for record in chunk_records]
+    result["chunk_offsets"] = [
+        (record["start"], record["end"]) for record in chunk_records
+    ]
+    result["chunk_pages"] = [
+        (record["page_start"], record["page_end"]) for record in chunk_records
+    ]
+    result["metadata"]["chunk_token_stats"] = chunk_token_statistics(
+        result["chunks"]
+    )
+    result["metadata"]["chunk_index_stats"] = index_stats
+    result["metadata"]["embedding_throughput"] = embedding_throughput(
+        embedding_stats
+    )
+    return result
+
+
+def start_background_indexing(text, *, document_id):
+    """Index stored extracted text in a background thread and return its future.
+
+    The future resolves to the chunk records of ``index_document_pages``.
+    A job that is still running for the same document is returned instead of
+    starting a second one. Finished jobs nobody waited for are forgotten.
+    """
+    running_job = _background_jobs.get(document_id)
+    if running_job is not None and not running_job["future"].done():
+        return running_job["future"]
+
+    for finished_id, job in list(_background_jobs.items()):
+        if job["future"].done():
+            _background_jobs.pop(finished_id, None)
+
+    index_stats = _new_index_stats()
+    future = _background_executor.submit(
+        index_document_pages,
+        split_extracted_sections(text),
+        document_id=document_id,
+        index_stats=index_stats,
+    )
+    _background_jobs[document_id] = {"future": future, "index_stats": index_stats}
+    return future
+
+
+def background_indexing_progress(document_id):
+    """Return ``(indexed_chunks, done)`` for a background job, or None."""
+    job = _background_jobs.get(document_id)
+    if job is None:
+        return None
+    return job["index_stats"]["indexed_chunks"], job["future"].done()
+
+
+def wait_for_background_indexing(document_id):
+    """Wait for a document's background indexing job and return its stats.
+
+    Returns None when no job is pending. The job is forgotten once its result
+    is read, and a failed job raises its error, so the next call to
+    ``start_background_indexing`` retries.
+    """
+    job = _background_jobs.get(document_id)
+    if job is None:
+        return None
+    try:
+        job["future"].result()
+    finally:
+        if _background_jobs.get(document_id) is job:
+            _background_jobs.pop(document_id, None)
+    return job["index_stats"]
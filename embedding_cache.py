@@ -0,0 +1,95 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import unicodedata
+
+
+# Boilerplate such as terms footers, claim forms, and policy disclaimers
+# repeats across documents. Embeddings are cached by model and normalised
+# chunk text: first in this process, then in a PostgreSQL table shared by
+# every app process, the indexing scripts, and later deploys.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "20000"))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "500000"))
+EMBEDDING_CACHE_USE_DATABASE = os.getenv("EMBEDDING_CACHE_USE_DATABASE", "1") != "0"
+
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def embedding_text_hash(text):
+    """Return the cache hash of a chunk after normalising its whitespace.
+
+    The tokenizer ignores how words are spaced and wrapped, so copies of the
+    same text that only differ in line breaks share one embedding.
+    """
+    normalised_text = " ".join(unicodedata.normalize("NFC", text).split())
+    return hashlib.sha256(normalised_text.encode("utf-8")).hexdigest()
+
+
+def _read_memory_entries(embedding_model, text_hashes):
+    found = {}
+    with _memory_lock:
+        for text_hash in text_hashes:
+            embedding = _memory_cache.get((embedding_model, text_hash))
+            if embedding is not None:
+                _memory_cache.move_to_end((embedding_model, text_hash))
+                found[text_hash] = embedding
+    return found
+
+
+def _write_memory_entries(embedding_model, embeddings_by_hash):
+    with _memory_lock:
+        for text_hash, embedding in embeddings_by_hash.items():
+            _memory_cache[(embedding_model, text_hash)] = embedding
+            _memory_cache.move_to_end((embedding_model, text_hash))
+        while len(_memory_cache) > EMBEDDING_CACHE_MAX_ENTRIES:
+            _memory_cache.popitem(last=False)
+
+
+def read_cached_embeddings(embedding_model, text_hashes):
+    """Return ``{text_hash: embedding}`` for the hashes cached for the model."""
+    text_hashes = set(text_hashes)
+    found = _read_memory_entries(embedding_model, text_hashes)
+    missing_hashes = text_hashes - found.keys()
+
+    if not missing_hashes or not EMBEDDING_CACHE_USE_DATABASE:
+        return found
+
+    try:
+        from database import find_cached_embeddings
+
+        stored = find_cached_embeddings(
+            embedding_model=embedding_model,
+            text_hashes=missing_hashes,
+        )
+    except Exception as exc:
+        # The database tier is optional; a miss only costs an encode call.
+        print("Embedding cache lookup failed:", type(exc).__name__)
+        return found
+
+    _write_memory_entries(embedding_model, stored)
+    found.update(stored)
+    return found
+
+
+def store_embeddings(embedding_model, embeddings_by_hash):
+    """Cache new embeddings in memory and, when configured, PostgreSQL."""
+    if not embeddings_by_hash:
+        return
+
+    _write_memory_entries(embedding_model, embeddings_by_hash)
+
+    if not EMBEDDING_CACHE_USE_DATABASE:
+        return
+
+    try:
+        from database import save_cached_embeddings
+
+        save_cached_embeddings(
+            embedding_model=embedding_model,
+            embeddings_by_hash=embeddings_by_hash,
+            max_rows=EMBEDDING_CACHE_MAX_ROWS,
+        )
+    except Exception as exc:
+        print("Embedding cache write failed:", type(exc).__name__)
@@ -0,0 +1,145 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+import os
+
+import numpy as np
+
+
+# Bulk backfills embed on a pool of processes that each load the model once.
+# Chunks are sent in shards, so one long document is spread over every worker
+# and many short policies share a shard.
+EMBEDDING_POOL_WORKERS = int(
+    os.getenv("EMBEDDING_POOL_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+EMBEDDING_POOL_SHARD_CHUNKS = int(os.getenv("EMBEDDING_POOL_SHARD_CHUNKS", "256"))
+# Shards waiting for a worker are bounded so results are written to the
+# database while later jobs are still being read and chunked.
+_SHARDS_IN_FLIGHT_PER_WORKER = 2
+
+
+def _initialize_worker(thread_count):
+    """Worker initializer: split the CPU cores between the workers.
+
+    The limits are set before the model is imported, so PyTorch or ONNX
+    Runtime in each worker does not start one thread per core.
+    """
+    os.environ["OMP_NUM_THREADS"] = str(thread_count)
+    os.environ["ONNX_INTRA_OP_THREADS"] = str(thread_count)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+def _embed_shard(chunks):
+    """Worker entry point: embed one shard and return its encoding counters."""
+    from vector_store import embed_chunks, new_embedding_stats
+
+    embedding_stats = new_embedding_stats()
+    embeddings = embed_chunks(chunks, embedding_stats=embedding_stats)
+    return embeddings, embedding_stats
+
+
+def _iter_shards(jobs, shard_chunks, part_counts):
+    """Pack ``(key, chunks)`` jobs into shards of up to ``shard_chunks`` chunks.
+
+    Each shard is a list of ``(key, part_index, chunks)`` parts. The number
+    of parts of every job is recorded in ``part_counts`` before its first
+    part is yielded.
+    """
+    shard = []
+    shard_size = 0
+    for key, chunks in jobs:
+        chunks = list(chunks)
+        parts = [
+            chunks[start : start + shard_chunks]
+            for start in range(0, len(chunks), shard_chunks)
+        ] or [[]]
+        part_counts[key] = len(parts)
+        for part_index, part in enumerate(parts):
+            if shard and shard_size + len(part) > shard_chunks:
+                yield shard
+                shard = []
+                shard_size = 0
+            shard.append((key, part_index, part))
+            shard_size += len(part)
+    if shard:
+        yield shard
+
+
+def iter_pool_embeddings(
+    jobs,
+    *,
+    max_workers=None,
+    shard_chunks=None,
+    embedding_stats=None,
+):
+    """Embed ``(key, chunks)`` jobs on a process pool; yield ``(key, embeddings)``.
+
+    Each job is yielded as soon as all of its chunks are embedded, with a
+    float32 array in chunk order, so callers can write it to the database
+    while later shards are still being encoded. Encoding counters of every
+    worker are added to ``embedding_stats`` when a dictionary is supplied.
+    With one worker, shards are embedded in this process.
+    """
+    worker_count = max(1, max_workers or EMBEDDING_POOL_WORKERS)
+    part_counts = {}
+    received_parts = {}
+    shards = _iter_shards(jobs, shard_chunks or EMBEDDING_POOL_SHARD_CHUNKS, part_counts)
+
+    def finished_jobs(shard, embeddings, shard_stats):
+        if embedding_stats is not None:
+            for name, value in shard_stats.items():
+                embedding_stats[name] += value
+        position = 0
+        for key, part_index, part in shard:
+            parts = received_parts.setdefault(key, {})
+            parts[part_index] = embeddings[position : position + len(part)]
+            position += len(part)
+            if len(parts) == part_counts[key]:
+                del received_parts[key]
+                arrays = [
+                    np.asarray(parts[index], dtype=np.float32)
+                    for index in range(len(parts))
+                    if len(parts[index])
+                ]
+                yield key, (
+                    np.concatenate(arrays)
+                    if arrays
+                    else np.empty((0, 0), dtype=np.float32)
+                )
+
+    def shard_chunks_of(shard):
+        return [chunk for _, _, part in shard for chunk in part]
+
+    if worker_count == 1:
+        for shard in shards:
+            chunks = shard_chunks_of(shard)
+            if chunks:
+                yield from finished_jobs(shard, *_embed_shard(chunks))
+            else:
+                yield from finished_jobs(shard, [], {})
+        return
+
+    cpu_count = os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=worker_count,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_initialize_worker,
+        initargs=(max(1, cpu_count // worker_count),),
+    ) as executor:
+        running = {}
+        for shard in shards:
+            chunks = shard_chunks_of(shard)
+            if not chunks:
+                yield from finished_jobs(shard, [], {})
+                continue
+
+            running[executor.submit(_embed_shard, chunks)] = shard
+            if len(running) < worker_count * _SHARDS_IN_FLIGHT_PER_WORKER:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from finished_jobs(running.pop(future), *future.result())
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from finished_jobs(running.pop(future), *future.result())
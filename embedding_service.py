@@ -0,0 +1,333 @@
+import argparse
+from concurrent.futures import Future
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+
+# Several app processes on one host can share one embedding model through a
+# local server: "http://127.0.0.1:8765" or "unix:///tmp/saidia-embedding.sock".
+# Requests that arrive within the micro-batching window are encoded together.
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "")
+EMBEDDING_SERVICE_BATCH_WINDOW_MS = float(
+    os.getenv("EMBEDDING_SERVICE_BATCH_WINDOW_MS", "5")
+)
+EMBEDDING_SERVICE_MAX_BATCH = int(os.getenv("EMBEDDING_SERVICE_MAX_BATCH", "64"))
+EMBEDDING_SERVICE_TIMEOUT_SECONDS = float(
+    os.getenv("EMBEDDING_SERVICE_TIMEOUT_SECONDS", "60")
+)
+DEFAULT_EMBEDDING_SERVICE_URL = "http://127.0.0.1:8765"
+
+
+def _parse_service_url(url):
+    """Return ``("unix", socket_path)`` or ``("http", (host, port))``."""
+    parts = urlsplit(url)
+    if parts.scheme == "unix":
+        return "unix", parts.path
+    if parts.scheme == "http" and parts.hostname:
+        return "http", (parts.hostname, parts.port or 80)
+    raise ValueError(
+        "EMBEDDING_SERVICE_URL must look like http://127.0.0.1:8765 "
+        "or unix:///path/to/socket."
+    )
+
+
+class MicroBatcher:
+    """Encode texts from concurrent requests together on one model.
+
+    A single thread owns the model. After the first waiting request it
+    collects more for up to ``window_seconds``, or until ``max_batch`` texts
+    are waiting, then encodes them all in one call sorted by length.
+    """
+
+    def __init__(self, model, *, window_seconds, max_batch):
+        self._model = model
+        self._window_seconds = window_seconds
+        self._max_batch = max_batch
+        self._requests = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "texts": 0,
+            "encode_seconds": 0.0,
+        }
+        threading.Thread(
+            target=self._run,
+            name="saidia-embedding-batcher",
+            daemon=True,
+        ).start()
+
+    def encode(self, texts):
+        """Return float32 embeddings of ``texts``, waiting for their batch."""
+        future = Future()
+        self._requests.put((list(texts), future))
+        return future.result()
+
+    def stats(self):
+        """Return request, batch, and text counts with the mean batch size."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["encode_seconds"] = round(stats["encode_seconds"], 3)
+        stats["mean_batch_texts"] = (
+            round(stats["texts"] / stats["batches"], 1) if stats["batches"] else 0
+        )
+        return stats
+
+    def _collect_batch(self):
+        batch = [self._requests.get()]
+        text_count = len(batch[0][0])
+        deadline = time.monotonic() + self._window_seconds
+        while text_count < self._max_batch:
+            remaining_seconds = deadline - time.monotonic()
+            if remaining_seconds <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining_seconds)
+            except queue.Empty:
+                break
+            batch.append(request)
+            text_count += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                started_at = time.perf_counter()
+                embeddings = self._encode(texts)
+                encode_seconds = time.perf_counter() - started_at
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+
+            with self._stats_lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["texts"] += len(texts)
+                self._stats["encode_seconds"] += encode_seconds
+
+            offset = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[offset : offset + len(request_texts)])
+                offset += len(request_texts)
+
+    def _encode(self, texts):
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # Texts from different requests are sorted by length so each model
+        # batch pads to similar lengths.
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        sorted_embeddings = np.asarray(
+            self._model.encode(
+                [texts[index] for index in order],
+                batch_size=self._max_batch,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            ),
+            dtype=np.float32,
+        )
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+
+class _EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    """``POST /embed`` with ``{"texts": [...]}``; ``GET /stats``; ``GET /health``.
+
+    Embeddings are returned as raw float32 rows, with the dimension count in
+    the ``X-Embedding-Dimensions`` header.
+    """
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json({"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(self.server.batcher.stats())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path != "/embed":
+            self.send_error(404)
+            return
+
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(content_length))["texts"]
+            if not all(isinstance(text, str) for text in texts):
+                raise ValueError("texts must be strings")
+        except (KeyError, TypeError, ValueError):
+            self.send_error(400, "Expected a JSON body with a list of texts.")
+            return
+
+        try:
+            embeddings = self.server.batcher.encode(texts)
+        except Exception as exc:
+            print("Embedding request failed:", type(exc).__name__)
+            self.send_error(500, "The embedding model failed to encode the texts.")
+            return
+
+        body = np.ascontiguousarray(embeddings, dtype="<f4").tobytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Embedding-Dimensions", str(embeddings.shape[1]))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Per-request lines would flood the log; errors are printed above.
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # Unix sockets have no peer address, which request handlers expect.
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+def create_embedding_server(
+    url,
+    model,
+    *,
+    window_seconds=None,
+    max_batch=None,
+):
+    """Create an embedding server for ``url`` that encodes with ``model``.
+
+    Call ``serve_forever()`` on the result to start answering requests. A
+    stale Unix socket file left by a stopped server is replaced.
+    """
+    if window_seconds is None:
+        window_seconds = EMBEDDING_SERVICE_BATCH_WINDOW_MS / 1000
+    transport, address = _parse_service_url(url)
+    if transport == "unix":
+        if os.path.exists(address):
+            os.unlink(address)
+        server = _UnixHTTPServer(address, _EmbeddingRequestHandler)
+    else:
+        server = ThreadingHTTPServer(address, _EmbeddingRequestHandler)
+        server.daemon_threads = True
+
+    server.batcher = MicroBatcher(
+        model,
+        window_seconds=window_seconds,
+        max_batch=max_batch or EMBEDDING_SERVICE_MAX_BATCH,
+    )
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+class EmbeddingServiceClient:
+    """A drop-in for the ``encode`` calls made on the SentenceTransformer model.
+
+    Every call is one request to the local embedding server, which batches
+    it with requests from other app processes.
+    """
+
+    def __init__(self, url=None, timeout=None):
+        self._transport, self._address = _parse_service_url(
+            url or EMBEDDING_SERVICE_URL
+        )
+        self._timeout = timeout or EMBEDDING_SERVICE_TIMEOUT_SECONDS
+
+    def _connect(self):
+        if self._transport == "unix":
+            return _UnixHTTPConnection(self._address, self._timeout)
+        host, port = self._address
+        return http.client.HTTPConnection(host, port, timeout=self._timeout)
+
+    def encode(self, sentences, batch_size=32, **_kwargs):
+        """Return float32 embeddings; one row per sentence, or one vector for a string."""
+        single_sentence = isinstance(sentences, str)
+        if single_sentence:
+            sentences = [sentences]
+
+        connection = self._connect()
+        try:
+            connection.request(
+                "POST",
+                "/embed",
+                body=json.dumps({"texts": list(sentences)}),
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            body = response.read()
+        except OSError as exc:
+            raise RuntimeError(
+                "The local embedding service is not reachable. Start it with "
+                "`python embedding_service.py` or unset EMBEDDING_SERVICE_URL."
+            ) from exc
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise RuntimeError(
+                f"The local embedding service failed with HTTP {response.status}."
+            )
+
+        dimensions = int(response.getheader("X-Embedding-Dimensions", "0"))
+        embeddings = np.frombuffer(body, dtype="<f4").astype(np.float32)
+        embeddings = embeddings.reshape(len(sentences), dimensions)
+        return embeddings[0] if single_sentence else embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the embedding model to every app process on this host.",
+    )
+    parser.add_argument(
+        "--url",
+        default=EMBEDDING_SERVICE_URL or DEFAULT_EMBEDDING_SERVICE_URL,
+        help="http://host:port or unix:///path/to/socket to listen on.",
+    )
+    arguments = parser.parse_args()
+
+    from qa_engine import load_local_embedding_model
+
+    server = create_embedding_server(arguments.url, load_local_embedding_model())
+    print(f"Serving embeddings on {arguments.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Embedding service stopped:", server.batcher.stats())
+
+
+if __name__ == "__main__":
+    main()
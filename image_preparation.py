@@ -0,0 +1,276 @@
+import os
+
+import numpy as np
+
+from lazy_imports import LazyModule
+
+fitz = LazyModule("fitz")  # PyMuPDF
+
+
+# OpenAI high-detail vision fits an image inside 2048 x 2048 pixels and then
+# scales its shortest side to 768 pixels. Larger payloads only add upload time.
+VISION_TARGET_SHORT_SIDE = int(os.getenv("VISION_TARGET_SHORT_SIDE", "768"))
+VISION_MAX_LONG_SIDE = int(os.getenv("VISION_MAX_LONG_SIDE", "2048"))
+# Small pages such as receipts are enlarged, but never beyond this factor.
+MAX_RENDER_SCALE = 4.0
+JPEG_QUALITY = 85
+
+# Page checks run on a greyscale render large enough to keep a one-line
+# signature or a changed amount visible, but far cheaper than a vision call.
+PAGE_CHECK_LONG_SIDE = 1024
+INK_LEVEL = 128
+# Fewer dark pixels than this share of the page means a blank page; a lone
+# page number stays below it, while a one-line signature does not.
+BLANK_PAGE_MAX_INK_RATIO = 0.00005
+DUPLICATE_HASH_MAX_DISTANCE = 4
+# Hash cells whose neighbours differ by less than this many grey levels are
+# blank paper, where scanner noise alone decides the gradient bit.
+HASH_MIN_CONTRAST = 1.0
+# Rescans of one page are offset by a pixel or two and re-rasterised, so
+# pages are compared after aligning them, allowing sub-pixel shifts.
+DUPLICATE_MAX_OFFSET = 2
+# On the blurred thumbnails, an aligned rescan differs by faint
+# anti-aliasing of about 20 grey levels, while a changed digit in a
+# filled-in form leaves a stroke difference of 70 or more.
+DUPLICATE_MAX_PIXEL_DIFFERENCE = 40
+
+
+def render_scale_for_size(width, height):
+    """Return the scale that maps a page or image to the model's resolution."""
+    short_side = min(width, height)
+    long_side = max(width, height)
+    if short_side <= 0:
+        return 1.0
+
+    return min(
+        VISION_TARGET_SHORT_SIDE / short_side,
+        VISION_MAX_LONG_SIDE / long_side,
+        MAX_RENDER_SCALE,
+    )
+
+
+def _encode_smallest(pixmap):
+    """Return ``(image_bytes, mime_type, png_size)`` for the smaller encoding.
+
+    Bilevel scans usually compress best as lossless PNG, while photos and
+    greyscale scans are much smaller as JPEG, so both are tried.
+    """
+    png_bytes = pixmap.tobytes("png")
+    jpeg_bytes = pixmap.tobytes("jpg", jpg_quality=JPEG_QUALITY)
+
+    if len(jpeg_bytes) < len(png_bytes):
+        return jpeg_bytes, "image/jpeg", len(png_bytes)
+    return png_bytes, "image/png", len(png_bytes)
+
+
+def prepare_pdf_page(page):
+    """Render one PDF page for vision at a scale chosen from its physical size.
+
+    Returns ``(image_bytes, mime_type, stats)``. ``bytes_before`` is the
+    lossless PNG size of the render and ``bytes_after`` the payload sent.
+    """
+    scale = render_scale_for_size(page.rect.width, page.rect.height)
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    image_bytes, mime_type, png_size = _encode_smallest(pixmap)
+
+    return image_bytes, mime_type, {
+        "bytes_before": png_size,
+        "bytes_after": len(image_bytes),
+    }
+
+
+def prepare_uploaded_image(image_bytes, mime_type):
+    """Downsample an oversized upload and re-encode it only when smaller.
+
+    Returns ``(image_bytes, mime_type, stats)`` where ``bytes_before`` is the
+    original upload size.
+    """
+    pixmap = fitz.Pixmap(image_bytes)
+    if pixmap.colorspace is None or pixmap.colorspace.n not in (1, 3):
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+
+    scale = render_scale_for_size(pixmap.width, pixmap.height)
+    if scale < 1:
+        pixmap = fitz.Pixmap(
+            pixmap,
+            max(1, round(pixmap.width * scale)),
+            max(1, round(pixmap.height * scale)),
+            None,
+        )
+        prepared_bytes, prepared_mime_type, _ = _encode_smallest(pixmap)
+        if len(prepared_bytes) >= len(image_bytes):
+            prepared_bytes, prepared_mime_type = image_bytes, mime_type
+    else:
+        # Re-encoding an image that is already small enough rarely helps a
+        # JPEG, but a large PNG photo can still shrink considerably.
+        prepared_bytes, prepared_mime_type = image_bytes, mime_type
+        if mime_type == "image/png":
+            jpeg_bytes = pixmap.tobytes("jpg", jpg_quality=JPEG_QUALITY)
+            if len(jpeg_bytes) < len(image_bytes):
+                prepared_bytes, prepared_mime_type = jpeg_bytes, "image/jpeg"
+
+    return prepared_bytes, prepared_mime_type, {
+        "bytes_before": len(image_bytes),
+        "bytes_after": len(prepared_bytes),
+    }
+
+
+def page_thumbnail(page):
+    """Render a greyscale thumbnail used for blank and duplicate checks."""
+    scale = PAGE_CHECK_LONG_SIDE / max(page.rect.width, page.rect.height, 1)
+    pixmap = page.get_pixmap(
+        matrix=fitz.Matrix(scale, scale),
+        colorspace=fitz.csGRAY,
+        alpha=False,
+    )
+    samples = np.frombuffer(pixmap.samples, dtype=np.uint8)
+    return samples.reshape(pixmap.height, pixmap.stride)[:, : pixmap.width]
+
+
+def is_blank_page(thumbnail):
+    """Return whether a page thumbnail has practically no ink."""
+    return float(np.mean(thumbnail < INK_LEVEL)) < BLANK_PAGE_MAX_INK_RATIO
+
+
+def perceptual_hash(thumbnail):
+    """Return a 256-bit difference hash of a page thumbnail and its cell mask.
+
+    The mask marks the gradient bits taken where the page has contrast, so
+    noise on blank paper does not count towards the hash distance.
+    """
+    row_groups = np.array_split(np.arange(thumbnail.shape[0]), 16)
+    column_groups = np.array_split(np.arange(thumbnail.shape[1]), 17)
+    grid = np.array(
+        [
+            [thumbnail[np.ix_(rows, columns)].mean() for columns in column_groups]
+            for rows in row_groups
+        ]
+    )
+    gradients = grid[:, 1:] - grid[:, :-1]
+    page_hash = 0
+    contrast_mask = 0
+    for gradient in gradients.flat:
+        page_hash = (page_hash << 1) | int(gradient > 0)
+        contrast_mask = (contrast_mask << 1) | int(abs(gradient) >= HASH_MIN_CONTRAST)
+    return page_hash, contrast_mask
+
+
+def _hash_distance(page_hash, other_hash):
+    (bits, mask), (other_bits, other_mask) = page_hash, other_hash
+    return bin((bits ^ other_bits) & (mask | other_mask)).count("1")
+
+
+def may_be_duplicate(page_hash, other_hash):
+    """Return whether two page hashes are close enough to compare the pages."""
+    return _hash_distance(page_hash, other_hash) <= DUPLICATE_HASH_MAX_DISTANCE
+
+
+def _box_blur(image):
+    """Return a 3 x 3 box blur of ``image`` as float32, to soften scan noise."""
+    padded = np.pad(image.astype(np.float32), 1, mode="edge")
+    height, width = image.shape
+    blurred = sum(
+        padded[row : row + height, column : column + width]
+        for row in range(3)
+        for column in range(3)
+    )
+    return blurred / 9
+
+
+def _shifted_values(padded, rows, columns, half_rows, half_columns):
+    """Return ``padded`` sampled at pixels moved by half-pixel offsets.
+
+    ``rows`` and ``columns`` index the unpadded image; half-pixel positions
+    average their two or four neighbouring pixels.
+    """
+    margin = DUPLICATE_MAX_OFFSET + 2
+    row_offsets = {half_rows // 2, (half_rows + 1) // 2}
+    column_offsets = {half_columns // 2, (half_columns + 1) // 2}
+    return sum(
+        padded[rows + margin + row_offset, columns + margin + column_offset]
+        for row_offset in row_offsets
+        for column_offset in column_offsets
+    ) / (len(row_offsets) * len(column_offsets))
+
+
+def _has_unmatched_pixel(image, reference):
+    """Return whether a pixel of ``image`` matches no nearby ``reference`` pixel.
+
+    ``reference`` is first aligned by the whole-pixel offset with the
+    smallest mean difference. Pixels that still differ may then match within
+    one more pixel in half-pixel steps, which absorbs re-rasterised strokes.
+    """
+    margin = DUPLICATE_MAX_OFFSET + 2
+    padded = np.pad(reference, margin, mode="edge")
+    height, width = image.shape
+    offsets = range(-DUPLICATE_MAX_OFFSET, DUPLICATE_MAX_OFFSET + 1)
+    # Every other row is enough to find the offset of a whole page.
+    row_offset, column_offset = min(
+        ((row, column) for row in offsets for column in offsets),
+        key=lambda offset: float(
+            np.mean(
+                np.abs(
+                    image[::2]
+                    - padded[
+                        margin + offset[0] : margin + offset[0] + height : 2,
+                        margin + offset[1] : margin + offset[1] + width,
+                    ]
+                )
+            )
+        ),
+    )
+
+    rows, columns = np.nonzero(
+        np.abs(
+            image
+            - padded[
+                margin + row_offset : margin + row_offset + height,
+                margin + column_offset : margin + column_offset + width,
+            ]
+        )
+        > DUPLICATE_MAX_PIXEL_DIFFERENCE
+    )
+    values = image[rows, columns]
+    unmatched = np.ones(len(rows), dtype=bool)
+    for half_rows in range(-2, 3):
+        for half_columns in range(-2, 3):
+            unmatched &= (
+                np.abs(
+                    values
+                    - _shifted_values(
+                        padded,
+                        rows,
+                        columns,
+                        2 * row_offset + half_rows,
+                        2 * column_offset + half_columns,
+                    )
+                )
+                > DUPLICATE_MAX_PIXEL_DIFFERENCE
+            )
+    return bool(unmatched.any())
+
+
+def is_duplicate_page(thumbnail, page_hash, other_thumbnail, other_hash):
+    """Return whether two pages are renders or rescans of the same content.
+
+    Pages with close hashes are aligned and compared on blurred thumbnails
+    in both directions, so a stroke present on only one page is found.
+    """
+    if not may_be_duplicate(page_hash, other_hash):
+        return False
+    if any(
+        abs(size - other_size) > DUPLICATE_MAX_OFFSET
+        for size, other_size in zip(thumbnail.shape, other_thumbnail.shape)
+    ):
+        return False
+
+    height = min(thumbnail.shape[0], other_thumbnail.shape[0])
+    width = min(thumbnail.shape[1], other_thumbnail.shape[1])
+    image = _box_blur(thumbnail[:height, :width])
+    other_image = _box_blur(other_thumbnail[:height, :width])
+    return not (
+        _has_unmatched_pixel(image, other_image)
+        or _has_unmatched_pixel(other_image, image)
+    )
@@ -1,14 +1,29 @@
+import argparse
+import time
+
 from database import (
+    delete_policy_chunks_from,
     get_database_url,
-    policy_has_embeddings,
+    load_policy_chunk_state,
     save_policy_chunks,
 )
-from vector_store import chunk_text, embed_chunks
+from document_indexing import changed_chunk_records, reusable_chunk_embeddings
+from embedding_pool import iter_pool_embeddings
+from vector_store import (
+    chunk_text,
+    chunk_token_statistics,
+    chunks_to_embed,
+    embed_chunks_reusing,
+    embedding_throughput,
+    new_embedding_stats,
+)
+from vector_storage import chunk_embedding_model
 
 import psycopg
 
 
-EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+# Includes the storage mode, so switching it re-embeds stored chunks.
+EMBEDDING_MODEL = chunk_embedding_model()
 
 
 def load_policies():
@@ -28,46 +43,188 @@ def load_policies():
             return cursor.fetchall()
 
 
-def index_policy(policy_db_id, policy_code, title, policy_text):
-    """Chunk, embed, and save one policy if it is not already indexed."""
+def _plan_policy_update(policy_db_id, policy_text):
+    """Chunk a policy and find the chunks that changed since it was indexed.
 
-    if policy_has_embeddings(policy_db_id):
-        print(f"Skipping {policy_code}: embeddings already exist.")
-        return
+    Returns None when the policy produces no chunks.
+    """
 
     chunks = chunk_text(policy_text)
 
     if not chunks:
-        print(f"Skipping {policy_code}: no chunks were created.")
-        return
-
-    embeddings = embed_chunks(chunks)
+        return None
 
-    save_policy_chunks(
-        policy_id=policy_db_id,
-        chunks=chunks,
-        embeddings=embeddings,
-        embedding_model=EMBEDDING_MODEL,
+    stored_chunks = load_policy_chunk_state(policy_db_id)
+    changed_records = changed_chunk_records(
+        [{"text": chunk} for chunk in chunks],
+        stored_chunks,
     )
 
+    return {
+        "chunks": chunks,
+        "stored_chunks": stored_chunks,
+        "reusable_embeddings": reusable_chunk_embeddings(stored_chunks),
+        "changed_indexes": [chunk_index for chunk_index, _, _ in changed_records],
+        "changed_hashes": [content_hash for _, _, content_hash in changed_records],
+    }
+
+
+def _save_policy_update(policy_db_id, plan, embeddings):
+    """Save the changed chunks of a plan and delete chunks past its end."""
+
+    chunks = plan["chunks"]
+    if plan["changed_indexes"]:
+        save_policy_chunks(
+            policy_id=policy_db_id,
+            chunks=[chunks[chunk_index] for chunk_index in plan["changed_indexes"]],
+            embeddings=embeddings,
+            embedding_model=EMBEDDING_MODEL,
+            chunk_indexes=plan["changed_indexes"],
+        )
+
+    if any(chunk_index >= len(chunks) for chunk_index in plan["stored_chunks"]):
+        return delete_policy_chunks_from(policy_db_id, len(chunks))
+    return 0
+
+
+def _print_policy_result(policy_code, title, plan, embedded_count, deleted_count):
+    chunks = plan["chunks"]
+    changed_count = len(plan["changed_indexes"])
+    chunk_token_stats = chunk_token_statistics(chunks)
     print(
         f"Indexed {policy_code} - {title}: "
-        f"{len(chunks)} chunk(s), embedding shape {embeddings.shape}"
+        f"{len(chunks)} chunk(s), {embedded_count} embedded, "
+        f"{changed_count - embedded_count} reused, "
+        f"{len(chunks) - changed_count} unchanged, "
+        f"{deleted_count} deleted, "
+        f"{chunk_token_stats['truncated_chunks']} truncated chunk(s)"
     )
 
 
+def index_policy(policy_db_id, policy_code, title, policy_text):
+    """Chunk one policy and embed only the chunks that changed since last time.
+
+    Unchanged chunks keep their stored rows, edited chunks whose text was
+    embedded before reuse that embedding, and chunks past the new end of the
+    policy are deleted.
+    """
+
+    plan = _plan_policy_update(policy_db_id, policy_text)
+
+    if plan is None:
+        print(f"Skipping {policy_code}: no chunks were created.")
+        return
+
+    embeddings = None
+    embedded_count = 0
+    if plan["changed_indexes"]:
+        embeddings, embedded_count = embed_chunks_reusing(
+            [plan["chunks"][chunk_index] for chunk_index in plan["changed_indexes"]],
+            plan["changed_hashes"],
+            plan["reusable_embeddings"],
+        )
+
+    deleted_count = _save_policy_update(policy_db_id, plan, embeddings)
+    _print_policy_result(policy_code, title, plan, embedded_count, deleted_count)
+
+
+def index_policies_bulk(policies, *, max_workers=None):
+    """Index many policies, encoding their changed chunks on a process pool.
+
+    Each policy is planned as in ``index_policy``; only chunks without a
+    reusable embedding are sent to the pool, and each policy is saved as
+    soon as its chunks come back. Returns the pool's encoding counters.
+    """
+
+    plans = {}
+    embedding_stats = new_embedding_stats()
+
+    def embedding_jobs():
+        for policy_db_id, policy_code, title, policy_text in policies:
+            plan = _plan_policy_update(policy_db_id, policy_text)
+            if plan is None:
+                print(f"Skipping {policy_code}: no chunks were created.")
+                continue
+
+            missing_chunks = chunks_to_embed(
+                [plan["chunks"][chunk_index] for chunk_index in plan["changed_indexes"]],
+                plan["changed_hashes"],
+                plan["reusable_embeddings"],
+            )
+            plan["missing_hashes"] = list(missing_chunks)
+            plans[policy_db_id] = (policy_code, title, plan)
+            yield policy_db_id, list(missing_chunks.values())
+
+    for policy_db_id, new_embeddings in iter_pool_embeddings(
+        embedding_jobs(),
+        max_workers=max_workers,
+        embedding_stats=embedding_stats,
+    ):
+        policy_code, title, plan = plans.pop(policy_db_id)
+        plan["reusable_embeddings"].update(zip(plan["missing_hashes"], new_embeddings))
+        embeddings, _ = embed_chunks_reusing(
+            [plan["chunks"][chunk_index] for chunk_index in plan["changed_indexes"]],
+            plan["changed_hashes"],
+            plan["reusable_embeddings"],
+        )
+        deleted_count = _save_policy_update(policy_db_id, plan, embeddings)
+        _print_policy_result(
+            policy_code,
+            title,
+            plan,
+            len(plan["missing_hashes"]),
+            deleted_count,
+        )
+
+    return embedding_stats
+
+
 def main():
+    parser = argparse.ArgumentParser(
+        description="Chunk and embed carrier policies for semantic search.",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Encode changed chunks on a pool of embedding worker processes.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of embedding worker processes for --bulk.",
+    )
+    arguments = parser.parse_args()
+
     policies = load_policies()
 
     print(f"Found {len(policies)} carrier policies.")
 
-    for policy_db_id, policy_code, title, policy_text in policies:
-        index_policy(
-            policy_db_id,
-            policy_code,
-            title,
-            policy_text,
+    started_at = time.perf_counter()
+    if arguments.bulk:
+        throughput = embedding_throughput(
+            index_policies_bulk(policies, max_workers=arguments.workers)
         )
+    else:
+        for policy_db_id, policy_code, title, policy_text in policies:
+            index_policy(
+                policy_db_id,
+                policy_code,
+                title,
+                policy_text,
+            )
+        throughput = embedding_throughput()
+
+    elapsed_seconds = time.perf_counter() - started_at
+    print(
+        f"Encoded {throughput['encoded_chunks']} chunk(s) in "
+        f"{throughput['encode_seconds']:g}s of model time: "
+        f"{throughput['chunks_per_second']:g} chunks/s per worker, "
+        f"{throughput['tokens_per_second']} tokens/s, "
+        f"{throughput['padding_ratio']:.0%} padding. "
+        f"Wall clock: {elapsed_seconds:.1f}s, "
+        f"{throughput['encoded_chunks'] / max(elapsed_seconds, 1e-9):.1f} chunks/s."
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+import importlib
+
+
+class LazyModule:
+    """A module that is imported the first time one of its attributes is used.
+
+    Heavy parsers and API clients are only needed once a document is
+    processed or a question is asked, so deferring them keeps them out of
+    the app's cold start. ``python -X importtime`` audits this in
+    ``tests/test_import_time.py``.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            # The import system serialises concurrent first imports.
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
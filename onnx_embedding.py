@@ -0,0 +1,227 @@
+import argparse
+import os
+from pathlib import Path
+import sys
+
+import numpy as np
+
+from qa_engine import EMBEDDING_MAX_TOKENS, EMBEDDING_MODEL_NAME
+
+
+# An int8-quantized ONNX export of all-mpnet-base-v2 runs on ONNX Runtime
+# without importing PyTorch. Create it once with
+# ``python onnx_embedding.py export`` and select it with EMBEDDING_BACKEND=onnx.
+ONNX_EMBEDDING_MODEL_DIR = Path(
+    os.getenv("ONNX_EMBEDDING_MODEL_DIR", "models/all-mpnet-base-v2-onnx-int8")
+)
+ONNX_MODEL_FILE = "model_quantized.onnx"
+ONNX_TOKENIZER_FILE = "tokenizer.json"
+# 0 lets ONNX Runtime use one thread per physical core.
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+# Quantization may move an embedding slightly; retrieval is unaffected while
+# every parity text keeps at least this cosine similarity to PyTorch.
+PARITY_MIN_COSINE = 0.99
+
+PARITY_TEXTS = (
+    "The shipment arrived with three damaged pallets and a torn shrink wrap.",
+    "Carrier liability is limited to the declared value of the goods.",
+    "Delivery was delayed by 48 hours because of a customs inspection.",
+    "Invoice 1042 for freight charges of $2,350.00 is overdue.",
+    "Temperature logs show the reefer unit exceeded 8 °C for six hours.",
+    "Proof of delivery was signed by the consignee at 14:05 on 3 March.",
+    "Claims must be filed within nine months of the delivery date.",
+    "Seal number 448213 did not match the seal recorded at loading.",
+)
+
+
+def _mean_pool(token_embeddings, attention_mask):
+    """Average token embeddings over real tokens, as sentence-transformers does."""
+    mask = attention_mask[..., np.newaxis].astype(np.float32)
+    summed = (token_embeddings * mask).sum(axis=1)
+    return summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def _normalize(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
+
+
+def _load_tokenizer(model_dir):
+    from tokenizers import Tokenizer
+
+    return Tokenizer.from_file(str(Path(model_dir) / ONNX_TOKENIZER_FILE))
+
+
+class OnnxEmbeddingModel:
+    """A drop-in for the ``encode`` calls made on the SentenceTransformer model.
+
+    Embeddings have the same 768 dimensions, mean pooling, and unit length as
+    all-mpnet-base-v2, so they can be searched against stored embeddings.
+    """
+
+    def __init__(self, model_dir=None):
+        import onnxruntime
+
+        model_dir = Path(model_dir or ONNX_EMBEDDING_MODEL_DIR)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if ONNX_INTRA_OP_THREADS:
+            options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        self._session = onnxruntime.InferenceSession(
+            str(model_dir / ONNX_MODEL_FILE),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {
+            model_input.name for model_input in self._session.get_inputs()
+        }
+
+        self._tokenizer = _load_tokenizer(model_dir)
+        self._tokenizer.enable_truncation(max_length=EMBEDDING_MAX_TOKENS)
+        pad_token = "<pad>"
+        self._tokenizer.enable_padding(
+            pad_id=self._tokenizer.token_to_id(pad_token),
+            pad_token=pad_token,
+        )
+
+    def encode(self, sentences, batch_size=32, **_kwargs):
+        """Return float32 embeddings; one row per sentence, or one vector for a string."""
+        single_sentence = isinstance(sentences, str)
+        if single_sentence:
+            sentences = [sentences]
+
+        batches = []
+        for batch_start in range(0, len(sentences), batch_size):
+            encodings = self._tokenizer.encode_batch(
+                list(sentences[batch_start : batch_start + batch_size])
+            )
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array(
+                [encoding.attention_mask for encoding in encodings],
+                dtype=np.int64,
+            )
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+            token_embeddings = self._session.run(None, feeds)[0]
+            batches.append(_normalize(_mean_pool(token_embeddings, attention_mask)))
+
+        embeddings = (
+            np.concatenate(batches).astype(np.float32)
+            if batches
+            else np.empty((0, 0), dtype=np.float32)
+        )
+        return embeddings[0] if single_sentence else embeddings
+
+
+class OnnxTokenCounter:
+    """Count tokens with the exported ``tokenizer.json`` instead of transformers.
+
+    Supports the ``tokenizer(texts, add_special_tokens=...)["input_ids"]``
+    calls that chunking makes. Texts are never truncated, so long chunks are
+    counted in full.
+    """
+
+    def __init__(self, model_dir=None):
+        self._tokenizer = _load_tokenizer(model_dir or ONNX_EMBEDDING_MODEL_DIR)
+        self._tokenizer.no_truncation()
+        self._tokenizer.no_padding()
+
+    def __call__(self, texts, add_special_tokens=True):
+        encodings = self._tokenizer.encode_batch(
+            list(texts),
+            add_special_tokens=add_special_tokens,
+        )
+        return {"input_ids": [encoding.ids for encoding in encodings]}
+
+
+def export_quantized_model(output_dir):
+    """Export all-mpnet-base-v2 to ONNX and quantize its weights to int8.
+
+    Needs ``optimum[onnxruntime]`` and PyTorch, but only on the machine that
+    runs the export; the app only needs onnxruntime and tokenizers.
+    """
+    import tempfile
+
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    output_dir = Path(output_dir)
+    with tempfile.TemporaryDirectory() as export_dir:
+        model = ORTModelForFeatureExtraction.from_pretrained(
+            EMBEDDING_MODEL_NAME,
+            export=True,
+        )
+        model.save_pretrained(export_dir)
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        quantizer.quantize(
+            save_dir=output_dir,
+            quantization_config=AutoQuantizationConfig.avx2(
+                is_static=False,
+                per_channel=True,
+            ),
+        )
+    AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME).save_pretrained(output_dir)
+    return output_dir / ONNX_MODEL_FILE
+
+
+def embedding_parity(reference_embeddings, candidate_embeddings):
+    """Compare two embedding matrices row by row with cosine similarity."""
+    reference_embeddings = np.asarray(reference_embeddings, dtype=np.float32)
+    candidate_embeddings = np.asarray(candidate_embeddings, dtype=np.float32)
+    if reference_embeddings.shape != candidate_embeddings.shape:
+        raise ValueError(
+            "Embedding shapes differ: "
+            f"{reference_embeddings.shape} and {candidate_embeddings.shape}."
+        )
+
+    cosine = (
+        _normalize(reference_embeddings) * _normalize(candidate_embeddings)
+    ).sum(axis=1)
+    return {
+        "dimensions": reference_embeddings.shape[1],
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "passed": bool(cosine.min() >= PARITY_MIN_COSINE),
+    }
+
+
+def check_parity(texts=PARITY_TEXTS, model_dir=None):
+    """Embed ``texts`` with PyTorch and with ONNX Runtime and compare them."""
+    from sentence_transformers import SentenceTransformer
+
+    texts = list(texts)
+    reference_embeddings = SentenceTransformer(EMBEDDING_MODEL_NAME).encode(texts)
+    onnx_embeddings = OnnxEmbeddingModel(model_dir).encode(texts)
+    return embedding_parity(reference_embeddings, onnx_embeddings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export and verify the int8 ONNX embedding model.",
+    )
+    parser.add_argument("command", choices=("export", "parity"))
+    parser.add_argument("--model-dir", type=Path, default=ONNX_EMBEDDING_MODEL_DIR)
+    arguments = parser.parse_args()
+
+    if arguments.command == "export":
+        model_path = export_quantized_model(arguments.model_dir)
+        print(f"Saved the quantized model to {model_path}.")
+        return
+
+    parity = check_parity(model_dir=arguments.model_dir)
+    print(
+        f"{parity['dimensions']} dimensions; cosine similarity to PyTorch: "
+        f"min {parity['min_cosine']:.4f}, mean {parity['mean_cosine']:.4f}."
+    )
+    if not parity["passed"]:
+        print(f"Parity check failed: minimum is below {PARITY_MIN_COSINE}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import multiprocessing
+import os
+
+from lazy_imports import LazyModule
+
+fitz = LazyModule("fitz")  # PyMuPDF
+
+
+# Text extraction is CPU-bound, so long PDFs are split into page ranges and
+# read by separate processes. Short PDFs stay in-process because starting a
+# worker costs more than reading a few dozen pages.
+PARALLEL_TEXT_MIN_PAGES = int(os.getenv("PDF_PARALLEL_TEXT_MIN_PAGES", "120"))
+PARALLEL_TEXT_MAX_WORKERS = int(
+    os.getenv("PDF_PARALLEL_TEXT_MAX_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+
+
+def read_page_texts(document):
+    """Return the stripped native text of every page of an open PDF."""
+    return [page.get_text("text").strip() for page in document]
+
+
+def _read_page_range_texts(pdf_bytes, start, stop):
+    """Worker entry point: read native text for pages ``start`` to ``stop - 1``."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        return [
+            document[index].get_text("text").strip()
+            for index in range(start, stop)
+        ]
+
+
+def read_page_texts_parallel(pdf_bytes, page_count, *, max_workers=None):
+    """Read page text in contiguous page ranges on a process pool.
+
+    Results are reassembled in page order. Workers are spawned rather than
+    forked, because forking a multi-threaded app process is unsafe. With a
+    single worker the pages are read in this process instead.
+    """
+    worker_count = max(1, min(max_workers or PARALLEL_TEXT_MAX_WORKERS, page_count))
+    if worker_count == 1:
+        return _read_page_range_texts(pdf_bytes, 0, page_count)
+
+    shard_size = -(-page_count // worker_count)
+    page_ranges = [
+        (start, min(start + shard_size, page_count))
+        for start in range(0, page_count, shard_size)
+    ]
+
+    with ProcessPoolExecutor(
+        max_workers=worker_count,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        shard_futures = [
+            executor.submit(_read_page_range_texts, pdf_bytes, start, stop)
+            for start, stop in page_ranges
+        ]
+        page_texts = []
+        for shard_future in shard_futures:
+            page_texts.extend(shard_future.result())
+
+    return page_texts
+
+
+def read_pdf_annotations(document):
+    """Return the text content of every annotation in an open PDF."""
+    annotations = []
+
+    for page in document:
+        annotation = page.first_annot
+
+        while annotation:
+            info = annotation.info
+            if info and info.get("content"):
+                annotations.append(info["content"])
+            annotation = annotation.next
+
+    return annotations
+
+
+def read_pdfplumber_page_texts(pdf_bytes):
+    """Fallback text reader used only when PyMuPDF cannot read page text."""
+    import pdfplumber
+
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        return [(page.extract_text() or "").strip() for page in pdf.pages]
+
+
+def scan_pdf(document, *, pdf_bytes=None):
+    """Read page count, native page text, and annotations in one pass.
+
+    The returned document stays open in the caller, so pages that need vision
+    can be rendered from it without parsing the file again. When ``pdf_bytes``
+    is supplied and the PDF has at least ``PARALLEL_TEXT_MIN_PAGES`` pages,
+    page text is read by a process pool instead.
+    """
+    page_texts = None
+    if (
+        pdf_bytes is not None
+        and PARALLEL_TEXT_MAX_WORKERS > 1
+        and document.page_count >= PARALLEL_TEXT_MIN_PAGES
+    ):
+        try:
+            page_texts = read_page_texts_parallel(pdf_bytes, document.page_count)
+        except Exception as exc:
+            print("Parallel PDF text extraction failed:", type(exc).__name__)
+
+    try:
+        if page_texts is None:
+            page_texts = read_page_texts(document)
+    except Exception as exc:
+        print("PyMuPDF text extraction failed:", type(exc).__name__)
+        try:
+            page_texts = read_pdfplumber_page_texts(document.tobytes())
+        except Exception as fallback_exc:
+            print("pdfplumber extraction failed:", type(fallback_exc).__name__)
+            page_texts = [""] * document.page_count
+
+    try:
+        annotations = read_pdf_annotations(document)
+    except Exception as exc:
+        print("Annotation extraction failed:", type(exc).__name__)
+        annotations = []
+
+    return {
+        "page_count": document.page_count,
+        "page_texts": page_texts,
+        "annotations": annotations,
+    }
+
@@ -1,8 +1,38 @@
+from concurrent.futures import Future
 import os
-from openai import OpenAI
+import threading
+
 import streamlit as st
 
+from lazy_imports import LazyModule
+
+# The OpenAI SDK is slow to import; it loads when the first answer is requested.
+openai = LazyModule("openai")
+
 DEFAULT_QA_MODEL = "gpt-5.6-sol"
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+# all-mpnet-base-v2 truncates longer inputs, including its two special tokens.
+EMBEDDING_MAX_TOKENS = 384
+EMBEDDING_DIMENSIONS = 768
+# "sentence-transformers" runs the model on PyTorch; "onnx" runs the int8
+# ONNX export from onnx_embedding.py on ONNX Runtime without importing torch.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers").lower()
+# Embeddings are cached and stored under this label. Int8 ONNX vectors are
+# close to, but not the same as, PyTorch ones, so each backend gets its own.
+EMBEDDING_MODEL_LABEL = (
+    EMBEDDING_MODEL_NAME
+    if EMBEDDING_BACKEND == "sentence-transformers"
+    else f"{EMBEDDING_MODEL_NAME}+{EMBEDDING_BACKEND}"
+)
+# Opt-in: load the embedding model on a background thread when the app
+# process starts, so no user's first search pays for the model load.
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "0") == "1"
+# Optional: encode through the shared server started with
+# ``python embedding_service.py`` instead of loading a model per process.
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "")
+
+_warmup_lock = threading.Lock()
+_warmup_future = None
 
 
 def _read_openai_settings():
@@ -33,15 +63,89 @@ def _read_openai_settings():
 
     return api_key, model
 
-# Load the shared embedding model only when document search first needs it.
-# Streamlit then reuses the same model for later reruns and questions while
-# the app process remains active.
-@st.cache_resource(show_spinner="Loading document search model...")
-def get_embedding_model():
+def load_local_embedding_model():
+    """Load the embedding model of EMBEDDING_BACKEND into this process."""
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_embedding import OnnxEmbeddingModel
+
+        return OnnxEmbeddingModel()
+
     from sentence_transformers import SentenceTransformer
 
     return SentenceTransformer("all-mpnet-base-v2")
 
+
+def _load_embedding_model():
+    # With a local embedding service, this process only holds a client.
+    if EMBEDDING_SERVICE_URL:
+        from embedding_service import EmbeddingServiceClient
+
+        return EmbeddingServiceClient(EMBEDDING_SERVICE_URL)
+
+    return load_local_embedding_model()
+
+
+def _warm_up_embedding_model(future):
+    try:
+        model = _load_embedding_model()
+        # One encode initialises the inference kernels and thread pools.
+        model.encode(["Warm-up sentence for the document search model."])
+    except BaseException as exc:
+        future.set_exception(exc)
+    else:
+        future.set_result(model)
+
+
+def start_embedding_warmup():
+    """Start loading the embedding model on a background thread, once.
+
+    Returns the future of the warm-up; later calls return the same future.
+    ``get_embedding_model`` waits for it instead of loading a second copy.
+    """
+    global _warmup_future
+
+    with _warmup_lock:
+        if _warmup_future is None:
+            _warmup_future = Future()
+            threading.Thread(
+                target=_warm_up_embedding_model,
+                args=(_warmup_future,),
+                name="saidia-embedding-warmup",
+                daemon=True,
+            ).start()
+        return _warmup_future
+
+
+# Load the shared embedding model only when document search first needs it,
+# or take the one loaded by start_embedding_warmup. Streamlit then reuses the
+# same model for later reruns and questions while the app process is active.
+@st.cache_resource(show_spinner="Loading document search model...")
+def get_embedding_model():
+    with _warmup_lock:
+        warmup_future = _warmup_future
+
+    if warmup_future is not None:
+        try:
+            return warmup_future.result()
+        except Exception as exc:
+            print("Embedding model warm-up failed:", type(exc).__name__)
+
+    return _load_embedding_model()
+
+
+# Chunking counts tokens with the embedding model's own tokenizer, which is
+# far cheaper to load than the model itself.
+@st.cache_resource(show_spinner=False)
+def get_embedding_tokenizer():
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_embedding import OnnxTokenCounter
+
+        return OnnxTokenCounter()
+
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+
 # Ask GPT using OpenAI client
 def answer_question_with_gpt(question, context_chunks, chat_history=None):
     context = "\n\n".join(
@@ -86,7 +190,7 @@ def answer_question_with_gpt(question, context_chunks, chat_history=None):
 
     try:
         api_key, model = _read_openai_settings()
-        response = OpenAI(api_key=api_key).responses.create(
+        response = openai.OpenAI(api_key=api_key).responses.create(
             model=model,
             instructions=instructions,
             input=messages,
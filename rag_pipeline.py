@@ -1,18 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 import os
 from pathlib import Path
-
-import pdfplumber
-from docx import Document
-import streamlit as st
-import fitz  # PyMuPDF for annotation extraction
-import boto3
-
+import re
+
+from database import find_processed_document, load_document_chunks
+from lazy_imports import LazyModule
+from image_preparation import (
+    is_blank_page,
+    is_duplicate_page,
+    may_be_duplicate,
+    page_thumbnail,
+    perceptual_hash,
+    prepare_pdf_page,
+    prepare_uploaded_image,
+)
+from pdf_engine import read_pdf_annotations, scan_pdf
 from vision_engine import (
     NoReadableTextError,
     VisionProcessingError,
     extract_text_from_image_bytes,
 )
 
+# Parsers are imported when the first document of that kind is processed.
+docx = LazyModule("docx")
+fitz = LazyModule("fitz")  # PyMuPDF for annotation extraction
+
 
 SUPPORTED_FILE_EXTENSIONS = {
     ".pdf",
@@ -23,49 +36,118 @@ SUPPORTED_FILE_EXTENSIONS = {
     ".jpeg",
 }
 IMAGE_FILE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+# Increase whenever extraction output can change for the same input bytes, so
+# stored extractions from an older pipeline are processed again.
+EXTRACTOR_VERSION = "4"
+# Pages with fewer non-whitespace characters are treated as scanned pages.
 PDF_NATIVE_TEXT_MIN_CHARACTERS = 40
 MAX_VISION_PDF_PAGES = 20
+# Vision calls are network-bound, so a few pages can be transcribed at once
+# without exceeding typical OpenAI rate limits for a single document.
+VISION_PDF_MAX_WORKERS = int(os.getenv("VISION_PDF_MAX_WORKERS", "4"))
 
 
 class DocumentProcessingError(RuntimeError):
     """A safe document-processing error that can be shown to an app user."""
 
 
-# ─── AWS CREDENTIALS ────────────────────────────────────────────────────────────
-try:
-    aws_access_key = st.secrets["aws"]["AWS_ACCESS_KEY_ID"]
-    aws_secret_key = st.secrets["aws"]["AWS_SECRET_ACCESS_KEY"]
-except Exception:
-    from dotenv import load_dotenv
-    load_dotenv()
-    aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
-    aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=aws_access_key,
-    aws_secret_access_key=aws_secret_key,
-    region_name="eu-north-1"
-)
+class VisionPageLimitError(DocumentProcessingError):
+    """Raised when a scan needs more vision pages than one request allows."""
+
 
 # ─── S3 FILE DOWNLOAD ───────────────────────────────────────────────────────────
 def download_file_from_s3(file_name, download_path):
+    # The S3 client is created on first use instead of when this module loads.
+    from s3_upload import S3_BUCKET, _create_s3_client
+
     try:
-        s3.download_file("smart-doc-assistant-saidia", file_name, download_path)
+        _create_s3_client().download_file(S3_BUCKET, file_name, download_path)
         return True
     except Exception as e:
         print("Download error:", e)
         return False
 
 
+# ─── STORED EXTRACTION REUSE ──────────────────────────────────────────────────
+def load_cached_extraction(document_hash):
+    """Return a stored extraction for identical bytes, or None when stale.
+
+    The result has the same ``text`` and ``metadata`` keys as
+    ``process_document`` plus the stored ``document_id``, ``s3_object_key``,
+    and any previously saved ``chunks``.
+    """
+    try:
+        stored_document = find_processed_document(document_hash)
+    except Exception as exc:
+        print("Extraction cache lookup failed:", type(exc).__name__)
+        return None
+
+    if (
+        stored_document is None
+        or stored_document["extractor_version"] != EXTRACTOR_VERSION
+        or not stored_document["extraction_metadata"]
+    ):
+        return None
+
+    try:
+        chunks = load_document_chunks(stored_document["document_id"])
+    except Exception as exc:
+        print("Stored chunk lookup failed:", type(exc).__name__)
+        chunks = []
+
+    return {
+        "text": stored_document["extracted_text"],
+        "metadata": stored_document["extraction_metadata"],
+        "document_id": stored_document["document_id"],
+        "s3_object_key": stored_document["s3_object_key"],
+        "chunks": chunks,
+    }
+
+
+# ─── DOCUMENT SOURCES ─────────────────────────────────────────────────────────
+def _read_document_source(source, file_name=None):
+    """Return ``(file_bytes, file_name)`` for a path or an in-memory upload.
+
+    Paths are read once. Bytes are used as-is, so uploads are processed
+    without writing a temporary copy to disk.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        path = Path(source)
+        if not path.is_file():
+            raise DocumentProcessingError(
+                "The downloaded document could not be found."
+            )
+        return path.read_bytes(), Path(file_name or path.name).name
+
+    if isinstance(source, BytesIO):
+        source = source.getvalue()
+
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        raise DocumentProcessingError("The document source is not supported.")
+
+    if not file_name:
+        raise DocumentProcessingError(
+            "A file name is required to process in-memory document data."
+        )
+
+    return bytes(source), Path(file_name).name
+
+
+def _open_fitz_document(file_bytes, extension):
+    """Open PDF or image bytes with PyMuPDF without touching the disk."""
+    return fitz.open(stream=file_bytes, filetype=extension.lstrip("."))
+
+
 # ─── LOCAL DOCUMENT INSPECTION ────────────────────────────────────────────────
-def inspect_document(file_path):
-    """Return safe document facts without sending the file to another service."""
-    path = Path(file_path)
-    extension = path.suffix.lower()
+def inspect_document(source, *, file_name=None, count_pdf_pages=True):
+    """Return safe document facts without sending the file to another service.
 
-    if not path.is_file():
-        raise DocumentProcessingError("The downloaded document could not be found.")
+    ``source`` is a path, or bytes/``BytesIO``/memoryview together with
+    ``file_name``. ``process_document`` passes ``count_pdf_pages=False``
+    because its single PDF extraction pass reports the page count itself.
+    """
+    file_bytes, file_name = _read_document_source(source, file_name)
+    extension = Path(file_name).suffix.lower()
 
     if extension not in SUPPORTED_FILE_EXTENSIONS:
         raise DocumentProcessingError(
@@ -82,18 +164,18 @@ def inspect_document(file_path):
         document_kind = "image"
 
     metadata = {
-        "file_name": path.name,
+        "file_name": file_name,
         "extension": extension,
         "document_kind": document_kind,
-        "size_bytes": path.stat().st_size,
+        "size_bytes": len(file_bytes),
         "page_count": None,
         "image_width": None,
         "image_height": None,
     }
 
-    if extension == ".pdf":
+    if extension == ".pdf" and count_pdf_pages:
         try:
-            with fitz.open(path) as document:
+            with _open_fitz_document(file_bytes, extension) as document:
                 metadata["page_count"] = document.page_count
         except Exception as exc:
             raise DocumentProcessingError(
@@ -102,7 +184,7 @@ def inspect_document(file_path):
 
     elif extension in IMAGE_FILE_EXTENSIONS:
         try:
-            with fitz.open(path) as image_document:
+            with _open_fitz_document(file_bytes, extension) as image_document:
                 if image_document.page_count != 1:
                     raise DocumentProcessingError(
                         "The selected image has an unexpected page structure."
@@ -124,45 +206,211 @@ def inspect_document(file_path):
 
 
 # ─── OPENAI VISION EXTRACTION ────────────────────────────────────────────────
-def extract_image_with_vision(file_path):
-    """Use OpenAI Vision to transcribe one uploaded image."""
-    path = Path(file_path)
-    mime_type = "image/png" if path.suffix.lower() == ".png" else "image/jpeg"
+def _add_image_stats(vision_stats, page_stats):
+    """Accumulate vision payload sizes into a caller-supplied dictionary."""
+    if vision_stats is None:
+        return
+    for key in ("bytes_before", "bytes_after"):
+        vision_stats[key] = vision_stats.get(key, 0) + page_stats[key]
+
+
+def _new_vision_stats():
+    """Return an empty record of vision payload sizes and skipped pages."""
+    return {
+        "bytes_before": 0,
+        "bytes_after": 0,
+        "blank_pages": [],
+        "reused_pages": [],
+    }
+
+
+def extract_image_with_vision(source, *, file_name=None, vision_stats=None):
+    """Use OpenAI Vision to transcribe one uploaded image.
+
+    Oversized photos are downsampled before upload; payload sizes are added
+    to ``vision_stats`` when a dictionary is supplied.
+    """
+    file_bytes, file_name = _read_document_source(source, file_name)
+    extension = Path(file_name).suffix.lower()
+    mime_type = "image/png" if extension == ".png" else "image/jpeg"
+
+    try:
+        image_bytes, mime_type, page_stats = prepare_uploaded_image(
+            file_bytes,
+            mime_type,
+        )
+    except Exception as exc:
+        raise DocumentProcessingError(
+            "The selected image could not be prepared for OpenAI vision."
+        ) from exc
+    _add_image_stats(vision_stats, page_stats)
 
     return extract_text_from_image_bytes(
-        path.read_bytes(),
+        image_bytes,
         mime_type,
-        page_label=path.name,
+        page_label=file_name,
+        extractor_version=EXTRACTOR_VERSION,
     )
 
 
-def extract_scanned_pdf_with_vision(file_path):
-    """Render and transcribe scanned-PDF pages with OpenAI Vision."""
-    page_texts = []
+def _transcribe_page_image(
+    image_bytes,
+    mime_type,
+    page_number,
+    vision_checkpoint=None,
+):
+    """Transcribe one rendered PDF page, keeping blank pages in the output."""
+    try:
+        page_text = extract_text_from_image_bytes(
+            image_bytes,
+            mime_type,
+            page_label=f"page {page_number}",
+            extractor_version=EXTRACTOR_VERSION,
+        )
+    except NoReadableTextError:
+        page_text = "[No readable text]"
+
+    if vision_checkpoint is not None:
+        vision_checkpoint.save_page(page_number, page_text)
+    return page_text
+
+
+def _plan_vision_pages(
+    page_numbers,
+    *,
+    vision_stats,
+    vision_checkpoint=None,
+    max_vision_pages=None,
+):
+    """Return ``(completed_pages, pending_page_numbers)`` for a vision job.
+
+    With a ``vision_checkpoint`` (see ``vision_jobs``), pages finished by an
+    earlier attempt are reused. ``max_vision_pages`` limits only the pages
+    that still need transcription, and is checked before any page is sent.
+    """
+    page_limit = max_vision_pages or MAX_VISION_PDF_PAGES
+    completed_pages = (
+        vision_checkpoint.begin(page_numbers) if vision_checkpoint is not None else {}
+    )
+    pending_page_numbers = [
+        page_number
+        for page_number in page_numbers
+        if page_number not in completed_pages
+    ]
+    vision_stats["resumed_pages"] = len(page_numbers) - len(pending_page_numbers)
+
+    if len(pending_page_numbers) > page_limit:
+        raise VisionPageLimitError(
+            f"Scanned PDFs are currently limited to "
+            f"{page_limit} pages to keep processing reliable."
+        )
+
+    return completed_pages, pending_page_numbers
+
+
+def _iter_transcribed_pages(
+    document,
+    page_numbers,
+    completed_pages,
+    pending_page_numbers,
+    *,
+    max_workers=None,
+    vision_stats,
+    vision_checkpoint=None,
+):
+    """Yield ``(page_number, text)`` for selected pages of an open PDF.
+
+    Pages are rendered one at a time in this thread, because a PyMuPDF
+    document must not be shared between threads, while up to ``max_workers``
+    rendered pages are transcribed concurrently. Each page is yielded in page
+    order as soon as it and every earlier page are finished.
+
+    A cheap local check runs first: blank pages are never sent, and a page
+    that is a near-identical copy of an earlier one reuses its transcription.
+    Skipped pages are recorded in ``vision_stats``, and every new page is
+    saved to the ``vision_checkpoint`` as it completes.
+    """
+    worker_count = max(1, max_workers or VISION_PDF_MAX_WORKERS)
 
     try:
-        with fitz.open(file_path) as document:
-            if document.page_count > MAX_VISION_PDF_PAGES:
-                raise DocumentProcessingError(
-                    f"Scanned PDFs are currently limited to "
-                    f"{MAX_VISION_PDF_PAGES} pages to keep processing reliable."
-                )
-
-            for page_number, page in enumerate(document, start=1):
-                # A 2x render improves small-text readability without giving the
-                # model an unrestricted local path or direct access to S3.
-                pixmap = page.get_pixmap(matrix=fitz.Matrix(2, 2), alpha=False)
-
-                try:
-                    page_text = extract_text_from_image_bytes(
-                        pixmap.tobytes("png"),
-                        "image/png",
-                        page_label=f"page {page_number}",
+        with ThreadPoolExecutor(
+            max_workers=worker_count,
+            thread_name_prefix="saidia-vision",
+        ) as executor:
+            page_futures = {}
+            reused_page_numbers = set()
+            transcribed_pages = []
+            try:
+                for page_number in pending_page_numbers:
+                    page = document[page_number - 1]
+                    thumbnail = page_thumbnail(page)
+                    if is_blank_page(thumbnail):
+                        vision_stats["blank_pages"].append(page_number)
+                        if vision_checkpoint is not None:
+                            vision_checkpoint.save_page(
+                                page_number,
+                                "[No readable text]",
+                            )
+                        continue
+
+                    # Only hashes are kept per page; an earlier page is
+                    # rendered again for the pixel check when its hash is
+                    # close, so a long scan never holds every thumbnail.
+                    page_hash = perceptual_hash(thumbnail)
+                    source_page_number = next(
+                        (
+                            earlier_page_number
+                            for earlier_page_number, earlier_hash in transcribed_pages
+                            if may_be_duplicate(page_hash, earlier_hash)
+                            and is_duplicate_page(
+                                thumbnail,
+                                page_hash,
+                                page_thumbnail(document[earlier_page_number - 1]),
+                                earlier_hash,
+                            )
+                        ),
+                        None,
+                    )
+                    if source_page_number is not None:
+                        vision_stats["reused_pages"].append(
+                            {"page": page_number, "source_page": source_page_number}
+                        )
+                        reused_page_numbers.add(page_number)
+                        page_futures[page_number] = page_futures[source_page_number]
+                        continue
+
+                    # Only the rendered image is sent, never a local path or
+                    # direct access to S3.
+                    image_bytes, mime_type, page_stats = prepare_pdf_page(page)
+                    _add_image_stats(vision_stats, page_stats)
+                    transcribed_pages.append((page_number, page_hash))
+                    page_futures[page_number] = executor.submit(
+                        _transcribe_page_image,
+                        image_bytes,
+                        mime_type,
+                        page_number,
+                        vision_checkpoint,
                     )
-                except NoReadableTextError:
-                    page_text = "[No readable text]"
 
-                page_texts.append(f"[Page {page_number}]\n{page_text}")
+                for page_number in page_numbers:
+                    if page_number in completed_pages:
+                        page_text = completed_pages[page_number]
+                    elif page_number in page_futures:
+                        page_text = page_futures[page_number].result()
+                        if (
+                            page_number in reused_page_numbers
+                            and vision_checkpoint is not None
+                        ):
+                            vision_checkpoint.save_page(page_number, page_text)
+                    else:
+                        page_text = "[No readable text]"
+                    yield page_number, page_text
+            except BaseException:
+                # Stop paying for pages that have not started once one fails
+                # or the caller stops reading pages.
+                for page_future in page_futures.values():
+                    page_future.cancel()
+                raise
     except (DocumentProcessingError, VisionProcessingError):
         raise
     except Exception as exc:
@@ -170,91 +418,226 @@ def extract_scanned_pdf_with_vision(file_path):
             "The scanned PDF could not be prepared for OpenAI vision."
         ) from exc
 
-    readable_pages = [
-        page_text for page_text in page_texts if "[No readable text]" not in page_text
-    ]
-    if not readable_pages:
-        raise DocumentProcessingError(
-            "OpenAI vision found no readable text in the scanned PDF."
+
+def _transcribe_document_pages(
+    document,
+    page_numbers,
+    *,
+    max_workers=None,
+    vision_stats=None,
+    vision_checkpoint=None,
+    max_vision_pages=None,
+):
+    """Return ``{page_number: text}`` for selected pages of an open PDF."""
+    page_numbers = sorted(set(page_numbers))
+    if vision_stats is None:
+        vision_stats = _new_vision_stats()
+
+    completed_pages, pending_page_numbers = _plan_vision_pages(
+        page_numbers,
+        vision_stats=vision_stats,
+        vision_checkpoint=vision_checkpoint,
+        max_vision_pages=max_vision_pages,
+    )
+    return dict(
+        _iter_transcribed_pages(
+            document,
+            page_numbers,
+            completed_pages,
+            pending_page_numbers,
+            max_workers=max_workers,
+            vision_stats=vision_stats,
+            vision_checkpoint=vision_checkpoint,
         )
+    )
 
-    return "\n\n".join(page_texts)
 
+def extract_scanned_pdf_with_vision(source, *, page_numbers=None, max_workers=None):
+    """Render and transcribe scanned-PDF pages with OpenAI Vision."""
+    file_bytes, _ = _read_document_source(source, "document.pdf")
 
-# ─── ANNOTATION EXTRACTION FROM PDF ─────────────────────────────────────────────
-def extract_annotations_from_pdf(file_path):
     try:
-        with fitz.open(file_path) as document:
-            annotations = []
+        with _open_fitz_document(file_bytes, ".pdf") as document:
+            if page_numbers is None:
+                page_numbers = range(1, document.page_count + 1)
+            page_texts = _transcribe_document_pages(
+                document,
+                page_numbers,
+                max_workers=max_workers,
+            )
+    except (DocumentProcessingError, VisionProcessingError):
+        raise
+    except Exception as exc:
+        raise DocumentProcessingError(
+            "The scanned PDF could not be prepared for OpenAI vision."
+        ) from exc
 
-            for page in document:
-                annotation = page.first_annot
+    if all(text == "[No readable text]" for text in page_texts.values()):
+        raise DocumentProcessingError(
+            "OpenAI vision found no readable text in the scanned PDF."
+        )
 
-                while annotation:
-                    info = annotation.info
-                    if info and info.get("content"):
-                        annotations.append(info["content"])
-                    annotation = annotation.next
+    return "\n\n".join(
+        f"[Page {page_number}]\n{page_text}"
+        for page_number, page_text in page_texts.items()
+    )
 
-        return "\n".join(annotations)
+
+# ─── ANNOTATION EXTRACTION FROM PDF ─────────────────────────────────────────────
+def extract_annotations_from_pdf(source):
+    try:
+        file_bytes, _ = _read_document_source(source, "document.pdf")
+        with _open_fitz_document(file_bytes, ".pdf") as document:
+            return "\n".join(read_pdf_annotations(document))
 
     except Exception as e:
         print("Annotation extraction failed:", e)
         return ""
 
 # ─── TEXT EXTRACTION FROM PDF ───────────────────────────────────────────────────
-def _extract_native_pdf_text(file_path):
-    page_texts = []
-
+def _has_native_text(page_text):
+    """Return whether a page has enough native text to skip vision."""
+    return len("".join(page_text.split())) >= PDF_NATIVE_TEXT_MIN_CHARACTERS
+
+
+def _iter_pdf_pages(
+    file_bytes,
+    metadata,
+    *,
+    vision_checkpoint=None,
+    max_vision_pages=None,
+):
+    """Yield one ``[Page N]`` section per PDF page in page order.
+
+    Each page is routed to native text or vision. Native pages are yielded as
+    soon as every earlier scanned page is transcribed, and annotations follow
+    as a final section. The PDF is opened once: the same document supplies
+    the page count, native text, annotations, and the renders of pages that
+    need vision. Decision metadata is added to ``metadata`` after the last
+    section.
+    """
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = (page.extract_text() or "").strip()
-                if page_text:
-                    page_texts.append(f"[Page {page.page_number}]\n{page_text}")
+        document = _open_fitz_document(file_bytes, ".pdf")
     except Exception as exc:
-        print("pdfplumber extraction failed:", exc)
-
-    return "\n\n".join(page_texts)
+        raise DocumentProcessingError(
+            "The selected PDF is corrupted or could not be opened."
+        ) from exc
 
+    vision_stats = _new_vision_stats()
+    with document:
+        pdf_scan = scan_pdf(document, pdf_bytes=file_bytes)
+        native_pages = pdf_scan["page_texts"]
+        vision_page_numbers = [
+            page_number
+            for page_number, page_text in enumerate(native_pages, start=1)
+            if not _has_native_text(page_text)
+        ]
+
+        vision_pages = iter(())
+        if vision_page_numbers:
+            # The page limit is checked before any section is yielded, so no
+            # page of an over-limit scan is indexed.
+            completed_pages, pending_page_numbers = _plan_vision_pages(
+                vision_page_numbers,
+                vision_stats=vision_stats,
+                vision_checkpoint=vision_checkpoint,
+                max_vision_pages=max_vision_pages,
+            )
+            vision_pages = _iter_transcribed_pages(
+                document,
+                vision_page_numbers,
+                completed_pages,
+                pending_page_numbers,
+                vision_stats=vision_stats,
+                vision_checkpoint=vision_checkpoint,
+            )
+
+        scanned_page_numbers = set(vision_page_numbers)
+        page_methods = []
+        readable_vision_page_count = 0
+        # A fully scanned PDF holds back its sections until a page has
+        # readable text, so a blank scan fails before anything is indexed.
+        held_sections = []
+        hold_sections = len(vision_page_numbers) == len(native_pages)
+        for page_number, native_page_text in enumerate(native_pages, start=1):
+            if page_number in scanned_page_numbers:
+                page_methods.append("openai_vision")
+                _, page_text = next(vision_pages)
+                if page_text != "[No readable text]":
+                    readable_vision_page_count += 1
+            else:
+                page_methods.append("native_pdf")
+                page_text = native_page_text
+
+            section = f"[Page {page_number}]\n{page_text}"
+            if not hold_sections:
+                yield section
+                continue
+            held_sections.append(section)
+            if readable_vision_page_count:
+                yield from held_sections
+                held_sections = []
+                hold_sections = False
+
+    if hold_sections:
+        raise DocumentProcessingError(
+            "OpenAI vision found no readable text in the scanned PDF."
+        )
 
-def _process_pdf(file_path):
-    text = _extract_native_pdf_text(file_path)
-    native_word_count = len(text.split())
-    native_character_count = len("".join(text.split()))
-    appears_scanned = native_character_count < PDF_NATIVE_TEXT_MIN_CHARACTERS
+    if pdf_scan["annotations"]:
+        yield "[Annotations]\n" + "\n".join(pdf_scan["annotations"])
 
-    if appears_scanned:
-        text = extract_scanned_pdf_with_vision(file_path)
+    if not vision_page_numbers:
+        extraction_method = "native_pdf"
+    elif len(vision_page_numbers) == len(native_pages):
         extraction_method = "openai_vision"
     else:
-        extraction_method = "native_pdf"
+        extraction_method = "hybrid_pdf"
+
+    native_text = "\n".join(native_pages)
+    metadata.update(
+        {
+            "page_count": pdf_scan["page_count"],
+            "extraction_method": extraction_method,
+            "used_vision": bool(vision_page_numbers),
+            "appears_scanned": bool(vision_page_numbers),
+            "native_word_count": len(native_text.split()),
+            "native_character_count": len("".join(native_text.split())),
+            "vision_page_count": len(vision_page_numbers),
+            "page_extraction_methods": page_methods,
+            "vision_bytes_before": vision_stats["bytes_before"],
+            "vision_bytes_after": vision_stats["bytes_after"],
+            "vision_skipped_blank_pages": vision_stats["blank_pages"],
+            "vision_reused_pages": vision_stats["reused_pages"],
+            "vision_resumed_pages": vision_stats.get("resumed_pages", 0),
+        }
+    )
 
-    try:
-        annotations = extract_annotations_from_pdf(file_path)
-        if annotations.strip():
-            text += "\n\n[Annotations]\n" + annotations
-    except Exception as exc:
-        print("Annotation merge failed:", exc)
-
-    return text, {
-        "extraction_method": extraction_method,
-        "used_vision": extraction_method == "openai_vision",
-        "appears_scanned": appears_scanned,
-        "native_word_count": native_word_count,
-        "native_character_count": native_character_count,
-    }
 
+def _process_pdf(file_bytes, *, vision_checkpoint=None, max_vision_pages=None):
+    """Return ``(text, decision_metadata)`` for a PDF, merged in page order."""
+    decision_metadata = {}
+    text = "\n\n".join(
+        _iter_pdf_pages(
+            file_bytes,
+            decision_metadata,
+            vision_checkpoint=vision_checkpoint,
+            max_vision_pages=max_vision_pages,
+        )
+    )
+    return text, decision_metadata
 
-def extract_text_from_pdf(file_path):
+
+def extract_text_from_pdf(source):
     """Compatibility wrapper that returns only extracted PDF text."""
-    text, _ = _process_pdf(file_path)
+    file_bytes, _ = _read_document_source(source, "document.pdf")
+    text, _ = _process_pdf(file_bytes)
     return text
 
 
-def _extract_docx_text(file_path):
+def _extract_docx_text(file_bytes):
     """Extract ordinary paragraphs and table rows from a Word document."""
-    document = Document(file_path)
+    document = docx.Document(BytesIO(file_bytes))
     text_parts = [
         paragraph.text.strip()
         for paragraph in document.paragraphs
@@ -271,39 +654,95 @@ def _extract_docx_text(file_path):
 
 
 # ─── MAIN HANDLER ───────────────────────────────────────────────────────────────
-def process_document(file_path):
-    """Inspect and extract a document, returning text plus decision metadata."""
-    metadata = inspect_document(file_path)
+def _readable_section(text):
+    """Return a single-section document's text, or fail before it is indexed."""
+    if not text:
+        raise DocumentProcessingError(
+            "No readable text could be extracted from the document."
+        )
+    return text
+
+
+def iter_document_pages(
+    source,
+    *,
+    file_name=None,
+    vision_checkpoint=None,
+    max_vision_pages=None,
+    metadata=None,
+):
+    """Yield extracted text sections as soon as each one is ready.
+
+    PDFs yield one ``[Page N]`` section per page in page order, followed by
+    any ``[Annotations]``; other files yield a single stripped section.
+    Joining the sections with blank lines gives the text of
+    ``process_document`` at the same character offsets, so a caller can chunk
+    and index early pages while later ones are still being transcribed.
+    Document and decision metadata are added to ``metadata`` and are complete
+    once the generator is exhausted. A document without readable text fails
+    before its first section is yielded.
+    """
+    if metadata is None:
+        metadata = {}
+    file_bytes, file_name = _read_document_source(source, file_name)
+    metadata.update(
+        inspect_document(
+            file_bytes,
+            file_name=file_name,
+            count_pdf_pages=False,
+        )
+    )
     extension = metadata["extension"]
 
     try:
         if extension == ".txt":
-            with open(file_path, "r", encoding="utf-8") as file_stream:
-                text = file_stream.read()
-            decision_metadata = {
-                "extraction_method": "native_text",
-                "used_vision": False,
-                "appears_scanned": False,
-            }
+            # Match text-mode reading, which normalises Windows line endings.
+            text = file_bytes.decode("utf-8").replace("\r\n", "\n").strip()
+            metadata.update(
+                {
+                    "extraction_method": "native_text",
+                    "used_vision": False,
+                    "appears_scanned": False,
+                }
+            )
+            yield _readable_section(text)
 
         elif extension == ".pdf":
-            text, decision_metadata = _process_pdf(file_path)
+            yield from _iter_pdf_pages(
+                file_bytes,
+                metadata,
+                vision_checkpoint=vision_checkpoint,
+                max_vision_pages=max_vision_pages,
+            )
 
         elif extension == ".docx":
-            text = _extract_docx_text(file_path)
-            decision_metadata = {
-                "extraction_method": "native_docx",
-                "used_vision": False,
-                "appears_scanned": False,
-            }
+            text = _extract_docx_text(file_bytes).strip()
+            metadata.update(
+                {
+                    "extraction_method": "native_docx",
+                    "used_vision": False,
+                    "appears_scanned": False,
+                }
+            )
+            yield _readable_section(text)
 
         elif extension in IMAGE_FILE_EXTENSIONS:
-            text = extract_image_with_vision(file_path)
-            decision_metadata = {
-                "extraction_method": "openai_vision",
-                "used_vision": True,
-                "appears_scanned": True,
-            }
+            vision_stats = _new_vision_stats()
+            text = extract_image_with_vision(
+                file_bytes,
+                file_name=file_name,
+                vision_stats=vision_stats,
+            ).strip()
+            metadata.update(
+                {
+                    "extraction_method": "openai_vision",
+                    "used_vision": True,
+                    "appears_scanned": True,
+                    "vision_bytes_before": vision_stats["bytes_before"],
+                    "vision_bytes_after": vision_stats["bytes_after"],
+                }
+            )
+            yield _readable_section(text)
 
         else:
             raise DocumentProcessingError("The selected file type is not supported.")
@@ -318,19 +757,67 @@ def process_document(file_path):
             "The document could not be processed. Check the app logs."
         ) from exc
 
-    text = text.strip()
+
+_PAGE_SECTION = re.compile(r"\[Page (\d+)\]\n")
+_SECTION_BREAK = re.compile(r"\n\n(?=\[(?:Page \d+|Annotations)\]\n)")
+
+
+def section_page_number(section):
+    """Return the page number of a ``[Page N]`` section, or None."""
+    match = _PAGE_SECTION.match(section)
+    return int(match.group(1)) if match else None
+
+
+def split_extracted_sections(text):
+    """Split stored extracted text back into its ``[Page N]`` sections.
+
+    Joining the result with ``"\n\n"`` gives back ``text`` exactly, so chunk
+    offsets and pages match an index built while the document was extracted.
+    """
+    return _SECTION_BREAK.split(text)
+
+
+def assemble_extraction(sections, metadata):
+    """Join sections from ``iter_document_pages`` into a processing result."""
+    text = "\n\n".join(sections).strip()
     if not text:
         raise DocumentProcessingError(
             "No readable text could be extracted from the document."
         )
 
-    metadata.update(decision_metadata)
     metadata["extracted_word_count"] = len(text.split())
     metadata["extracted_character_count"] = len(text)
 
     return {"text": text, "metadata": metadata}
 
 
-def extract_text_from_file(file_path):
+def process_document(
+    source,
+    *,
+    file_name=None,
+    vision_checkpoint=None,
+    max_vision_pages=None,
+):
+    """Inspect and extract a document, returning text plus decision metadata.
+
+    ``source`` is a file path, or the upload's bytes, ``BytesIO``, or
+    memoryview together with ``file_name``; in-memory data never touches disk.
+    ``vision_checkpoint`` and ``max_vision_pages`` apply to scanned PDF pages
+    and are normally supplied by ``vision_jobs``.
+    """
+    metadata = {}
+    sections = list(
+        iter_document_pages(
+            source,
+            file_name=file_name,
+            vision_checkpoint=vision_checkpoint,
+            max_vision_pages=max_vision_pages,
+            metadata=metadata,
+        )
+    )
+    return assemble_extraction(sections, metadata)
+
+
+def extract_text_from_file(source, *, file_name=None):
     """Compatibility wrapper that returns only extracted document text."""
-    return process_document(file_path)["text"]
+    return process_document(source, file_name=file_name)["text"]
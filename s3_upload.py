@@ -3,8 +3,6 @@ import mimetypes
 import os
 from pathlib import Path
 
-import boto3
-from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError
 from dotenv import load_dotenv
 import streamlit as st
 
@@ -46,6 +44,8 @@ def _read_aws_credentials():
 
 
 def _create_s3_client():
+    import boto3
+
     access_key, secret_key, session_token = _read_aws_credentials()
     return boto3.client(
         "s3",
@@ -56,13 +56,24 @@ def _create_s3_client():
     )
 
 
+def s3_object_key_for(file_name):
+    """Return the S3 object key ``upload_to_s3`` uses for a file name."""
+    # Never allow a supplied filename to create an unexpected S3 path.
+    return Path(file_name).name
+
+
 def upload_to_s3(file_data, file_name):
     """Upload in-memory file data and return the safe S3 object key."""
+    from botocore.exceptions import (
+        ClientError,
+        NoCredentialsError,
+        PartialCredentialsError,
+    )
+
     if not file_data:
         raise S3UploadError("The selected file is empty.")
 
-    # Never allow a supplied filename to create an unexpected S3 path.
-    object_key = Path(file_name).name
+    object_key = s3_object_key_for(file_name)
     content_type = mimetypes.guess_type(object_key)[0] or "application/octet-stream"
 
     try:
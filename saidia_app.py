@@ -3,7 +3,6 @@ from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import json
 from pathlib import Path
-import tempfile
 import time
 
 import streamlit as st
@@ -12,15 +11,32 @@ from agent_engine import (
     DocumentAgentError,
     NonIncidentDocumentError,
     prepare_incident_case,
+    query_embedding_cache_stats,
     run_document_agent,
 )
 from case_handoff import CaseHandoffError, send_case_to_make
-from rag_pipeline import process_document
-from s3_upload import S3UploadError, upload_to_s3
-from vector_store import chunk_text, embed_chunks
+from qa_engine import EMBEDDING_WARMUP, start_embedding_warmup
+from rag_pipeline import (
+    EXTRACTOR_VERSION,
+    VisionPageLimitError,
+    load_cached_extraction,
+)
+from document_indexing import (
+    background_indexing_progress,
+    start_background_indexing,
+    wait_for_background_indexing,
+)
+from s3_upload import S3UploadError, s3_object_key_for, upload_to_s3
+from vector_store import chunk_text
+from vision_jobs import (
+    process_document_resumably,
+    start_background_vision_job,
+    vision_job_progress,
+)
 from database import (
     document_has_embeddings,
-    save_document_chunks,
+    mark_document_failed,
+    start_document_processing,
     upsert_document,
 )
 
@@ -31,6 +47,11 @@ try:
 except RuntimeError:
     asyncio.set_event_loop(asyncio.new_event_loop())
 
+# The first run of the script in a new process starts the warm-up; later
+# reruns and sessions get the same one back.
+if EMBEDDING_WARMUP:
+    start_embedding_warmup()
+
 
 DOCUMENT_STATE_KEYS = [
     "processing_requested",
@@ -49,6 +70,7 @@ DOCUMENT_STATE_KEYS = [
     "incident_workflow_error",
     "non_incident_message",
     "processing_timings",
+    "background_vision_job",
 ]
 
 
@@ -70,12 +92,18 @@ def render_agent_trace(tool_trace):
             )
 
 
-def process_uploaded_bytes(file_data, file_name):
-    """Process the original upload bytes without downloading the S3 copy."""
-    with tempfile.TemporaryDirectory(prefix="saidia-processing-") as temp_dir:
-        local_path = Path(temp_dir) / Path(file_name).name
-        local_path.write_bytes(file_data)
-        return process_document(str(local_path))
+def process_uploaded_bytes(file_data, file_name, document_id):
+    """Process the original upload bytes in memory without an S3 download.
+
+    Pages are chunked, embedded, and saved to the document as they are
+    extracted. Scanned pages are checkpointed, so a retry after an API error
+    resumes from the last finished page instead of paying for every page again.
+    """
+    return process_document_resumably(
+        file_data,
+        file_name,
+        document_id=document_id,
+    )
 
 
 def timed_call(function, *args):
@@ -85,6 +113,16 @@ def timed_call(function, *args):
     return result, time.perf_counter() - started_at
 
 
+def record_processing_failure(document_id, error):
+    """Mark an interrupted extraction as failed without hiding the app error."""
+    if document_id is None:
+        return
+    try:
+        mark_document_failed(document_id, str(error))
+    except Exception as exc:
+        print("Could not record the processing failure:", type(exc).__name__)
+
+
 def render_incident_case(incident_case):
     """Lead with the workflow result and keep detailed analysis available."""
 
@@ -237,12 +275,23 @@ with st.sidebar:
         "Vision when native text is unavailable."
     )
 
+    st.checkbox(
+        "Force reprocessing",
+        key="force_reprocess",
+        help=(
+            "Extract the file again even if an identical upload was processed "
+            "before. Pages already transcribed by OpenAI Vision with the same "
+            "model and prompt are reused rather than sent again."
+        ),
+    )
+
     if uploaded_file and st.button("🚀 Process Document", key="process_btn"):
         file_data = uploaded_file.getvalue()
         document_hash = hashlib.sha256(file_data).hexdigest()
 
         if (
             document_hash == st.session_state.get("processed_doc_hash")
+            and not st.session_state.get("force_reprocess")
         ):
             st.info("This document is already processed for the current session.")
         else:
@@ -258,6 +307,21 @@ with st.sidebar:
         key="clear_btn",
     )
 
+    background_job = st.session_state.get("background_vision_job")
+    if background_job:
+        progress = vision_job_progress(background_job["document_hash"])
+        if progress:
+            st.caption(
+                f"Background transcription of `{background_job['file_name']}`: "
+                f"{progress['completed_page_count']} of {progress['page_count']} "
+                f"scanned pages ({progress['status']})."
+            )
+            if progress["status"] == "completed":
+                st.caption("Select **Process Document** again to finish processing.")
+            elif progress["status"] == "failed" and progress["last_error"]:
+                st.caption(progress["last_error"])
+        st.button("🔄 Refresh progress", key="refresh_vision_job_btn")
+
 
 # This block runs only for a newly selected document. Once complete, later
 # Streamlit reruns reuse the objects stored in session_state.
@@ -269,70 +333,131 @@ if st.session_state.get("processing_requested"):
     st.info(f"📁 Processing `{file_name}` for the first time in this session.")
     processing_started_at = time.perf_counter()
     processing_timings = {}
+    # Set while a new extraction runs, so a failure can be recorded on it.
+    processing_document_id = None
 
     try:
         with st.status("Preparing document...", expanded=True) as status:
-            status.write(
-                "Uploading to S3 while extracting from the original file..."
-            )
-            with ThreadPoolExecutor(max_workers=2) as executor:
-                upload_future = executor.submit(
-                    timed_call,
-                    upload_to_s3,
-                    file_data,
-                    file_name,
+            cached_extraction = None
+            if not st.session_state.get("force_reprocess"):
+                status.write("Checking for a stored extraction of this file...")
+                cache_started_at = time.perf_counter()
+                cached_extraction = load_cached_extraction(document_hash)
+                processing_timings["Extraction cache lookup"] = (
+                    time.perf_counter() - cache_started_at
+                )
+
+            if cached_extraction is not None:
+                status.write(
+                    "Reusing the stored extraction; the file was processed before."
                 )
-                extraction_future = executor.submit(
-                    timed_call,
-                    process_uploaded_bytes,
-                    file_data,
-                    file_name,
+                extracted_text = cached_extraction["text"]
+                document_metadata = cached_extraction["metadata"]
+                document_id = cached_extraction["document_id"]
+                s3_object_key = cached_extraction["s3_object_key"]
+                chunks = cached_extraction["chunks"]
+            else:
+                status.write(
+                    "Uploading to S3 while extracting and indexing each page..."
                 )
-                processing_result, extraction_seconds = extraction_future.result()
-                s3_object_key, upload_seconds = upload_future.result()
-
-            processing_timings["Text extraction"] = extraction_seconds
-            processing_timings["S3 upload"] = upload_seconds
-            extracted_text = processing_result["text"]
-            document_metadata = processing_result["metadata"]
-            status.write("Saving document metadata to PostgreSQL...")
-
-            database_started_at = time.perf_counter()
-            document_id = upsert_document(
-                document_hash=document_hash,
-                original_file_name=file_name,
-                s3_object_key=s3_object_key,
-                content_type=getattr(
+                database_started_at = time.perf_counter()
+                content_type = getattr(
                     st.session_state.get("uploaded_file"),
                     "type",
                     None,
-                ),
-                size_bytes=len(file_data),
-                document_kind=document_metadata.get("extension"),
-                extraction_method=document_metadata.get("extraction_method"),
-                used_vision=document_metadata.get("used_vision", False),
-                page_count=document_metadata.get("page_count"),
-                extracted_word_count=document_metadata.get("extracted_word_count"),
-                extracted_character_count=document_metadata.get(
-                    "extracted_character_count"
-                ),
-                extracted_text=extracted_text,
-                processing_status="processed",
-            )
-            processing_timings["PostgreSQL persistence"] = (
-                time.perf_counter() - database_started_at
-            )
+                )
+                # The record exists before extraction so that page chunks can
+                # be saved under it while later pages are still being read. A
+                # record from an earlier extraction keeps its data and its
+                # processed status until the new extraction is saved below.
+                document_id = start_document_processing(
+                    document_hash=document_hash,
+                    original_file_name=file_name,
+                    s3_object_key=s3_object_key_for(file_name),
+                    content_type=content_type,
+                    size_bytes=len(file_data),
+                )
+                processing_document_id = document_id
+                # Chunks indexed from an earlier extraction are replaced while
+                # the new pages are indexed; unchanged chunks are not embedded
+                # again and chunks past the new end are deleted.
+                database_seconds = time.perf_counter() - database_started_at
+
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    upload_future = executor.submit(
+                        timed_call,
+                        upload_to_s3,
+                        file_data,
+                        file_name,
+                    )
+                    extraction_future = executor.submit(
+                        timed_call,
+                        process_uploaded_bytes,
+                        file_data,
+                        file_name,
+                        document_id,
+                    )
+                    processing_result, extraction_seconds = (
+                        extraction_future.result()
+                    )
+                    s3_object_key, upload_seconds = upload_future.result()
+
+                processing_timings["Extraction and indexing"] = extraction_seconds
+                processing_timings["S3 upload"] = upload_seconds
+                extracted_text = processing_result["text"]
+                document_metadata = processing_result["metadata"]
+                chunks = processing_result["chunks"]
+                status.write("Saving document metadata to PostgreSQL...")
+
+                database_started_at = time.perf_counter()
+                upsert_document(
+                    document_hash=document_hash,
+                    original_file_name=file_name,
+                    s3_object_key=s3_object_key,
+                    content_type=content_type,
+                    size_bytes=len(file_data),
+                    document_kind=document_metadata.get("extension"),
+                    extraction_method=document_metadata.get("extraction_method"),
+                    used_vision=document_metadata.get("used_vision", False),
+                    page_count=document_metadata.get("page_count"),
+                    extracted_word_count=document_metadata.get(
+                        "extracted_word_count"
+                    ),
+                    extracted_character_count=document_metadata.get(
+                        "extracted_character_count"
+                    ),
+                    extracted_text=extracted_text,
+                    extraction_metadata=document_metadata,
+                    extractor_version=EXTRACTOR_VERSION,
+                    processing_status="processed",
+                )
+                processing_timings["PostgreSQL persistence"] = (
+                    database_seconds + time.perf_counter() - database_started_at
+                )
+                processing_document_id = None
+
             if not extracted_text.strip():
                 raise RuntimeError("No text could be extracted from the document.")
 
-            status.write("Preparing searchable document chunks...")
-            chunking_started_at = time.perf_counter()
-            chunks = chunk_text(extracted_text)
             if not chunks:
-                raise RuntimeError("The extracted document produced no text chunks.")
-            processing_timings["Text chunking"] = (
-                time.perf_counter() - chunking_started_at
-            )
+                status.write("Preparing searchable document chunks...")
+                chunking_started_at = time.perf_counter()
+                chunks = chunk_text(extracted_text)
+                if not chunks:
+                    raise RuntimeError(
+                        "The extracted document produced no text chunks."
+                    )
+                processing_timings["Text chunking"] = (
+                    time.perf_counter() - chunking_started_at
+                )
+
+            if cached_extraction is not None and not document_has_embeddings(
+                document_id
+            ):
+                # Embedding starts now and overlaps incident analysis; the
+                # first question only waits for whatever is still left.
+                status.write("Indexing the stored extraction in the background...")
+                start_background_indexing(extracted_text, document_id=document_id)
 
             st.session_state.processed_doc_hash = document_hash
             st.session_state.processed_file_name = file_name
@@ -341,8 +466,8 @@ if st.session_state.get("processing_requested"):
             st.session_state.extracted_text = extracted_text
             st.session_state.document_metadata = document_metadata
             st.session_state.chunks = chunks
-            # Build embeddings lazily on the first chat question so the Jira
-            # result is not delayed by semantic-search preparation.
+            # New extractions were indexed page by page above; a stored
+            # extraction without embeddings is being indexed in the background.
             st.session_state.chat_messages = []
 
             status.write("Analyzing the incident and preparing its case record...")
@@ -382,12 +507,32 @@ if st.session_state.get("processing_requested"):
             status.update(label="Document processing complete", state="complete")
 
         st.rerun()
+    except VisionPageLimitError as exc:
+        st.session_state.processing_requested = False
+        record_processing_failure(processing_document_id, exc)
+        start_background_vision_job(
+            file_data,
+            file_name,
+            document_hash=document_hash,
+        )
+        st.session_state.background_vision_job = {
+            "document_hash": document_hash,
+            "file_name": file_name,
+        }
+        st.info(
+            f"{exc} This scan is being transcribed as a resumable background "
+            "job instead. Select **Process Document** again once the sidebar "
+            "shows it as completed."
+        )
+        st.stop()
     except S3UploadError as exc:
         st.session_state.processing_requested = False
+        record_processing_failure(processing_document_id, exc)
         st.error(f"❌ Upload to S3 failed: {exc}")
         st.stop()
     except Exception as exc:
         st.session_state.processing_requested = False
+        record_processing_failure(processing_document_id, exc)
         st.error(f"❌ Document processing failed: {exc}")
         st.stop()
 
@@ -408,12 +553,27 @@ if st.session_state.get("processed_doc_hash"):
         document_metadata["extraction_method"].replace("_", " ").title(),
     )
 
-    if document_metadata.get("used_vision"):
+    if document_metadata.get("extraction_method") == "hybrid_pdf":
+        st.caption(
+            f"OpenAI Vision was selected automatically for "
+            f"{document_metadata['vision_page_count']} of "
+            f"{document_metadata['page_count']} pages that did not contain "
+            "enough usable native text."
+        )
+    elif document_metadata.get("used_vision"):
         st.caption(
             "OpenAI Vision was selected automatically because this document "
             "did not contain enough usable native text."
         )
 
+    indexing_progress = background_indexing_progress(st.session_state.document_id)
+    if indexing_progress and not indexing_progress[1]:
+        st.caption(
+            f"Indexing for search: {indexing_progress[0]} of {len(chunks)} "
+            "chunks saved. A question asked now waits only for the rest."
+        )
+        st.button("🔄 Refresh progress", key="refresh_indexing_btn")
+
     processing_timings = st.session_state.get("processing_timings", {})
     if processing_timings:
         with st.expander("⏱️ Processing performance", expanded=False):
@@ -421,6 +581,45 @@ if st.session_state.get("processed_doc_hash"):
                 {"Stage": stage, "Seconds": f"{seconds:.2f}"}
                 for stage, seconds in processing_timings.items()
             ])
+            if document_metadata.get("vision_bytes_after"):
+                st.caption(
+                    "OpenAI Vision payload: "
+                    f"{document_metadata['vision_bytes_after'] / 1024:,.0f} KB "
+                    f"(prepared from "
+                    f"{document_metadata['vision_bytes_before'] / 1024:,.0f} KB)"
+                )
+            chunk_index_stats = document_metadata.get("chunk_index_stats")
+            if chunk_index_stats:
+                st.caption(
+                    f"Indexing embedded {chunk_index_stats['embedded_chunks']} "
+                    f"new chunk(s), reused {chunk_index_stats['reused_chunks']} "
+                    "stored embedding(s), kept "
+                    f"{chunk_index_stats['unchanged_chunks']} unchanged chunk(s), "
+                    f"and removed {chunk_index_stats['deleted_chunks']}."
+                )
+            embedding_throughput = document_metadata.get("embedding_throughput")
+            if embedding_throughput and embedding_throughput["encoded_chunks"]:
+                st.caption(
+                    f"Embedding: {embedding_throughput['encoded_chunks']} chunk(s) "
+                    f"at {embedding_throughput['chunks_per_second']:g} chunks/s "
+                    f"({embedding_throughput['tokens_per_second']:,} tokens/s); "
+                    f"{embedding_throughput['padding_ratio']:.0%} padding."
+                )
+            query_cache_stats = query_embedding_cache_stats()
+            if query_cache_stats["hits"] or query_cache_stats["misses"]:
+                st.caption(
+                    "Search query embeddings: "
+                    f"{query_cache_stats['hits']} cache hit(s), "
+                    f"{query_cache_stats['misses']} encoded."
+                )
+            chunk_token_stats = document_metadata.get("chunk_token_stats")
+            if chunk_token_stats:
+                st.caption(
+                    f"Search chunks: {chunk_token_stats['chunk_count']} averaging "
+                    f"{chunk_token_stats['mean_chunk_tokens']:g} tokens; "
+                    f"{chunk_token_stats['truncated_chunks']} truncated by the "
+                    "embedding model."
+                )
 
     with st.expander("🧠 Preview extracted text", expanded=False):
         st.text_area(
@@ -502,21 +701,31 @@ if st.session_state.get("processed_doc_hash"):
         with st.chat_message("assistant"):
             with st.spinner("The document agent is deciding what to inspect..."):
                 try:
-                    if not document_has_embeddings(st.session_state.document_id):
-                        index_started_at = time.perf_counter()
-
-                        embeddings = embed_chunks(chunks)
-
-                        save_document_chunks(
+                    index_started_at = time.perf_counter()
+                    index_stats = wait_for_background_indexing(
+                        st.session_state.document_id
+                    )
+                    if index_stats is None and not document_has_embeddings(
+                        st.session_state.document_id
+                    ):
+                        start_background_indexing(
+                            extracted_text,
                             document_id=st.session_state.document_id,
-                            chunks=chunks,
-                            embeddings=embeddings,
-                            embedding_model="sentence-transformers/all-mpnet-base-v2",
                         )
-
-                        st.session_state.setdefault("processing_timings", {})[
-                            "Semantic index (first chat)"
-                        ] = time.perf_counter() - index_started_at
+                        index_stats = wait_for_background_indexing(
+                            st.session_state.document_id
+                        )
+                    processing_timings = st.session_state.setdefault(
+                        "processing_timings",
+                        {},
+                    )
+                    if (
+                        index_stats is not None
+                        and "Semantic index wait (first chat)" not in processing_timings
+                    ):
+                        processing_timings["Semantic index wait (first chat)"] = (
+                            time.perf_counter() - index_started_at
+                        )
                     agent_result = run_document_agent(
                         question,
                         file_name=file_name,
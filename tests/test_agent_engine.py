@@ -15,10 +15,13 @@ sys.modules["openai"] = fake_openai
 fake_qa_engine = types.ModuleType("qa_engine")
 fake_qa_engine._read_openai_settings = lambda: ("test-key", "test-model")
 fake_qa_engine.get_embedding_model = lambda: None
+fake_qa_engine.EMBEDDING_MODEL_LABEL = "test-embedding-model+test-backend"
 sys.modules["qa_engine"] = fake_qa_engine
 
 fake_database = types.ModuleType("database")
 fake_database.search_document_chunks = lambda **_kwargs: []
+fake_database.load_document_page_chunks = lambda **_kwargs: []
+fake_database.find_carrier_policies = lambda **_kwargs: []
 sys.modules["database"] = fake_database
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -38,7 +41,15 @@ class ToolSchemaTests(unittest.TestCase):
             self.assertIn("required", tool["parameters"])
 
 
+def clear_query_embedding_cache():
+    agent_engine._query_embedding_cache.clear()
+    agent_engine._query_embedding_cache_counts.update(hits=0, misses=0)
+
+
 class ToolExecutionTests(unittest.TestCase):
+    def setUp(self):
+        clear_query_embedding_cache()
+
     def test_search_document_returns_ranked_excerpts(self):
         captured_search = {}
 
@@ -50,8 +61,8 @@ class ToolExecutionTests(unittest.TestCase):
         def fake_search(**kwargs):
             captured_search.update(kwargs)
             return [
-                (0, "First relevant excerpt", 0.9),
-                (1, "Second relevant excerpt", 0.8),
+                (0, "First relevant excerpt", 0.9, 1, 1),
+                (1, "Second relevant excerpt", 0.8, 1, 2),
             ]
 
         with patch.object(
@@ -77,6 +88,56 @@ class ToolExecutionTests(unittest.TestCase):
         self.assertEqual(captured_search["limit"], 2)
         self.assertEqual(result["result_count"], 2)
         self.assertEqual(result["excerpts"][0]["rank"], 1)
+        self.assertEqual(result["excerpts"][1]["page_start"], 1)
+        self.assertEqual(result["excerpts"][1]["page_end"], 2)
+
+    def test_read_document_page_fetches_chunks_without_a_search(self):
+        captured_lookup = {}
+
+        def fake_page_lookup(**kwargs):
+            captured_lookup.update(kwargs)
+            return [
+                (4, "[Page 3]\nDamage photos attached.", 3, 3),
+                (5, "Claim filed on 2024-05-02.", 3, 4),
+            ]
+
+        with patch.object(
+            agent_engine,
+            "load_document_page_chunks",
+            side_effect=fake_page_lookup,
+        ), patch.object(
+            agent_engine,
+            "get_embedding_model",
+            side_effect=AssertionError("no embedding is needed"),
+        ):
+            result = agent_engine.execute_document_tool(
+                "read_document_page",
+                {"page_number": 3},
+                file_name="claim.pdf",
+                document_metadata={},
+                document_id=42,
+                chunks=[],
+            )
+
+        self.assertEqual(captured_lookup["document_id"], 42)
+        self.assertEqual(captured_lookup["page_number"], 3)
+        self.assertEqual(result["chunk_count"], 2)
+        self.assertEqual(
+            [chunk["chunk_index"] for chunk in result["chunks"]],
+            [4, 5],
+        )
+
+    def test_read_document_page_rejects_invalid_page_numbers(self):
+        result = agent_engine.execute_document_tool(
+            "read_document_page",
+            {"page_number": 0},
+            file_name="claim.pdf",
+            document_metadata={},
+            document_id=42,
+            chunks=[],
+        )
+
+        self.assertIn("error", result)
 
     def test_inspect_document_returns_processing_metadata(self):
         result = agent_engine.execute_document_tool(
@@ -127,7 +188,60 @@ class ToolExecutionTests(unittest.TestCase):
         self.assertEqual(result["match_count"], 1)
 
 
+    def test_repeated_search_queries_reuse_the_cached_embedding(self):
+        encoded_queries = []
+
+        class FakeEmbeddingModel:
+            def encode(self, query):
+                encoded_queries.append(query)
+                return [float(len(encoded_queries)), 0.0]
+
+        captured_embeddings = []
+
+        def fake_search(**kwargs):
+            captured_embeddings.append(kwargs["query_embedding"])
+            return []
+
+        with patch.object(
+            agent_engine,
+            "get_embedding_model",
+            return_value=FakeEmbeddingModel(),
+        ), patch.object(
+            agent_engine,
+            "search_document_chunks",
+            side_effect=fake_search,
+        ), patch.object(agent_engine, "QUERY_EMBEDDING_CACHE_SIZE", 2):
+            for query in (
+                "damaged pallets",
+                "damaged  pallets\n",
+                "carrier liability",
+                "delivery date",
+                "damaged pallets",
+            ):
+                agent_engine.execute_document_tool(
+                    "search_document",
+                    {"query": query, "max_results": 1},
+                    file_name="claim.pdf",
+                    document_metadata={},
+                    document_id=7,
+                    chunks=[],
+                )
+
+        self.assertEqual(
+            encoded_queries,
+            ["damaged pallets", "carrier liability", "delivery date", "damaged pallets"],
+        )
+        self.assertEqual(captured_embeddings[0], captured_embeddings[1])
+        self.assertEqual(
+            agent_engine.query_embedding_cache_stats(),
+            {"hits": 1, "misses": 4, "size": 2, "max_size": 1024},
+        )
+
+
 class AgentLoopTests(unittest.TestCase):
+    def setUp(self):
+        clear_query_embedding_cache()
+
     def test_structured_incident_facts_use_strict_json_schema(self):
         facts = {
             "is_logistics_incident": True,
@@ -157,7 +271,7 @@ class AgentLoopTests(unittest.TestCase):
             "_read_openai_settings",
             return_value=("test-key", "test-model"),
         ), patch.object(
-            agent_engine,
+            agent_engine.openai,
             "OpenAI",
             return_value=fake_client,
         ):
@@ -195,7 +309,7 @@ class AgentLoopTests(unittest.TestCase):
             agent_engine,
             "_read_openai_settings",
             return_value=("test-key", "test-model"),
-        ), patch.object(agent_engine, "OpenAI", return_value=fake_client):
+        ), patch.object(agent_engine.openai, "OpenAI", return_value=fake_client):
             result = agent_engine.extract_incident_facts(
                 "Evidence available: Commercial invoice, damage photographs"
             )
@@ -293,7 +407,7 @@ class AgentLoopTests(unittest.TestCase):
             "_read_openai_settings",
             return_value=("test-key", "test-model"),
         ), patch.object(
-            agent_engine,
+            agent_engine.openai,
             "OpenAI",
             return_value=fake_client,
         ), patch.object(
@@ -303,7 +417,7 @@ class AgentLoopTests(unittest.TestCase):
         ), patch.object(
             agent_engine,
             "search_document_chunks",
-            return_value=[(0, "Aggressive 63 0 25", 0.9)],
+            return_value=[(0, "Aggressive 63 0 25", 0.9, None, None)],
         ):
             result = agent_engine.run_document_agent(
                 "What can you tell me about this document?",
@@ -0,0 +1,551 @@
+import threading
+
+import numpy as np
+import pytest
+
+import backfill_documents
+import document_indexing
+import embedding_cache
+import vector_store
+from vector_store import (
+    chunk_text,
+    chunk_token_statistics,
+    iter_file_chunks,
+    iter_text_chunks,
+)
+
+
+class _WordTokenizer:
+    """Counts one token per word, and two for hyphenated words."""
+
+    def __call__(self, texts, add_special_tokens=True):
+        special_tokens = [0, 0] if add_special_tokens else []
+        return {
+            "input_ids": [
+                special_tokens
+                + [1 for word in text.split() for _ in word.split("-")]
+                for text in texts
+            ]
+        }
+
+
+@pytest.fixture(autouse=True)
+def word_tokenizer(monkeypatch):
+    monkeypatch.setattr(vector_store, "get_embedding_tokenizer", _WordTokenizer)
+
+
+@pytest.fixture(autouse=True)
+def empty_chunk_store(monkeypatch):
+    monkeypatch.setattr(document_indexing, "load_document_chunk_state", lambda _id: {})
+    monkeypatch.setattr(
+        document_indexing,
+        "delete_document_chunks_from",
+        lambda _id, _count: 0,
+    )
+
+
+def _fake_embeddings(chunks, **_kwargs):
+    return np.zeros((len(chunks), 4), dtype=np.float32)
+
+
+def _sentence(label, word_count):
+    return " ".join(f"{label}w{index}" for index in range(word_count)) + "."
+
+
+def test_chunks_keep_sentences_whole_within_the_token_budget():
+    sentences = [_sentence(f"s{index}", 30) for index in range(10)]
+    text = " ".join(sentences)
+
+    chunks = chunk_text(text, max_tokens=100, overlap_tokens=30)
+
+    assert chunks == [
+        " ".join(sentences[0:3]),
+        " ".join(sentences[2:5]),
+        " ".join(sentences[4:7]),
+        " ".join(sentences[6:9]),
+        " ".join(sentences[8:10]),
+    ]
+    stats = chunk_token_statistics(chunks)
+    assert stats["max_chunk_tokens"] == 92
+    assert stats["truncated_chunks"] == 0
+
+
+def test_tokens_are_counted_with_the_model_tokenizer():
+    """Hyphenated words cost two tokens here, so fewer fit in one chunk."""
+    text = " ".join(["plain."] * 10 + ["half-token."] * 10)
+
+    chunks = chunk_text(text, max_tokens=10, overlap_tokens=0)
+
+    assert chunks == [" ".join(["plain."] * 10)] + [" ".join(["half-token."] * 5)] * 2
+
+
+def test_long_sentences_are_split_between_words_to_fit():
+    sentence = _sentence("long", 250)
+
+    chunks = chunk_text(sentence, max_tokens=100, overlap_tokens=0)
+
+    assert [len(chunk.split()) for chunk in chunks] == [100, 100, 50]
+    assert " ".join(chunks) == sentence
+
+
+def test_truncation_statistics_count_tokens_beyond_the_model_limit():
+    stats = chunk_token_statistics(["word " * 390, "word " * 10])
+
+    assert stats["chunk_count"] == 2
+    assert stats["max_chunk_tokens"] == 392
+    assert stats["truncated_chunks"] == 1
+    assert stats["truncated_tokens"] == 392 - vector_store.EMBEDDING_MAX_TOKENS
+
+
+def test_streamed_chunks_match_chunking_the_joined_text():
+    pages = [
+        " ".join(_sentence(f"p{page}s{index}", 17) for index in range(count))
+        for page, count in enumerate([0, 5, 31, 1, 22])
+    ]
+
+    streamed_chunks = list(iter_text_chunks(pages, max_tokens=100, overlap_tokens=30))
+    joined_text = "\n\n".join(pages)
+
+    assert [chunk.text for chunk in streamed_chunks] == chunk_text(
+        joined_text,
+        max_tokens=100,
+        overlap_tokens=30,
+    )
+    for chunk in streamed_chunks:
+        assert chunk.text == joined_text[chunk.start:chunk.end]
+
+
+def test_chunks_are_offsets_into_the_original_text():
+    text = "First line\n\nSecond sentence here.  Third one!\n" * 40
+    chunks = list(iter_text_chunks([text], max_tokens=20, overlap_tokens=5))
+
+    assert chunks[0].start == 0
+    assert chunks[-1].end == len(text.rstrip())
+    for chunk in chunks:
+        # Chunks share the caller's string instead of copying it.
+        assert chunk._source is text
+        assert chunk.text == text[chunk.start:chunk.end]
+        assert chunk.text == chunk.text.strip()
+
+
+def test_text_files_are_chunked_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "FILE_CHUNK_BLOCK_CHARACTERS", 37)
+    text = "".join(
+        f"Line {index} of the incident log. Status: open\n" for index in range(200)
+    )
+    file_path = tmp_path / "log.txt"
+    file_path.write_text(text, encoding="utf-8")
+
+    chunks = list(iter_file_chunks(file_path, max_tokens=50, overlap_tokens=10))
+
+    assert [chunk.text for chunk in chunks] == chunk_text(
+        text,
+        max_tokens=50,
+        overlap_tokens=10,
+    )
+    assert all(chunk.text == text[chunk.start:chunk.end] for chunk in chunks)
+
+
+def test_early_pages_are_saved_before_later_pages_are_extracted(monkeypatch):
+    """A slow later page must not hold back chunks that are already complete."""
+    first_batch_saved = threading.Event()
+    saved_batches = []
+
+    def fake_save(*, chunks, chunk_indexes, **_kwargs):
+        saved_batches.append((chunk_indexes[0], list(chunks)))
+        first_batch_saved.set()
+
+    monkeypatch.setattr(document_indexing, "save_document_chunks", fake_save)
+    monkeypatch.setattr(vector_store, "embed_chunks", _fake_embeddings)
+
+    early_page = " ".join(_sentence(f"early{index}", 50) for index in range(20))
+    late_page = " ".join(_sentence(f"late{index}", 50) for index in range(10))
+    early_page_was_searchable = []
+
+    def pages():
+        yield early_page
+        # Stands in for a scanned page that is still being transcribed.
+        early_page_was_searchable.append(first_batch_saved.wait(timeout=5))
+        yield late_page
+
+    chunks = document_indexing.index_document_pages(pages(), document_id=7)
+
+    assert early_page_was_searchable == [True]
+    chunk_texts = [record["text"] for record in chunks]
+    assert chunk_texts == chunk_text(f"{early_page}\n\n{late_page}")
+    saved_chunks = []
+    for start_index, batch in saved_batches:
+        assert start_index == len(saved_chunks)
+        saved_chunks.extend(batch)
+    assert saved_chunks == chunk_texts
+
+
+def test_indexed_processing_returns_the_same_extraction(monkeypatch):
+    from rag_pipeline import process_document
+
+    monkeypatch.setattr(document_indexing, "save_document_chunks", lambda **_: None)
+    monkeypatch.setattr(vector_store, "embed_chunks", _fake_embeddings)
+    file_data = ("Incident report line.\r\n" * 200).encode("utf-8")
+
+    result = document_indexing.process_and_index_document(
+        file_data,
+        document_id=3,
+        file_name="incident.txt",
+    )
+    expected = process_document(file_data, file_name="incident.txt")
+
+    assert result["text"] == expected["text"]
+    assert result["chunks"] == chunk_text(expected["text"])
+    assert result["chunks"] == [
+        expected["text"][start:end] for start, end in result["chunk_offsets"]
+    ]
+    assert result["metadata"].pop("chunk_token_stats")["truncated_chunks"] == 0
+    index_stats = result["metadata"].pop("chunk_index_stats")
+    result["metadata"].pop("embedding_throughput")
+    assert index_stats["unchanged_chunks"] == 0
+    assert index_stats["embedded_chunks"] + index_stats["reused_chunks"] == len(
+        result["chunks"]
+    )
+    assert result["metadata"] == expected["metadata"]
+
+
+def test_indexed_chunks_record_the_pages_they_cover(monkeypatch):
+    saved_pages = []
+    saved_offsets = []
+
+    def fake_save(*, chunks, chunk_offsets, chunk_pages, **_kwargs):
+        saved_offsets.extend(chunk_offsets)
+        saved_pages.extend(chunk_pages)
+
+    monkeypatch.setattr(document_indexing, "save_document_chunks", fake_save)
+    monkeypatch.setattr(vector_store, "embed_chunks", _fake_embeddings)
+    sections = [
+        f"[Page {page}]\n" + " ".join(_sentence(f"p{page}s{index}", 20) for index in range(6))
+        for page in (1, 2, 3)
+    ] + ["[Annotations]\nReviewed."]
+    text = "\n\n".join(sections)
+
+    chunk_records = document_indexing.index_document_pages(
+        iter(sections),
+        document_id=1,
+        max_batch_chunks=1,
+    )
+
+    assert saved_pages == [
+        (record["page_start"], record["page_end"]) for record in chunk_records
+    ]
+    assert saved_offsets == [
+        (record["start"], record["end"]) for record in chunk_records
+    ]
+    for record in chunk_records:
+        assert record["text"] == text[record["start"]:record["end"]]
+        covered_pages = {
+            int(marker.split()[1].rstrip("]"))
+            for marker in record["text"].split("\n")
+            if marker.startswith("[Page ")
+        }
+        for page in covered_pages:
+            assert record["page_start"] <= page <= record["page_end"]
+    assert chunk_records[0]["page_start"] == 1
+    assert chunk_records[-1]["page_end"] == 3
+
+
+def test_reindexing_embeds_only_new_or_changed_chunks(monkeypatch):
+    stored_rows = {}
+    embedded_texts = []
+
+    def fake_load(_document_id):
+        return {index: dict(row) for index, row in stored_rows.items()}
+
+    def fake_save(*, chunks, embeddings, embedding_model, chunk_indexes, chunk_offsets, chunk_pages, **_kwargs):
+        for index, chunk, embedding, offsets, pages in zip(
+            chunk_indexes, chunks, embeddings, chunk_offsets, chunk_pages
+        ):
+            stored_rows[index] = {
+                "content_hash": document_indexing.chunk_content_hash(chunk),
+                "embedding_model": embedding_model,
+                "embedding": embedding,
+                "start_offset": offsets[0],
+                "end_offset": offsets[1],
+                "page_start": pages[0],
+                "page_end": pages[1],
+            }
+
+    def fake_delete(_document_id, chunk_count):
+        orphaned = [index for index in stored_rows if index >= chunk_count]
+        for index in orphaned:
+            del stored_rows[index]
+        return len(orphaned)
+
+    def fake_embed(chunks, **_kwargs):
+        embedded_texts.extend(chunks)
+        return _fake_embeddings(chunks)
+
+    monkeypatch.setattr(document_indexing, "load_document_chunk_state", fake_load)
+    monkeypatch.setattr(document_indexing, "save_document_chunks", fake_save)
+    monkeypatch.setattr(document_indexing, "delete_document_chunks_from", fake_delete)
+    monkeypatch.setattr(vector_store, "embed_chunks", fake_embed)
+
+    pages = [
+        f"[Page {page}]\n" + " ".join(_sentence(f"p{page}s{index}", 60) for index in range(5))
+        for page in range(1, 5)
+    ]
+    first_stats = {}
+    first_records = document_indexing.index_document_pages(
+        iter(pages),
+        document_id=1,
+        index_stats=first_stats,
+    )
+    assert first_stats["embedded_chunks"] == len(first_records)
+
+    # A revised document: the last page is edited and the last page removed.
+    revised_pages = pages[:2] + [pages[2].replace("p3s4w0", "edited")]
+    embedded_texts.clear()
+    revised_stats = {}
+    revised_records = document_indexing.index_document_pages(
+        iter(revised_pages),
+        document_id=1,
+        index_stats=revised_stats,
+    )
+
+    changed_texts = [
+        record["text"] for record in revised_records
+        if record["text"] not in {first["text"] for first in first_records}
+    ]
+    assert embedded_texts == changed_texts
+    assert revised_stats["embedded_chunks"] == len(changed_texts)
+    assert revised_stats["unchanged_chunks"] > 0
+    assert revised_stats["deleted_chunks"] == len(first_records) - len(revised_records)
+    assert sorted(stored_rows) == list(range(len(revised_records)))
+
+
+@pytest.mark.parametrize("pages_before_failure", [0, 2])
+def test_failed_extraction_keeps_the_stored_chunks(monkeypatch, pages_before_failure):
+    stored_rows = {}
+    deleted_from = []
+
+    def fake_save(*, chunks, embedding_model, chunk_indexes, chunk_offsets, chunk_pages, **_kwargs):
+        for index, chunk, offsets, pages in zip(
+            chunk_indexes, chunks, chunk_offsets, chunk_pages
+        ):
+            stored_rows[index] = {
+                "content_hash": document_indexing.chunk_content_hash(chunk),
+                "embedding_model": embedding_model,
+                "embedding": None,
+                "start_offset": offsets[0],
+                "end_offset": offsets[1],
+                "page_start": pages[0],
+                "page_end": pages[1],
+            }
+
+    def fake_delete(_document_id, chunk_count):
+        deleted_from.append(chunk_count)
+        return 0
+
+    monkeypatch.setattr(
+        document_indexing,
+        "load_document_chunk_state",
+        lambda _id: {index: dict(row) for index, row in stored_rows.items()},
+    )
+    monkeypatch.setattr(document_indexing, "save_document_chunks", fake_save)
+    monkeypatch.setattr(document_indexing, "delete_document_chunks_from", fake_delete)
+    monkeypatch.setattr(vector_store, "embed_chunks", _fake_embeddings)
+
+    pages = [
+        f"[Page {page}]\n" + " ".join(_sentence(f"p{page}s{index}", 60) for index in range(5))
+        for page in range(1, 5)
+    ]
+    document_indexing.index_document_pages(iter(pages), document_id=1)
+    rows_before = {index: dict(row) for index, row in stored_rows.items()}
+    deleted_from.clear()
+
+    def failing_pages():
+        yield from pages[:pages_before_failure]
+        raise RuntimeError("Vision transcription failed")
+
+    with pytest.raises(RuntimeError, match="Vision transcription failed"):
+        document_indexing.index_document_pages(failing_pages(), document_id=1)
+
+    assert deleted_from == []
+    assert stored_rows == rows_before
+
+
+def test_embedding_cache_encodes_repeated_boilerplate_once(monkeypatch):
+    encoded_texts = []
+
+    class FakeModel:
+        def encode(self, texts, **_kwargs):
+            encoded_texts.extend(texts)
+            return np.array(
+                [[len(text), 1.0] for text in texts],
+                dtype=np.float32,
+            )
+
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_USE_DATABASE", False)
+    monkeypatch.setattr(embedding_cache, "_memory_cache", embedding_cache.OrderedDict())
+    monkeypatch.setattr(vector_store, "get_embedding_model", FakeModel)
+
+    footer = "Carrier liability is limited to the declared value."
+    first = vector_store.embed_chunks(["Invoice 1042 is overdue.", footer, footer])
+    second = vector_store.embed_chunks(
+        ["Carrier liability is limited\nto the declared value.", "Claim form A."]
+    )
+
+    assert encoded_texts == ["Invoice 1042 is overdue.", footer, "Claim form A."]
+    assert first.shape == (3, 2)
+    np.testing.assert_array_equal(second[0], first[1])
+
+
+def test_embedding_cache_evicts_least_recently_used_entries(monkeypatch):
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_USE_DATABASE", False)
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_MAX_ENTRIES", 2)
+    monkeypatch.setattr(embedding_cache, "_memory_cache", embedding_cache.OrderedDict())
+
+    embedding_cache.store_embeddings("model", {"older": [1.0], "newer": [2.0]})
+    embedding_cache.read_cached_embeddings("model", ["older"])
+    embedding_cache.store_embeddings("model", {"newest": [3.0]})
+
+    assert embedding_cache.read_cached_embeddings(
+        "model", ["older", "newer", "newest"]
+    ) == {"older": [1.0], "newest": [3.0]}
+
+
+def test_background_indexing_of_stored_text_matches_streamed_indexing(monkeypatch):
+    saved_records = []
+    save_allowed = threading.Event()
+
+    def fake_save(*, chunks, chunk_offsets, chunk_pages, **_kwargs):
+        save_allowed.wait(timeout=5)
+        saved_records.extend(zip(chunks, chunk_offsets, chunk_pages))
+
+    monkeypatch.setattr(document_indexing, "save_document_chunks", fake_save)
+    monkeypatch.setattr(vector_store, "embed_chunks", _fake_embeddings)
+    monkeypatch.setattr(document_indexing, "_background_jobs", {})
+    sections = [
+        f"[Page {page}]\n" + " ".join(_sentence(f"p{page}s{index}", 30) for index in range(8))
+        for page in (1, 2, 3)
+    ] + ["[Annotations]\nReviewed."]
+    text = "\n\n".join(sections)
+
+    assert document_indexing.split_extracted_sections(text) == sections
+    assert document_indexing.wait_for_background_indexing(5) is None
+
+    future = document_indexing.start_background_indexing(text, document_id=5)
+    assert document_indexing.start_background_indexing(text, document_id=5) is future
+    assert document_indexing.background_indexing_progress(5) == (0, False)
+    save_allowed.set()
+
+    index_stats = document_indexing.wait_for_background_indexing(5)
+
+    expected_records = document_indexing.index_document_pages(
+        iter(sections),
+        document_id=6,
+    )
+    assert [
+        (record["text"], (record["start"], record["end"]), (record["page_start"], record["page_end"]))
+        for record in expected_records
+    ] == saved_records[: len(expected_records)]
+    assert index_stats["indexed_chunks"] == len(expected_records)
+    # The finished job is forgotten once its result has been read.
+    assert document_indexing.background_indexing_progress(5) is None
+    assert document_indexing.wait_for_background_indexing(5) is None
+
+
+def test_chunks_are_encoded_in_length_sorted_batches(monkeypatch):
+    encoded_batches = []
+
+    class FakeModel:
+        def encode(self, texts, batch_size, **_kwargs):
+            assert batch_size == len(texts)
+            encoded_batches.append([len(text.split()) for text in texts])
+            return [[len(text.split()), 0.5] for text in texts]
+
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_USE_DATABASE", False)
+    monkeypatch.setattr(embedding_cache, "_memory_cache", embedding_cache.OrderedDict())
+    monkeypatch.setattr(vector_store, "get_embedding_model", FakeModel)
+    monkeypatch.setattr(vector_store, "EMBEDDING_BATCH_SIZE", 2)
+    word_counts = [7, 1, 5, 3, 6]
+    chunks = [_sentence(f"c{index}", count) for index, count in enumerate(word_counts)]
+    embedding_stats = vector_store.new_embedding_stats()
+
+    embeddings = vector_store.embed_chunks(chunks, embedding_stats=embedding_stats)
+
+    assert encoded_batches == [[1, 3], [5, 6], [7]]
+    assert embeddings.dtype == np.float32
+    assert embeddings[:, 0].tolist() == word_counts
+    assert embedding_stats["encoded_chunks"] == 5
+    assert embedding_stats["encoded_tokens"] == sum(word_counts)
+    assert embedding_stats["padded_tokens"] == 3 * 2 + 6 * 2 + 7
+    throughput = vector_store.embedding_throughput(embedding_stats)
+    assert throughput["padding_ratio"] == round(1 - 22 / 25, 3)
+
+
+def test_backfill_embeds_and_saves_only_changed_chunks(monkeypatch):
+    pages = [
+        f"[Page {page}]\n" + " ".join(_sentence(f"p{page}s{index}", 60) for index in range(5))
+        for page in range(1, 4)
+    ]
+    chunk_records = list(document_indexing.iter_chunk_records(pages))
+    # Every chunk but the last is already stored with the current model.
+    stored_rows = {
+        index: {
+            "content_hash": document_indexing.chunk_content_hash(record["text"]),
+            "embedding_model": document_indexing.DOCUMENT_EMBEDDING_MODEL,
+            "embedding": np.ones(4, dtype=np.float32),
+            "start_offset": record["start"],
+            "end_offset": record["end"],
+            "page_start": record["page_start"],
+            "page_end": record["page_end"],
+        }
+        for index, record in enumerate(chunk_records[:-1])
+    }
+    pool_texts = []
+    saved_indexes = []
+
+    def fake_pool(jobs, **_kwargs):
+        for document_id, texts in jobs:
+            pool_texts.extend(texts)
+            yield document_id, _fake_embeddings(texts)
+
+    def fake_save(*, chunk_indexes, **_kwargs):
+        saved_indexes.extend(chunk_indexes)
+
+    monkeypatch.setattr(
+        backfill_documents,
+        "load_extracted_text",
+        lambda _id: "\n\n".join(pages),
+    )
+    monkeypatch.setattr(
+        backfill_documents,
+        "load_document_chunk_state",
+        lambda _id: stored_rows,
+    )
+    monkeypatch.setattr(backfill_documents, "iter_pool_embeddings", fake_pool)
+    monkeypatch.setattr(document_indexing, "save_document_chunks", fake_save)
+
+    saved_count, _ = backfill_documents.backfill_documents([(1, "scan.pdf")])
+
+    assert pool_texts == [chunk_records[-1]["text"]]
+    assert saved_indexes == [len(chunk_records) - 1]
+    assert saved_count == 1
+
+
+def test_policy_chunks_without_offsets_share_the_change_detection():
+    chunks = ["Claims close after 30 days.", "Refunds take 5 days."]
+    stored_chunks = {
+        0: {
+            "content_hash": document_indexing.chunk_content_hash(chunks[0]),
+            "embedding_model": document_indexing.DOCUMENT_EMBEDDING_MODEL,
+            "embedding": np.ones(4, dtype=np.float32),
+        },
+    }
+
+    changed_records = document_indexing.changed_chunk_records(
+        [{"text": chunk} for chunk in chunks],
+        stored_chunks,
+    )
+
+    assert [chunk_index for chunk_index, _, _ in changed_records] == [1]
+    assert list(document_indexing.reusable_chunk_embeddings(stored_chunks)) == [
+        stored_chunks[0]["content_hash"]
+    ]
@@ -0,0 +1,43 @@
+import numpy as np
+
+import embedding_pool
+import vector_store
+
+
+def test_pool_reassembles_sharded_jobs_in_chunk_order(monkeypatch):
+    encoded_shards = []
+
+    def fake_embed(chunks, embedding_stats=None):
+        encoded_shards.append(list(chunks))
+        embedding_stats["encoded_chunks"] += len(chunks)
+        return np.array([[float(chunk.split("-")[1]), 1.0] for chunk in chunks])
+
+    monkeypatch.setattr(vector_store, "embed_chunks", fake_embed)
+    jobs = [
+        ("long", [f"long-{index}" for index in range(7)]),
+        ("empty", []),
+        ("short", ["short-100", "short-101"]),
+    ]
+    embedding_stats = vector_store.new_embedding_stats()
+
+    results = list(
+        embedding_pool.iter_pool_embeddings(
+            iter(jobs),
+            max_workers=1,
+            shard_chunks=3,
+            embedding_stats=embedding_stats,
+        )
+    )
+
+    assert encoded_shards == [
+        ["long-0", "long-1", "long-2"],
+        ["long-3", "long-4", "long-5"],
+        ["long-6", "short-100", "short-101"],
+    ]
+    assert [key for key, _ in results] == ["long", "empty", "short"]
+    embeddings = dict(results)
+    assert embeddings["long"].dtype == np.float32
+    assert embeddings["long"][:, 0].tolist() == list(range(7))
+    assert embeddings["empty"].shape[0] == 0
+    assert embeddings["short"][:, 0].tolist() == [100, 101]
+    assert embedding_stats["encoded_chunks"] == 9
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy as np
+import pytest
+
+import embedding_service
+
+
+class _LengthModel:
+    """Embeds each text as ``[len(text), 1]`` and records every encode call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, **_kwargs):
+        self.calls.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts])
+
+
+@pytest.fixture
+def running_service(tmp_path):
+    model = _LengthModel()
+    url = f"unix://{tmp_path / 'embedding.sock'}"
+    server = embedding_service.create_embedding_server(
+        url,
+        model,
+        window_seconds=0.2,
+        max_batch=64,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield url, model, server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_requests_share_one_model_batch(running_service):
+    url, model, server = running_service
+    client = embedding_service.EmbeddingServiceClient(url)
+    requests = [["a" * length for length in (3, 1, 2)], ["bbbbb"], ["cccc", "cc"]]
+
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        results = list(executor.map(client.encode, requests))
+
+    for texts, embeddings in zip(requests, results):
+        assert embeddings.dtype == np.float32
+        assert embeddings[:, 0].tolist() == [len(text) for text in texts]
+    assert len(model.calls) == 1
+    assert [len(text) for text in model.calls[0]] == [1, 2, 2, 3, 4, 5]
+    stats = server.batcher.stats()
+    assert (stats["requests"], stats["batches"], stats["texts"]) == (3, 1, 6)
+    assert stats["mean_batch_texts"] == 6.0
+
+
+def test_single_sentence_returns_one_vector_over_http():
+    model = _LengthModel()
+    server = embedding_service.create_embedding_server(
+        "http://127.0.0.1:0",
+        model,
+        window_seconds=0,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        host, port = server.server_address
+        client = embedding_service.EmbeddingServiceClient(f"http://{host}:{port}")
+
+        assert client.encode("query").tolist() == [5.0, 1.0]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_client_reports_an_unreachable_service(tmp_path):
+    client = embedding_service.EmbeddingServiceClient(
+        f"unix://{tmp_path / 'missing.sock'}",
+    )
+
+    with pytest.raises(RuntimeError, match="not reachable"):
+        client.encode(["text"])
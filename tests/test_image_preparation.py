@@ -0,0 +1,156 @@
+import os
+import unittest
+
+import fitz
+import numpy as np
+
+from image_preparation import (
+    PAGE_CHECK_LONG_SIDE,
+    is_blank_page,
+    is_duplicate_page,
+    page_thumbnail,
+    perceptual_hash,
+    prepare_pdf_page,
+    prepare_uploaded_image,
+    render_scale_for_size,
+)
+
+
+def _photo_bytes(width, height):
+    """Create a noisy RGB image that does not compress well as PNG."""
+    samples = os.urandom(width * height * 3)
+    return fitz.Pixmap(fitz.csRGB, width, height, samples, 0).tobytes("png")
+
+
+class RenderScaleTests(unittest.TestCase):
+    def test_letter_page_is_rendered_at_the_model_short_side(self):
+        scale = render_scale_for_size(612, 792)
+
+        self.assertAlmostEqual(612 * scale, 768)
+
+    def test_long_pages_stay_within_the_model_long_side(self):
+        scale = render_scale_for_size(600, 6000)
+
+        self.assertAlmostEqual(6000 * scale, 2048)
+
+
+class PreparedPayloadTests(unittest.TestCase):
+    def test_pdf_page_reports_payload_sizes(self):
+        with fitz.open() as document:
+            page = document.new_page(width=612, height=792)
+            page.insert_text((72, 72), "Proof of delivery", fontsize=14)
+
+            image_bytes, mime_type, stats = prepare_pdf_page(page)
+
+        self.assertIn(mime_type, {"image/png", "image/jpeg"})
+        self.assertEqual(stats["bytes_after"], len(image_bytes))
+        self.assertLessEqual(stats["bytes_after"], stats["bytes_before"])
+
+    def test_oversized_photo_is_downsampled_before_upload(self):
+        original = _photo_bytes(3000, 1200)
+
+        image_bytes, _mime_type, stats = prepare_uploaded_image(
+            original,
+            "image/png",
+        )
+
+        prepared = fitz.Pixmap(image_bytes)
+        self.assertEqual((prepared.width, prepared.height), (1920, 768))
+        self.assertEqual(stats["bytes_before"], len(original))
+        self.assertLess(stats["bytes_after"], stats["bytes_before"])
+
+    def test_small_jpeg_is_sent_unchanged(self):
+        original = fitz.Pixmap(_photo_bytes(400, 300)).tobytes("jpg")
+
+        image_bytes, mime_type, stats = prepare_uploaded_image(
+            original,
+            "image/jpeg",
+        )
+
+        self.assertEqual(image_bytes, original)
+        self.assertEqual(mime_type, "image/jpeg")
+        self.assertEqual(stats["bytes_before"], stats["bytes_after"])
+
+
+def _offset_thumbnail(page, columns, rows):
+    """Render a page thumbnail moved by a fraction of a pixel, like a rescan."""
+    scale = PAGE_CHECK_LONG_SIDE / max(page.rect.width, page.rect.height)
+    pixmap = page.get_pixmap(
+        matrix=fitz.Matrix(scale, 0, 0, scale, columns, rows),
+        colorspace=fitz.csGRAY,
+        alpha=False,
+    )
+    samples = np.frombuffer(pixmap.samples, dtype=np.uint8)
+    return samples.reshape(pixmap.height, pixmap.stride)[:, : pixmap.width]
+
+
+def _with_scanner_noise(thumbnail, sigma=3, seed=0):
+    noise = np.random.default_rng(seed).normal(0, sigma, thumbnail.shape)
+    return np.clip(thumbnail + noise, 0, 255).astype(np.uint8)
+
+
+class PageCheckTests(unittest.TestCase):
+    def _form_page(self, document, amount, offset=(0, 0)):
+        page = document.new_page()
+        for row in range(20):
+            page.insert_text((72, 72 + row * 30), f"Field {row}: ________", fontsize=11)
+        page.insert_text((250, 222), amount, fontsize=11)
+        return _offset_thumbnail(page, *offset)
+
+    def _assert_duplicate(self, thumbnail, other_thumbnail, expected=True):
+        self.assertEqual(
+            is_duplicate_page(
+                thumbnail,
+                perceptual_hash(thumbnail),
+                other_thumbnail,
+                perceptual_hash(other_thumbnail),
+            ),
+            expected,
+        )
+
+    def test_blank_page_is_detected_but_a_signature_line_is_not(self):
+        with fitz.open() as document:
+            blank = page_thumbnail(document.new_page())
+            signed_page = document.new_page()
+            signed_page.insert_text((72, 400), "Signed 2024-03-01", fontsize=9)
+            signed = page_thumbnail(signed_page)
+
+        self.assertTrue(is_blank_page(blank))
+        self.assertFalse(is_blank_page(signed))
+
+    def test_only_identical_form_pages_are_duplicates(self):
+        with fitz.open() as document:
+            first = self._form_page(document, "EUR 240.00")
+            copy = self._form_page(document, "EUR 240.00")
+            changed = self._form_page(document, "EUR 245.00")
+
+        self._assert_duplicate(copy, first)
+        self._assert_duplicate(changed, first, expected=False)
+
+    def test_shifted_and_noisy_rescans_are_duplicates(self):
+        with fitz.open() as document:
+            first = self._form_page(document, "EUR 240.00")
+            half_pixel = self._form_page(document, "EUR 240.00", offset=(0.5, 0.5))
+            shifted = self._form_page(document, "EUR 240.00", offset=(1.5, -1.5))
+            changed = self._form_page(document, "EUR 245.00", offset=(0.5, 0.5))
+
+        self._assert_duplicate(half_pixel, first)
+        self._assert_duplicate(_with_scanner_noise(shifted), first)
+        self._assert_duplicate(_with_scanner_noise(changed), first, expected=False)
+
+    def test_scanner_noise_on_blank_paper_does_not_change_the_hash(self):
+        with fitz.open() as document:
+            page = document.new_page()
+            page.insert_text((72, 400), "Signed 2024-03-01", fontsize=9)
+            signed = page_thumbnail(page)
+
+        noisy = _with_scanner_noise(signed)
+
+        page_hash, contrast_mask = perceptual_hash(signed)
+        noisy_hash, noisy_mask = perceptual_hash(noisy)
+        self.assertEqual((page_hash ^ noisy_hash) & (contrast_mask | noisy_mask), 0)
+        self._assert_duplicate(noisy, signed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+# Everything saidia_app imports before its first page can render.
+APP_MODULES = (
+    "agent_engine",
+    "case_handoff",
+    "database",
+    "document_indexing",
+    "rag_pipeline",
+    "s3_upload",
+    "vector_store",
+    "vision_jobs",
+)
+# Parsers, SDKs, and models that must load on first use, not at startup.
+DEFERRED_MODULES = {
+    "boto3",
+    "botocore",
+    "docx",
+    "fitz",
+    "onnxruntime",
+    "openai",
+    "pdfplumber",
+    "pymupdf",
+    "sentence_transformers",
+    "torch",
+    "transformers",
+}
+# Generous enough for slow CI hosts, whose import times vary a lot, while an
+# eager torch or sentence_transformers import alone takes several seconds.
+COLD_START_BUDGET_SECONDS = 5.0
+
+
+def _import_times():
+    """Return ``{module: (cumulative seconds, nesting)}`` for a cold app import."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(APP_MODULES)}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_time, cumulative_time, module_name = line[len("import time:"):].split("|")
+        import_times[module_name.strip()] = (
+            int(cumulative_time) / 1_000_000,
+            len(module_name) - len(module_name.lstrip()),
+        )
+    return import_times
+
+
+def test_app_startup_defers_heavy_modules_and_fits_the_budget():
+    import_times = _import_times()
+
+    eagerly_imported = {
+        module_name.split(".")[0] for module_name in import_times
+    } & DEFERRED_MODULES
+    assert not eagerly_imported
+
+    top_level_indent = min(indent for _, indent in import_times.values())
+    cold_start_seconds = sum(
+        seconds
+        for seconds, indent in import_times.values()
+        if indent == top_level_indent
+    )
+    assert cold_start_seconds < COLD_START_BUDGET_SECONDS
@@ -0,0 +1,121 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import onnx_embedding
+
+
+class _FakeTokenizer:
+    """Maps each word to its length as a token id; pads with id 1."""
+
+    def __init__(self):
+        self.padding = False
+        self.max_length = None
+
+    @classmethod
+    def from_file(cls, _path):
+        return cls()
+
+    def enable_truncation(self, max_length):
+        self.max_length = max_length
+
+    def no_truncation(self):
+        self.max_length = None
+
+    def enable_padding(self, pad_id, pad_token):
+        assert pad_token == "<pad>"
+        self.padding = True
+
+    def no_padding(self):
+        self.padding = False
+
+    def token_to_id(self, _token):
+        return 1
+
+    def encode_batch(self, texts, add_special_tokens=True):
+        ids = [[len(word) for word in text.split()] for text in texts]
+        if self.max_length:
+            ids = [token_ids[: self.max_length] for token_ids in ids]
+        longest = max(len(token_ids) for token_ids in ids)
+        encodings = []
+        for token_ids in ids:
+            padding = longest - len(token_ids) if self.padding else 0
+            encodings.append(
+                types.SimpleNamespace(
+                    ids=token_ids + [1] * padding,
+                    attention_mask=[1] * len(token_ids) + [0] * padding,
+                )
+            )
+        return encodings
+
+
+class _FakeSession:
+    """Returns ``[token id, 1]`` for real tokens and a large value for padding."""
+
+    def __init__(self, _path, _options, providers):
+        assert providers == ["CPUExecutionProvider"]
+
+    def get_inputs(self):
+        return [
+            types.SimpleNamespace(name="input_ids"),
+            types.SimpleNamespace(name="attention_mask"),
+        ]
+
+    def run(self, _output_names, feeds):
+        assert set(feeds) == {"input_ids", "attention_mask"}
+        input_ids = feeds["input_ids"].astype(np.float32)
+        token_embeddings = np.stack([input_ids, np.ones_like(input_ids)], axis=-1)
+        token_embeddings[feeds["attention_mask"] == 0] = 1000.0
+        return [token_embeddings]
+
+
+@pytest.fixture(autouse=True)
+def fake_onnx_runtime(monkeypatch):
+    fake_onnxruntime = types.ModuleType("onnxruntime")
+    fake_onnxruntime.SessionOptions = types.SimpleNamespace
+    fake_onnxruntime.GraphOptimizationLevel = types.SimpleNamespace(
+        ORT_ENABLE_ALL="all"
+    )
+    fake_onnxruntime.InferenceSession = _FakeSession
+    fake_tokenizers = types.ModuleType("tokenizers")
+    fake_tokenizers.Tokenizer = _FakeTokenizer
+    monkeypatch.setitem(sys.modules, "onnxruntime", fake_onnxruntime)
+    monkeypatch.setitem(sys.modules, "tokenizers", fake_tokenizers)
+
+
+def test_onnx_model_mean_pools_real_tokens_and_normalizes():
+    model = onnx_embedding.OnnxEmbeddingModel("model-dir")
+
+    embeddings = model.encode(["abc abcde", "a", "abcd abcd abcd"], batch_size=2)
+    query_embedding = model.encode("abc abcde")
+
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (3, 2)
+    expected = np.array([[4.0, 1.0], [1.0, 1.0], [4.0, 1.0]])
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    np.testing.assert_allclose(embeddings, expected, rtol=1e-6)
+    np.testing.assert_allclose(query_embedding, embeddings[0])
+
+
+def test_token_counter_counts_long_texts_in_full():
+    counter = onnx_embedding.OnnxTokenCounter("model-dir")
+    long_text = " ".join(["word"] * 500)
+
+    encoded = counter([long_text, "two words"], add_special_tokens=False)
+
+    assert [len(input_ids) for input_ids in encoded["input_ids"]] == [500, 2]
+
+
+def test_parity_reports_cosine_similarity_against_reference():
+    reference = np.array([[1.0, 0.0], [0.0, 2.0]])
+
+    matching = onnx_embedding.embedding_parity(reference, reference * 3)
+    drifted = onnx_embedding.embedding_parity(reference, [[1.0, 0.5], [0.0, 1.0]])
+
+    assert matching["passed"] and matching["min_cosine"] == pytest.approx(1.0)
+    assert matching["dimensions"] == 2
+    assert not drifted["passed"]
+    with pytest.raises(ValueError):
+        onnx_embedding.embedding_parity(reference, reference[:, :1])
@@ -1,5 +1,6 @@
 import importlib.util
 import sys
+import threading
 import types
 import unittest
 from pathlib import Path
@@ -39,7 +40,7 @@ class AnswerPromptTests(unittest.TestCase):
             "_read_openai_settings",
             return_value=("test-key", "test-model"),
         ), patch.object(
-            qa_engine,
+            qa_engine.openai,
             "OpenAI",
             return_value=fake_client,
         ):
@@ -58,5 +59,74 @@ class AnswerPromptTests(unittest.TestCase):
         )
 
 
+class EmbeddingWarmupTests(unittest.TestCase):
+    def setUp(self):
+        qa_engine._warmup_future = None
+
+    def tearDown(self):
+        qa_engine._warmup_future = None
+
+    def test_model_request_waits_for_the_warmup_instead_of_loading_twice(self):
+        load_started = threading.Event()
+        release_load = threading.Event()
+        loaded_models = []
+
+        class FakeModel:
+            def __init__(self):
+                self.encoded = []
+
+            def encode(self, texts):
+                self.encoded.append(texts)
+
+        def slow_load():
+            load_started.set()
+            release_load.wait(timeout=5)
+            model = FakeModel()
+            loaded_models.append(model)
+            return model
+
+        with patch.object(qa_engine, "_load_embedding_model", side_effect=slow_load):
+            warmup_future = qa_engine.start_embedding_warmup()
+            self.assertIs(qa_engine.start_embedding_warmup(), warmup_future)
+            self.assertTrue(load_started.wait(timeout=5))
+            release_load.set()
+
+            model = qa_engine.get_embedding_model()
+
+        self.assertEqual(loaded_models, [model])
+        self.assertEqual(len(model.encoded), 1)
+
+    def test_failed_warmup_falls_back_to_loading_on_request(self):
+        fallback_model = object()
+
+        with patch.object(
+            qa_engine,
+            "_load_embedding_model",
+            side_effect=[RuntimeError("no model files"), fallback_model],
+        ):
+            qa_engine.start_embedding_warmup().exception(timeout=5)
+            model = qa_engine.get_embedding_model()
+
+        self.assertIs(model, fallback_model)
+
+
+
+class EmbeddingModelLabelTests(unittest.TestCase):
+    def _load_with_backend(self, backend):
+        module = importlib.util.module_from_spec(SPEC)
+        with patch.dict("os.environ", {"EMBEDDING_BACKEND": backend}):
+            SPEC.loader.exec_module(module)
+        return module
+
+    def test_each_backend_caches_and_stores_under_its_own_label(self):
+        pytorch = self._load_with_backend("sentence-transformers")
+        onnx = self._load_with_backend("onnx")
+
+        self.assertEqual(pytorch.EMBEDDING_MODEL_LABEL, pytorch.EMBEDDING_MODEL_NAME)
+        self.assertEqual(
+            onnx.EMBEDDING_MODEL_LABEL,
+            f"{onnx.EMBEDDING_MODEL_NAME}+onnx",
+        )
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,16 @@
+from io import BytesIO
+import threading
+import time
+from unittest.mock import patch
+
+import fitz
+import pytest
 from docx import Document
 
+import pdf_engine
+import rag_pipeline
 from rag_pipeline import process_document
+from vision_engine import NoReadableTextError, VisionProcessingError
 
 
 def test_docx_extracts_paragraphs_and_table_cells(tmp_path):
@@ -39,4 +49,340 @@ def test_docx_extracts_paragraphs_and_table_cells(tmp_path):
 
     # Verify that DOCX used native extraction rather than Vision.
     assert result["metadata"]["extraction_method"] == "native_docx"
-    assert result["metadata"]["used_vision"] is False
\ No newline at end of file
+    assert result["metadata"]["used_vision"] is False
+
+
+def _draw_scanned_content(page, page_number):
+    """Draw distinct non-text marks so a page looks like a unique scan."""
+    for stripe in range(page_number):
+        top = 100 + stripe * 40
+        page.draw_rect(fitz.Rect(72, top, 400, top + 12), fill=(0, 0, 0))
+
+
+def _write_scanned_pdf(file_path, page_count):
+    """Create a PDF whose pages contain marks but no native text."""
+    with fitz.open() as document:
+        for page_number in range(1, page_count + 1):
+            _draw_scanned_content(document.new_page(), page_number)
+        document.save(file_path)
+
+
+def test_scanned_pdf_pages_are_transcribed_concurrently_in_page_order(tmp_path):
+    """Concurrent vision must keep page labels and per-page blank handling."""
+    file_path = tmp_path / "scanned.pdf"
+    _write_scanned_pdf(file_path, 4)
+
+    lock = threading.Lock()
+    active_calls = []
+    peak_calls = []
+
+    def fake_vision(image_bytes, mime_type, *, page_label, **_options):
+        with lock:
+            active_calls.append(page_label)
+            peak_calls.append(len(active_calls))
+        # Later pages finish first so ordering cannot depend on completion.
+        page_number = int(page_label.split()[-1])
+        time.sleep(0.05 * (5 - page_number))
+        with lock:
+            active_calls.remove(page_label)
+        if page_number == 2:
+            raise NoReadableTextError("blank")
+        return f"Text of {page_label}"
+
+    with patch.object(rag_pipeline, "extract_text_from_image_bytes", fake_vision):
+        text = rag_pipeline.extract_scanned_pdf_with_vision(
+            str(file_path),
+            max_workers=3,
+        )
+
+    assert text.split("\n\n") == [
+        "[Page 1]\nText of page 1",
+        "[Page 2]\n[No readable text]",
+        "[Page 3]\nText of page 3",
+        "[Page 4]\nText of page 4",
+    ]
+    assert 1 < max(peak_calls) <= 3
+
+
+def test_mixed_pdf_sends_only_textless_pages_to_vision(tmp_path):
+    """A typed cover page must not hide the scanned pages that follow it."""
+    file_path = tmp_path / "mixed.pdf"
+    with fitz.open() as document:
+        cover_page = document.new_page()
+        cover_page.insert_text(
+            (72, 72),
+            "Carrier claim cover sheet for incident INC-TEST-002.",
+        )
+        _draw_scanned_content(document.new_page(), 2)
+        _draw_scanned_content(document.new_page(), 3)
+        document.save(file_path)
+
+    transcribed_labels = []
+
+    def fake_vision(image_bytes, mime_type, *, page_label, **_options):
+        transcribed_labels.append(page_label)
+        return f"Scanned text of {page_label}"
+
+    with patch.object(rag_pipeline, "extract_text_from_image_bytes", fake_vision):
+        result = rag_pipeline.process_document(str(file_path))
+
+    metadata = result["metadata"]
+    assert sorted(transcribed_labels) == ["page 2", "page 3"]
+    assert metadata["extraction_method"] == "hybrid_pdf"
+    assert metadata["page_extraction_methods"] == [
+        "native_pdf",
+        "openai_vision",
+        "openai_vision",
+    ]
+    assert metadata["vision_page_count"] == 2
+    assert "[Page 1]\nCarrier claim cover sheet" in result["text"]
+    assert "[Page 3]\nScanned text of page 3" in result["text"]
+
+
+def test_stored_extraction_is_reused_only_for_the_current_extractor():
+    """Identical uploads reuse stored text unless the extractor has changed."""
+    stored_document = {
+        "document_id": 7,
+        "s3_object_key": "incident.pdf",
+        "extracted_text": "[Page 1]\nStored text",
+        "extraction_metadata": {"extraction_method": "openai_vision"},
+        "extractor_version": rag_pipeline.EXTRACTOR_VERSION,
+    }
+
+    with patch.object(
+        rag_pipeline,
+        "find_processed_document",
+        return_value=stored_document,
+    ), patch.object(
+        rag_pipeline,
+        "load_document_chunks",
+        return_value=["Stored text"],
+    ):
+        cached = rag_pipeline.load_cached_extraction("abc123")
+
+    assert cached["text"] == "[Page 1]\nStored text"
+    assert cached["metadata"]["extraction_method"] == "openai_vision"
+    assert cached["document_id"] == 7
+    assert cached["chunks"] == ["Stored text"]
+
+    with patch.object(
+        rag_pipeline,
+        "find_processed_document",
+        return_value=dict(stored_document, extractor_version="0"),
+    ):
+        assert rag_pipeline.load_cached_extraction("abc123") is None
+
+
+def test_pdf_is_opened_once_for_page_count_text_and_annotations(tmp_path):
+    """A native PDF upload must be parsed by a single PyMuPDF open."""
+    file_path = tmp_path / "annotated.pdf"
+    with fitz.open() as document:
+        for page_number in (1, 2):
+            page = document.new_page()
+            page.insert_text(
+                (72, 72),
+                f"Native carrier contract clause number {page_number} applies.",
+            )
+        document[1].add_text_annot((72, 144), "Reviewer note: check clause 2")
+        document.save(file_path)
+
+    with patch.object(rag_pipeline.fitz, "open", wraps=fitz.open) as fitz_open:
+        result = rag_pipeline.process_document(str(file_path))
+
+    assert fitz_open.call_count == 1
+    assert result["metadata"]["page_count"] == 2
+    assert result["metadata"]["extraction_method"] == "native_pdf"
+    assert "[Page 2]\nNative carrier contract clause number 2" in result["text"]
+    assert result["text"].endswith("[Annotations]\nReviewer note: check clause 2")
+
+
+def test_in_memory_uploads_are_processed_without_a_file_path():
+    """Upload bytes, BytesIO, and memoryview inputs need only a file name."""
+    file_data = "Incident INC-TEST-003 was reported.\r\nCarrier: NorthStar".encode(
+        "utf-8"
+    )
+
+    for source in (file_data, BytesIO(file_data), memoryview(file_data)):
+        result = rag_pipeline.process_document(source, file_name="incident.txt")
+
+        assert result["text"] == (
+            "Incident INC-TEST-003 was reported.\nCarrier: NorthStar"
+        )
+        assert result["metadata"]["file_name"] == "incident.txt"
+        assert result["metadata"]["size_bytes"] == len(file_data)
+        assert result["metadata"]["extraction_method"] == "native_text"
+
+    with pytest.raises(rag_pipeline.DocumentProcessingError):
+        rag_pipeline.process_document(file_data)
+
+
+def test_blank_and_duplicate_scanned_pages_skip_vision(tmp_path):
+    """Blank backs are skipped and repeated pages reuse one transcription."""
+    file_path = tmp_path / "batch.pdf"
+    with fitz.open() as document:
+        _draw_scanned_content(document.new_page(), 1)
+        document.new_page()
+        _draw_scanned_content(document.new_page(), 2)
+        _draw_scanned_content(document.new_page(), 1)
+        document.save(file_path)
+
+    transcribed_labels = []
+
+    def fake_vision(image_bytes, mime_type, *, page_label, **_options):
+        transcribed_labels.append(page_label)
+        return f"Scanned text of {page_label}"
+
+    with patch.object(rag_pipeline, "extract_text_from_image_bytes", fake_vision):
+        result = rag_pipeline.process_document(str(file_path))
+
+    metadata = result["metadata"]
+    assert sorted(transcribed_labels) == ["page 1", "page 3"]
+    assert metadata["vision_skipped_blank_pages"] == [2]
+    assert metadata["vision_reused_pages"] == [{"page": 4, "source_page": 1}]
+    assert "[Page 2]\n[No readable text]" in result["text"]
+    assert "[Page 4]\nScanned text of page 1" in result["text"]
+
+
+def test_large_pdf_text_is_sharded_across_processes_in_page_order(tmp_path):
+    """Process-pool extraction must return exactly the in-process page text."""
+    with fitz.open() as document:
+        for page_number in range(1, 8):
+            document.new_page().insert_text(
+                (72, 72),
+                f"Tariff book page {page_number} lists surcharges by zone.",
+            )
+        pdf_bytes = document.tobytes()
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document:
+        serial_texts = pdf_engine.read_page_texts(document)
+        with patch.object(pdf_engine, "PARALLEL_TEXT_MIN_PAGES", 5), patch.object(
+            pdf_engine,
+            "PARALLEL_TEXT_MAX_WORKERS",
+            3,
+        ), patch.object(
+            pdf_engine,
+            "read_page_texts",
+            side_effect=AssertionError("small-document path used"),
+        ):
+            pdf_scan = pdf_engine.scan_pdf(document, pdf_bytes=pdf_bytes)
+
+    assert pdf_scan["page_texts"] == serial_texts
+    assert pdf_scan["page_texts"][6].startswith("Tariff book page 7")
+
+
+def test_short_pdfs_and_single_workers_skip_the_process_pool():
+    """Spawning workers costs more than reading a short PDF in-process."""
+    with fitz.open() as document:
+        for page_number in range(1, 4):
+            document.new_page().insert_text((72, 72), f"Rate card page {page_number}.")
+        pdf_bytes = document.tobytes()
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as document, patch.object(
+        pdf_engine,
+        "ProcessPoolExecutor",
+        side_effect=AssertionError("process pool started"),
+    ):
+        with patch.object(pdf_engine, "PARALLEL_TEXT_MAX_WORKERS", 4):
+            short_scan = pdf_engine.scan_pdf(document, pdf_bytes=pdf_bytes)
+        single_worker_texts = pdf_engine.read_page_texts_parallel(
+            pdf_bytes,
+            document.page_count,
+            max_workers=1,
+        )
+
+    assert short_scan["page_texts"] == single_worker_texts
+    assert single_worker_texts[2] == "Rate card page 3."
+
+
+def test_documents_without_readable_text_fail_before_any_section(tmp_path):
+    """Nothing may be indexed for a blank scan or an empty file."""
+    file_path = tmp_path / "blank-scan.pdf"
+    _write_scanned_pdf(file_path, 3)
+    empty_path = tmp_path / "empty.txt"
+    empty_path.write_text("  \n", encoding="utf-8")
+
+    def blank_vision(image_bytes, mime_type, *, page_label, **_options):
+        raise NoReadableTextError("blank")
+
+    with patch.object(rag_pipeline, "extract_text_from_image_bytes", blank_vision):
+        with pytest.raises(rag_pipeline.DocumentProcessingError):
+            next(rag_pipeline.iter_document_pages(str(file_path)))
+    with pytest.raises(rag_pipeline.DocumentProcessingError):
+        next(rag_pipeline.iter_document_pages(str(empty_path)))
+
+
+class _MemoryVisionCheckpoint:
+    def __init__(self):
+        self.pages = {}
+
+    def begin(self, page_numbers):
+        return dict(self.pages)
+
+    def save_page(self, page_number, page_text):
+        self.pages[page_number] = page_text
+
+
+def test_failed_vision_job_resumes_from_the_last_finished_page(tmp_path):
+    """A retry after an API error must only transcribe the unfinished pages."""
+    file_path = tmp_path / "scanned.pdf"
+    _write_scanned_pdf(file_path, 4)
+    checkpoint = _MemoryVisionCheckpoint()
+    transcribed_labels = []
+
+    def failing_vision(image_bytes, mime_type, *, page_label, **_options):
+        if page_label == "page 3":
+            raise VisionProcessingError("rate limited")
+        transcribed_labels.append(page_label)
+        return f"Text of {page_label}"
+
+    def fake_vision(image_bytes, mime_type, *, page_label, **_options):
+        transcribed_labels.append(page_label)
+        return f"Text of {page_label}"
+
+    with (
+        patch.object(rag_pipeline, "VISION_PDF_MAX_WORKERS", 1),
+        patch.object(rag_pipeline, "extract_text_from_image_bytes", failing_vision),
+        pytest.raises(VisionProcessingError),
+    ):
+        rag_pipeline.process_document(
+            str(file_path),
+            vision_checkpoint=checkpoint,
+        )
+
+    assert sorted(checkpoint.pages) == [1, 2]
+    transcribed_labels.clear()
+
+    with patch.object(rag_pipeline, "extract_text_from_image_bytes", fake_vision):
+        result = rag_pipeline.process_document(
+            str(file_path),
+            vision_checkpoint=checkpoint,
+        )
+
+    assert sorted(transcribed_labels) == ["page 3", "page 4"]
+    assert result["metadata"]["vision_resumed_pages"] == 2
+    assert "[Page 1]\nText of page 1" in result["text"]
+    assert "[Page 4]\nText of page 4" in result["text"]
+
+
+def test_vision_page_limit_counts_only_unfinished_pages(tmp_path):
+    """Pages finished by an earlier job do not count toward the page limit."""
+    file_path = tmp_path / "scanned.pdf"
+    _write_scanned_pdf(file_path, 3)
+
+    def fake_vision(image_bytes, mime_type, *, page_label, **_options):
+        return f"Text of {page_label}"
+
+    with patch.object(rag_pipeline, "extract_text_from_image_bytes", fake_vision):
+        with pytest.raises(rag_pipeline.VisionPageLimitError):
+            rag_pipeline.process_document(str(file_path), max_vision_pages=2)
+
+        checkpoint = _MemoryVisionCheckpoint()
+        checkpoint.pages[1] = "Text of page 1"
+        result = rag_pipeline.process_document(
+            str(file_path),
+            vision_checkpoint=checkpoint,
+            max_vision_pages=2,
+        )
+
+    assert result["metadata"]["vision_page_count"] == 3
+    assert sorted(checkpoint.pages) == [1, 2, 3]
@@ -0,0 +1,97 @@
+import numpy as np
+from pgvector import HalfVector, Vector
+
+import vector_storage
+
+
+def _embeddings(count=600, dimensions=32, seed=1):
+    """Embeddings whose variance is concentrated in a few directions."""
+    rng = np.random.default_rng(seed)
+    scales = np.geomspace(10.0, 0.01, dimensions)
+    return (rng.standard_normal((count, dimensions)) * scales).astype(np.float32)
+
+
+def _use_pca(monkeypatch, tmp_path, dimensions, seed=1):
+    pca_projection = vector_storage.fit_pca(
+        _embeddings(dimensions=768, seed=seed),
+        dimensions,
+    )
+    path = tmp_path / f"pca-{dimensions}-{seed}.npz"
+    np.savez(path, **pca_projection)
+    monkeypatch.setattr(vector_storage, "VECTOR_PCA_PATH", str(path))
+    monkeypatch.setattr(vector_storage, "_pca_projection", None)
+    return pca_projection
+
+
+def test_default_mode_keeps_full_vectors_in_the_original_column():
+    embedding = np.arange(768, dtype=np.float32)
+
+    assert vector_storage.embedding_storage_column() == "embedding"
+    assert vector_storage.embedding_storage_schema_updates() == ()
+    assert vector_storage.stored_embedding_model("model") == "model"
+    assert isinstance(vector_storage.to_storage_vector(embedding), Vector)
+    assert vector_storage.full_embedding_from_storage(embedding).dtype == np.float32
+
+
+def test_halfvec_and_pca_mode_stores_projected_half_precision_vectors(
+    monkeypatch,
+    tmp_path,
+):
+    pca_projection = _use_pca(monkeypatch, tmp_path, 16)
+    monkeypatch.setattr(vector_storage, "VECTOR_STORAGE_TYPE", "halfvec")
+    embedding = _embeddings(count=1, dimensions=768, seed=2)[0]
+
+    stored = vector_storage.to_storage_vector(embedding)
+
+    assert isinstance(stored, HalfVector)
+    assert len(stored.to_list()) == 16
+    np.testing.assert_allclose(
+        stored.to_list(),
+        vector_storage.project_embeddings(embedding, pca_projection),
+        rtol=1e-2,
+        atol=1e-2,
+    )
+    assert vector_storage.embedding_storage_column() == "compact_embedding_16"
+    assert vector_storage.stored_embedding_model("model").startswith(
+        "model+halfvec+pca16-"
+    )
+    assert vector_storage.embedding_storage_schema_updates() == (
+        "alter table document_chunks add column if not exists compact_embedding_16 halfvec(16);",
+        "alter table policy_chunks add column if not exists compact_embedding_16 halfvec(16);",
+    )
+    assert vector_storage.full_embedding_from_storage(stored) is None
+
+
+def test_switching_pca_projection_changes_column_or_model_label(monkeypatch, tmp_path):
+    _use_pca(monkeypatch, tmp_path, 16)
+    column_16 = vector_storage.embedding_storage_column()
+    label_16 = vector_storage.stored_embedding_model("model")
+
+    _use_pca(monkeypatch, tmp_path, 8)
+    assert vector_storage.embedding_storage_column() == "reduced_embedding_8"
+    assert vector_storage.embedding_storage_column() != column_16
+    assert vector_storage.stored_embedding_model("model") != label_16
+
+    # A refit of the same size shares the column but not the label, so
+    # searches and incremental indexing ignore rows from the old basis.
+    label_8 = vector_storage.stored_embedding_model("model")
+    _use_pca(monkeypatch, tmp_path, 8, seed=3)
+    assert vector_storage.embedding_storage_column() == "reduced_embedding_8"
+    assert vector_storage.stored_embedding_model("model") != label_8
+
+
+def test_recall_report_trades_size_for_recall():
+    report = vector_storage.recall_size_report(
+        _embeddings(),
+        dimensions=[4, 32],
+        k=5,
+        query_count=50,
+    )
+
+    rows = {(row["storage_type"], row["dimensions"]): row for row in report}
+    assert rows[("vector", 32)]["recall_at_5"] == 1.0
+    assert rows[("vector", 32)]["size_ratio"] == 1.0
+    assert rows[("halfvec", 32)]["bytes_per_vector"] == 8 + 2 * 32
+    assert rows[("halfvec", 32)]["recall_at_5"] > 0.9
+    assert rows[("vector", 4)]["size_ratio"] < 0.2
+    assert 0 < rows[("vector", 4)]["recall_at_5"] < 1.0
@@ -1,5 +1,7 @@
 import importlib.util
+import os
 import sys
+import tempfile
 import types
 import unittest
 from pathlib import Path
@@ -29,9 +31,22 @@ SPEC = importlib.util.spec_from_file_location(
 )
 vision_engine = importlib.util.module_from_spec(SPEC)
 SPEC.loader.exec_module(vision_engine)
+vision_cache = sys.modules["vision_cache"]
 
 
 class VisionExtractionTests(unittest.TestCase):
+    def setUp(self):
+        # Each test starts with an empty local cache and no database tier.
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        for name, value in (
+            ("VISION_CACHE_DIR", Path(cache_dir.name)),
+            ("VISION_CACHE_USE_DATABASE", False),
+        ):
+            patcher = patch.object(vision_cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def test_empty_image_data_is_rejected_before_openai_is_called(self):
         with self.assertRaises(vision_engine.VisionProcessingError):
             vision_engine.extract_text_from_image_bytes(
@@ -54,7 +69,7 @@ class VisionExtractionTests(unittest.TestCase):
             "_read_openai_settings",
             return_value=("test-key", "test-vision-model"),
         ), patch.object(
-            vision_engine,
+            vision_engine.openai,
             "OpenAI",
             return_value=fake_client,
         ):
@@ -68,6 +83,93 @@ class VisionExtractionTests(unittest.TestCase):
         image_part = captured_request["input"][0]["content"][1]
         self.assertTrue(image_part["image_url"].startswith("data:image/png;base64,"))
 
+    def test_identical_image_is_transcribed_once_and_then_served_from_cache(self):
+        request_count = []
+
+        class FakeResponses:
+            def create(self, **kwargs):
+                request_count.append(kwargs["model"])
+                return types.SimpleNamespace(output_text="Standard claim form")
+
+        fake_client = types.SimpleNamespace(responses=FakeResponses())
+
+        with patch.object(
+            vision_engine,
+            "_read_openai_settings",
+            return_value=("test-key", "test-vision-model"),
+        ), patch.object(
+            vision_engine.openai,
+            "OpenAI",
+            return_value=fake_client,
+        ):
+            first = vision_engine.extract_text_from_image_bytes(b"form", "image/png")
+            second = vision_engine.extract_text_from_image_bytes(b"form", "image/png")
+
+        self.assertEqual(first, "Standard claim form")
+        self.assertEqual(second, "Standard claim form")
+        self.assertEqual(request_count, ["test-vision-model"])
+
+    def test_cached_blank_page_still_raises_no_readable_text(self):
+        cache_key = vision_cache.vision_cache_key(
+            b"blank",
+            "test-vision-model",
+            vision_engine.VISION_PROMPT_VERSION,
+            "",
+        )
+        vision_cache.store_transcription(
+            cache_key,
+            vision_engine.NO_READABLE_TEXT,
+            model="test-vision-model",
+            prompt_version=vision_engine.VISION_PROMPT_VERSION,
+        )
+
+        with patch.object(
+            vision_engine,
+            "_read_openai_settings",
+            return_value=("test-key", "test-vision-model"),
+        ):
+            with self.assertRaises(vision_engine.NoReadableTextError):
+                vision_engine.extract_text_from_image_bytes(b"blank", "image/png")
+
+    def test_local_cache_evicts_least_recently_used_entries(self):
+        with patch.object(vision_cache, "VISION_CACHE_MAX_BYTES", 25):
+            for last_used, cache_key in ((1, "older"), (2, "newer")):
+                vision_cache.store_transcription(
+                    cache_key, "x" * 10, model="m", prompt_version="1"
+                )
+                os.utime(vision_cache._cache_file(cache_key), (last_used, last_used))
+            vision_cache.store_transcription(
+                "newest", "z" * 10, model="m", prompt_version="1"
+            )
+
+        self.assertIsNone(vision_cache.read_cached_transcription("older"))
+        self.assertEqual(vision_cache.read_cached_transcription("newest"), "z" * 10)
+
+    def test_local_cache_writes_under_budget_do_not_list_the_directory(self):
+        vision_cache.store_transcription("first", "x", model="m", prompt_version="1")
+
+        with patch.object(
+            vision_cache,
+            "_scan_disk_entries",
+            side_effect=AssertionError("cache directory listed"),
+        ):
+            for index in range(20):
+                vision_cache.store_transcription(
+                    f"entry-{index}", "x", model="m", prompt_version="1"
+                )
+
+        self.assertEqual(vision_cache._disk_index["total_bytes"], 21)
+
+    def test_cache_key_changes_with_model_prompt_and_extractor(self):
+        keys = {
+            vision_cache.vision_cache_key(b"page", "model-a", "1", "4"),
+            vision_cache.vision_cache_key(b"page", "model-b", "1", "4"),
+            vision_cache.vision_cache_key(b"page", "model-a", "2", "4"),
+            vision_cache.vision_cache_key(b"page", "model-a", "1", "5"),
+        }
+
+        self.assertEqual(len(keys), 4)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,296 @@
+import argparse
+import hashlib
+import os
+from pathlib import Path
+import threading
+
+import numpy as np
+from pgvector import HalfVector, Vector
+
+from qa_engine import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL_LABEL
+
+
+# Chunk embeddings are stored as full 768-dimension float32 vectors by
+# default. "halfvec" stores float16 values at half the size, and a PCA
+# projection fitted with ``python vector_storage.py fit-pca`` stores fewer
+# dimensions. Both shrink the table and any vector index built on it.
+VECTOR_STORAGE_TYPE = os.getenv("VECTOR_STORAGE_TYPE", "vector").lower()
+VECTOR_PCA_PATH = os.getenv("VECTOR_PCA_PATH", "")
+
+VECTOR_STORAGE_TYPES = ("vector", "halfvec")
+# pgvector stores a 4-byte header per vector and 4 or 2 bytes per value.
+_VECTOR_HEADER_BYTES = 8
+_VALUE_BYTES = {"vector": 4, "halfvec": 2}
+EMBEDDING_TABLES = ("document_chunks", "policy_chunks")
+
+_pca_lock = threading.Lock()
+_pca_projection = None
+
+
+def load_pca_projection():
+    """Return the configured ``{"mean", "components"}`` projection, or None."""
+    global _pca_projection
+
+    if not VECTOR_PCA_PATH:
+        return None
+
+    with _pca_lock:
+        if _pca_projection is None:
+            with np.load(VECTOR_PCA_PATH) as saved_projection:
+                _pca_projection = {
+                    "mean": saved_projection["mean"].astype(np.float32),
+                    "components": saved_projection["components"].astype(np.float32),
+                }
+        return _pca_projection
+
+
+def storage_dimensions():
+    """Return the number of dimensions stored per chunk embedding."""
+    pca_projection = load_pca_projection()
+    if pca_projection is None:
+        return EMBEDDING_DIMENSIONS
+    return pca_projection["components"].shape[0]
+
+
+def embedding_storage_column():
+    """Return the chunk-table column that holds embeddings in this mode.
+
+    Full float32 vectors keep using ``embedding``. Every other type and
+    dimension has its own typed column, such as ``compact_embedding_256``,
+    so switching mode or PCA size never mixes vector sizes in one column.
+    """
+    if VECTOR_STORAGE_TYPE not in VECTOR_STORAGE_TYPES:
+        raise ValueError(
+            f"VECTOR_STORAGE_TYPE must be one of {', '.join(VECTOR_STORAGE_TYPES)}."
+        )
+    dimensions = storage_dimensions()
+    if VECTOR_STORAGE_TYPE == "vector" and dimensions == EMBEDDING_DIMENSIONS:
+        return "embedding"
+    prefix = "compact" if VECTOR_STORAGE_TYPE == "halfvec" else "reduced"
+    return f"{prefix}_embedding_{int(dimensions)}"
+
+
+def embedding_storage_schema_updates():
+    """Return the statements that add this mode's column, if it needs one."""
+    column = embedding_storage_column()
+    if column == "embedding":
+        return ()
+    column_type = f"{VECTOR_STORAGE_TYPE}({int(storage_dimensions())})"
+    return tuple(
+        f"alter table {table} add column if not exists {column} {column_type};"
+        for table in EMBEDDING_TABLES
+    )
+
+
+def vector_index_statement(table):
+    """Return a suggested HNSW index statement for this storage mode."""
+    column = embedding_storage_column()
+    return (
+        f"create index if not exists {table}_{column}_hnsw_idx "
+        f"on {table} using hnsw ({column} {VECTOR_STORAGE_TYPE}_cosine_ops);"
+    )
+
+
+def _projection_fingerprint(pca_projection):
+    digest = hashlib.sha256(pca_projection["mean"].tobytes())
+    digest.update(pca_projection["components"].tobytes())
+    return digest.hexdigest()[:8]
+
+
+def stored_embedding_model(embedding_model):
+    """Return the model label stored with chunks in this storage mode.
+
+    Rows saved in another mode, or with another PCA projection of the same
+    size, then count as stale: incremental indexing and backfills embed them
+    again, and searches skip them.
+    """
+    label = embedding_model
+    if VECTOR_STORAGE_TYPE != "vector":
+        label += f"+{VECTOR_STORAGE_TYPE}"
+    pca_projection = load_pca_projection()
+    if pca_projection is not None:
+        label += (
+            f"+pca{storage_dimensions()}-{_projection_fingerprint(pca_projection)}"
+        )
+    return label
+
+
+def chunk_embedding_model():
+    """Return the label of chunks embedded and stored with this configuration."""
+    return stored_embedding_model(EMBEDDING_MODEL_LABEL)
+
+
+def project_embeddings(embeddings, pca_projection):
+    """Project full embeddings onto the fitted principal components."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return (embeddings - pca_projection["mean"]) @ pca_projection["components"].T
+
+
+def to_storage_vector(embedding):
+    """Convert a full embedding into the pgvector value this mode stores.
+
+    Used for saved chunks and for search queries alike, so both are always
+    projected and rounded the same way.
+    """
+    embedding = np.asarray(embedding, dtype=np.float32)
+    pca_projection = load_pca_projection()
+    if pca_projection is not None:
+        embedding = project_embeddings(embedding, pca_projection)
+    if VECTOR_STORAGE_TYPE == "halfvec":
+        return HalfVector(embedding)
+    return Vector(embedding)
+
+
+def full_embedding_from_storage(value):
+    """Return a stored embedding as a full float32 array, or None.
+
+    Projected embeddings cannot be turned back into full ones, so they are
+    not reused; the shared embedding cache still avoids encoding them again.
+    """
+    if value is None:
+        return None
+    embedding = value.to_numpy() if hasattr(value, "to_numpy") else np.asarray(value)
+    if len(embedding) != EMBEDDING_DIMENSIONS:
+        return None
+    return embedding.astype(np.float32)
+
+
+def fit_pca(embeddings, dimensions):
+    """Fit a PCA projection of full embeddings onto ``dimensions`` components."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if not 0 < dimensions <= min(embeddings.shape):
+        raise ValueError(
+            "PCA dimensions must be positive and no larger than the sample."
+        )
+    mean = embeddings.mean(axis=0)
+    _, _, components = np.linalg.svd(embeddings - mean, full_matrices=False)
+    return {"mean": mean, "components": components[:dimensions]}
+
+
+def storage_bytes_per_vector(dimensions, storage_type):
+    """Return the on-disk size of one stored vector in bytes."""
+    return _VECTOR_HEADER_BYTES + _VALUE_BYTES[storage_type] * dimensions
+
+
+def _top_k(corpus, queries, k):
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True).clip(1e-12)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True).clip(1e-12)
+    similarities = queries @ corpus.T
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+def recall_size_report(
+    embeddings,
+    *,
+    dimensions,
+    storage_types=VECTOR_STORAGE_TYPES,
+    k=10,
+    query_count=200,
+    seed=0,
+):
+    """Measure search recall@k and vector size of each storage configuration.
+
+    A random subset of ``embeddings`` is used as queries against the rest.
+    Recall is the share of each query's exact float32 top-``k`` neighbours
+    that the stored configuration also returns. PCA is fitted on the corpus
+    part only, so queries are projected as unseen vectors.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    order = np.random.default_rng(seed).permutation(len(embeddings))
+    queries = embeddings[order[:query_count]]
+    corpus = embeddings[order[query_count:]]
+    k = min(k, len(corpus))
+    exact = _top_k(corpus, queries, k)
+    full_bytes = storage_bytes_per_vector(embeddings.shape[1], "vector")
+
+    rows = []
+    for dimension_count in dimensions:
+        if dimension_count >= embeddings.shape[1]:
+            dimension_count = embeddings.shape[1]
+            stored_corpus, stored_queries = corpus, queries
+        else:
+            pca_projection = fit_pca(corpus, dimension_count)
+            stored_corpus = project_embeddings(corpus, pca_projection)
+            stored_queries = project_embeddings(queries, pca_projection)
+
+        for storage_type in storage_types:
+            dtype = np.float16 if storage_type == "halfvec" else np.float32
+            approximate = _top_k(
+                stored_corpus.astype(dtype).astype(np.float32),
+                stored_queries.astype(dtype).astype(np.float32),
+                k,
+            )
+            recall = np.mean(
+                [len(found & expected) / k for found, expected in zip(approximate, exact)]
+            )
+            bytes_per_vector = storage_bytes_per_vector(dimension_count, storage_type)
+            rows.append(
+                {
+                    "storage_type": storage_type,
+                    "dimensions": dimension_count,
+                    "bytes_per_vector": bytes_per_vector,
+                    "size_ratio": round(bytes_per_vector / full_bytes, 3),
+                    f"recall_at_{k}": round(float(recall), 4),
+                }
+            )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit a PCA projection for chunk embeddings or compare storage modes.",
+    )
+    parser.add_argument("command", choices=("fit-pca", "report"))
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        nargs="+",
+        default=[128, 256, 384, EMBEDDING_DIMENSIONS],
+        help="PCA dimensions; fit-pca uses the first value.",
+    )
+    parser.add_argument("--sample", type=int, default=20000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("models/embedding_pca.npz"),
+        help="Where fit-pca saves the projection.",
+    )
+    arguments = parser.parse_args()
+
+    from database import load_embedding_sample
+
+    embeddings = load_embedding_sample(
+        embedding_model=EMBEDDING_MODEL_LABEL,
+        limit=arguments.sample,
+    )
+    print(f"Loaded {len(embeddings)} cached embedding(s) as the sample.")
+
+    if arguments.command == "fit-pca":
+        pca_projection = fit_pca(embeddings, arguments.dimensions[0])
+        arguments.output.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(arguments.output, **pca_projection)
+        print(
+            f"Saved a {arguments.dimensions[0]}-dimension projection to "
+            f"{arguments.output}. Set VECTOR_PCA_PATH to use it."
+        )
+        return
+
+    for row in recall_size_report(
+        embeddings,
+        dimensions=arguments.dimensions,
+        k=arguments.k,
+    ):
+        print(
+            f"{row['storage_type']:>8} {row['dimensions']:>4} dims: "
+            f"{row['bytes_per_vector']:>5} bytes/vector "
+            f"({row['size_ratio']:.0%} of float32), "
+            f"recall@{arguments.k} {row[f'recall_at_{arguments.k}']:.3f}"
+        )
+    for table in EMBEDDING_TABLES:
+        print(vector_index_statement(table))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,453 @@
-from qa_engine import get_embedding_model
+import os
+import re
+import threading
+import time
+
+from embedding_cache import (
+    embedding_text_hash,
+    read_cached_embeddings,
+    store_embeddings,
+)
+from qa_engine import (
+    EMBEDDING_MAX_TOKENS,
+    EMBEDDING_MODEL_LABEL,
+    get_embedding_model,
+    get_embedding_tokenizer,
+)
 import numpy as np
 
+# Chunks leave room for the model's two special tokens, so no chunk tail is
+# silently cut off when it is embedded.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(EMBEDDING_MAX_TOKENS - 2)))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+
+# Sentence ends and line breaks; OCR text and tables often have no full stops.
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+_STRIPPED_TEXT = re.compile(r"\S(?:.*\S)?", re.DOTALL)
+_WORD = re.compile(r"\S+")
+# Large text files are read and chunked this many characters at a time.
+FILE_CHUNK_BLOCK_CHARACTERS = 1024 * 1024
+# Sentences are tokenized in batches so a very large text is never copied
+# into one list of sentence strings.
+_TOKENIZE_BATCH_SENTENCES = 1024
+# Chunks are encoded in batches of similar token length, so little compute
+# goes to padding and memory stays bounded on very large documents.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+_process_embedding_stats_lock = threading.Lock()
+
+
+class TextChunk:
+    """A chunk stored as ``[start, end)`` character offsets, not a copy.
+
+    ``start`` and ``end`` are offsets into the whole chunked text. The chunk
+    string is only sliced from the underlying source when ``text`` is read.
+    """
+
+    __slots__ = ("start", "end", "_source", "_source_offset")
+
+    def __init__(self, start, end, source, source_offset=0):
+        self.start = start
+        self.end = end
+        self._source = source
+        self._source_offset = source_offset
+
+    @property
+    def text(self):
+        return self._source[
+            self.start - self._source_offset : self.end - self._source_offset
+        ]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"TextChunk(start={self.start}, end={self.end})"
+
+
+def _sentence_spans(text, start, end):
+    """Return stripped sentence spans in ``text[start:end]`` and the tail start.
+
+    The text after the last boundary may continue in a later page or file
+    block, so it is returned separately as the start of an unfinished tail.
+    """
+    spans = []
+    position = start
+    for boundary in _SENTENCE_BOUNDARY.finditer(text, start, end):
+        sentence = _STRIPPED_TEXT.search(text, position, boundary.start())
+        if sentence:
+            spans.append(sentence.span())
+        position = boundary.end()
+    return spans, position
+
+
+def _count_tokens(tokenizer, texts):
+    """Return the model token count of each text, without special tokens."""
+    if not texts:
+        return []
+    encoded = tokenizer(texts, add_special_tokens=False)
+    return [len(input_ids) for input_ids in encoded["input_ids"]]
+
+
+def _split_long_sentence(tokenizer, text, start, end, max_tokens):
+    """Split a sentence span over the token budget into word spans that fit."""
+    word_spans = [word.span() for word in _WORD.finditer(text, start, end)]
+    word_token_counts = _count_tokens(
+        tokenizer,
+        [text[word_start:word_end] for word_start, word_end in word_spans],
+    )
+    pieces = []
+    piece_start = None
+    piece_end = None
+    piece_tokens = 0
+
+    for (word_start, word_end), word_tokens in zip(word_spans, word_token_counts):
+        if piece_start is not None and piece_tokens + word_tokens > max_tokens:
+            pieces.append((piece_start, piece_end, piece_tokens))
+            piece_start = None
+            piece_tokens = 0
+        if piece_start is None:
+            piece_start = word_start
+        piece_end = word_end
+        piece_tokens += word_tokens
+
+    if piece_start is not None:
+        pieces.append((piece_start, piece_end, piece_tokens))
+    return pieces
+
+
+def _overlap_tail(window, overlap_tokens):
+    """Return the trailing sentences of a chunk that fit the overlap budget."""
+    tail = []
+    tail_tokens = 0
+    for sentence in reversed(window):
+        if tail_tokens + sentence[2] > overlap_tokens:
+            break
+        tail.insert(0, sentence)
+        tail_tokens += sentence[2]
+    return tail, tail_tokens
+
+
 # Chunk the document into smaller overlapping windows
-def chunk_text(text, chunk_size=300, overlap=50):
-    words = text.split()
-    chunks = []
+def chunk_text(text, max_tokens=None, overlap_tokens=None):
+    return [
+        chunk.text
+        for chunk in iter_text_chunks(
+            [text],
+            max_tokens=max_tokens,
+            overlap_tokens=overlap_tokens,
+        )
+    ]
 
-    for start in range(0, len(words), chunk_size - overlap):
-        chunk = words[start:start + chunk_size]
-        chunks.append(" ".join(chunk))
 
-    return chunks
+def iter_text_chunks(texts, max_tokens=None, overlap_tokens=None, separator="\n\n"):
+    """Yield sentence-aligned ``TextChunk`` spans for texts that arrive in order.
+
+    Offsets refer to the texts joined with ``separator``; the default matches
+    how ``process_document`` joins page sections. Tokens are counted with the
+    embedding model's own tokenizer. Each chunk holds whole sentences up to
+    ``max_tokens`` and repeats up to ``overlap_tokens`` of trailing sentences
+    from the previous chunk; only a sentence longer than the budget is split
+    between words. A chunk is yielded as soon as it is full, so pages can be
+    indexed while later pages are still being extracted.
+
+    A single text is never copied. With several texts, only the unfinished
+    part of the current chunk is carried over to the next text.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    if overlap_tokens is None:
+        overlap_tokens = CHUNK_OVERLAP_TOKENS
+    tokenizer = get_embedding_tokenizer()
+
+    buffer = ""
+    buffer_offset = 0
+    scan_from = 0
+    has_text = False
+    window = []
+    window_tokens = 0
+    window_has_new_text = False
+
+    def add_sentences(sentence_spans):
+        nonlocal window, window_tokens, window_has_new_text
+        for batch_start in range(0, len(sentence_spans), _TOKENIZE_BATCH_SENTENCES):
+            batch = sentence_spans[batch_start : batch_start + _TOKENIZE_BATCH_SENTENCES]
+            token_counts = _count_tokens(
+                tokenizer,
+                [buffer[start:end] for start, end in batch],
+            )
+            for (start, end), sentence_tokens in zip(batch, token_counts):
+                if sentence_tokens <= max_tokens:
+                    pieces = [(start, end, sentence_tokens)]
+                else:
+                    pieces = _split_long_sentence(
+                        tokenizer,
+                        buffer,
+                        start,
+                        end,
+                        max_tokens,
+                    )
+
+                for piece_start, piece_end, piece_tokens in pieces:
+                    piece = (
+                        piece_start + buffer_offset,
+                        piece_end + buffer_offset,
+                        piece_tokens,
+                    )
+                    if window_has_new_text and window_tokens + piece_tokens > max_tokens:
+                        yield TextChunk(window[0][0], window[-1][1], buffer, buffer_offset)
+                        window, window_tokens = _overlap_tail(window, overlap_tokens)
+                        window_has_new_text = False
+
+                    # The overlap gives way to a sentence that would not fit.
+                    while window and window_tokens + piece_tokens > max_tokens:
+                        window_tokens -= window.pop(0)[2]
+
+                    window.append(piece)
+                    window_tokens += piece_tokens
+                    window_has_new_text = True
+
+    for text in texts:
+        if has_text:
+            # Keep only the text that a later chunk can still include.
+            keep_from = min(
+                scan_from,
+                window[0][0] - buffer_offset if window else scan_from,
+            )
+            buffer = buffer[keep_from:] + separator + text
+            buffer_offset += keep_from
+            scan_from -= keep_from
+        else:
+            buffer = text
+            has_text = True
+
+        sentence_spans, scan_from = _sentence_spans(buffer, scan_from, len(buffer))
+        yield from add_sentences(sentence_spans)
+
+    tail = _STRIPPED_TEXT.search(buffer, scan_from)
+    if tail:
+        yield from add_sentences([tail.span()])
+
+    if window_has_new_text:
+        yield TextChunk(window[0][0], window[-1][1], buffer, buffer_offset)
+
+
+def iter_file_chunks(path, max_tokens=None, overlap_tokens=None):
+    """Yield ``TextChunk`` spans of a UTF-8 text file without reading it whole.
+
+    Offsets refer to the decoded file text with newlines normalised, as in
+    ``process_document``. Only the current block and the unfinished chunk
+    are held in memory.
+    """
+    with open(path, encoding="utf-8") as text_file:
+        yield from iter_text_chunks(
+            iter(lambda: text_file.read(FILE_CHUNK_BLOCK_CHARACTERS), ""),
+            max_tokens=max_tokens,
+            overlap_tokens=overlap_tokens,
+            separator="",
+        )
+
+
+def chunk_token_statistics(chunks):
+    """Return chunk token counts and how much the embedding model truncates."""
+    token_counts = []
+    if chunks:
+        encoded = get_embedding_tokenizer()(list(chunks))
+        token_counts = [len(input_ids) for input_ids in encoded["input_ids"]]
+
+    return {
+        "chunk_count": len(token_counts),
+        "mean_chunk_tokens": (
+            round(sum(token_counts) / len(token_counts), 1) if token_counts else 0
+        ),
+        "max_chunk_tokens": max(token_counts, default=0),
+        "truncated_chunks": sum(
+            count > EMBEDDING_MAX_TOKENS for count in token_counts
+        ),
+        "truncated_tokens": sum(
+            max(0, count - EMBEDDING_MAX_TOKENS) for count in token_counts
+        ),
+    }
+
+def new_embedding_stats():
+    """Return empty counters for ``embed_chunks(..., embedding_stats=...)``."""
+    return {
+        "encoded_chunks": 0,
+        "encoded_tokens": 0,
+        "padded_tokens": 0,
+        "encode_seconds": 0.0,
+    }
+
+
+_process_embedding_stats = new_embedding_stats()
+
+
+def embedding_throughput(embedding_stats=None):
+    """Summarise embedding counters as chunks and tokens per second.
+
+    Without ``embedding_stats``, the totals of this process are summarised.
+    ``padding_ratio`` is the share of encoded positions that were padding.
+    """
+    if embedding_stats is None:
+        with _process_embedding_stats_lock:
+            embedding_stats = dict(_process_embedding_stats)
+
+    encode_seconds = embedding_stats["encode_seconds"]
+    padded_tokens = embedding_stats["padded_tokens"]
+    return {
+        "encoded_chunks": embedding_stats["encoded_chunks"],
+        "encode_seconds": round(encode_seconds, 3),
+        "chunks_per_second": (
+            round(embedding_stats["encoded_chunks"] / encode_seconds, 1)
+            if encode_seconds else 0
+        ),
+        "tokens_per_second": (
+            round(embedding_stats["encoded_tokens"] / encode_seconds)
+            if encode_seconds else 0
+        ),
+        "padding_ratio": (
+            round(1 - embedding_stats["encoded_tokens"] / padded_tokens, 3)
+            if padded_tokens else 0
+        ),
+    }
+
+
+def _record_embedding_stats(embedding_stats, **counts):
+    with _process_embedding_stats_lock:
+        for name, value in counts.items():
+            _process_embedding_stats[name] += value
+    if embedding_stats is not None:
+        for name, value in counts.items():
+            embedding_stats[name] += value
+
+
+def _encode_by_length(texts, batch_size=None, embedding_stats=None):
+    """Encode texts in batches sorted by token length; return float32 rows.
+
+    Rows are returned in the order of ``texts``. Each batch only pads to
+    its own longest chunk instead of the longest chunk of the document.
+    """
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    tokenizer = get_embedding_tokenizer()
+    token_counts = []
+    for batch_start in range(0, len(texts), _TOKENIZE_BATCH_SENTENCES):
+        token_counts.extend(
+            min(token_count, EMBEDDING_MAX_TOKENS)
+            for token_count in _count_tokens(
+                tokenizer,
+                texts[batch_start : batch_start + _TOKENIZE_BATCH_SENTENCES],
+            )
+        )
+    order = sorted(range(len(texts)), key=token_counts.__getitem__)
 
-# Embed the chunks into vector space
-def embed_chunks(chunks):
     model = get_embedding_model()
-    embeddings = model.encode(chunks)
-    return np.array(embeddings)
+    embeddings = None
+    for batch_start in range(0, len(order), batch_size):
+        batch = order[batch_start : batch_start + batch_size]
+        started_at = time.perf_counter()
+        batch_embeddings = np.asarray(
+            model.encode(
+                [texts[index] for index in batch],
+                batch_size=len(batch),
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            ),
+            dtype=np.float32,
+        )
+        encode_seconds = time.perf_counter() - started_at
+
+        if embeddings is None:
+            embeddings = np.empty(
+                (len(texts), batch_embeddings.shape[1]),
+                dtype=np.float32,
+            )
+        embeddings[batch] = batch_embeddings
+        batch_tokens = [token_counts[index] for index in batch]
+        _record_embedding_stats(
+            embedding_stats,
+            encoded_chunks=len(batch),
+            encoded_tokens=sum(batch_tokens),
+            padded_tokens=max(batch_tokens) * len(batch),
+            encode_seconds=encode_seconds,
+        )
+
+    return embeddings
+
+
+# Embed the chunks into vector space
+def embed_chunks(chunks, embedding_stats=None):
+    """Embed chunks, encoding only text that no cached embedding covers.
+
+    The shared embedding cache is keyed by model and normalised chunk text,
+    so boilerplate repeated across documents and policies is encoded once.
+    Returns a float32 array in chunk order. Encoding counters are added to
+    ``embedding_stats`` when a ``new_embedding_stats`` dictionary is given.
+    """
+    text_hashes = [embedding_text_hash(chunk) for chunk in chunks]
+    embeddings_by_hash = read_cached_embeddings(EMBEDDING_MODEL_LABEL, text_hashes)
+
+    missing_chunks = {}
+    for chunk, text_hash in zip(chunks, text_hashes):
+        if text_hash not in embeddings_by_hash:
+            missing_chunks.setdefault(text_hash, chunk)
+
+    if missing_chunks:
+        new_embeddings = dict(
+            zip(
+                missing_chunks,
+                _encode_by_length(
+                    list(missing_chunks.values()),
+                    embedding_stats=embedding_stats,
+                ),
+            )
+        )
+        store_embeddings(EMBEDDING_MODEL_LABEL, new_embeddings)
+        embeddings_by_hash.update(new_embeddings)
+
+    return np.array(
+        [embeddings_by_hash[text_hash] for text_hash in text_hashes],
+        dtype=np.float32,
+    )
+
+
+def chunks_to_embed(chunks, content_hashes, reusable_embeddings):
+    """Return ``{content_hash: chunk}`` for chunks without a reusable embedding.
+
+    Identical chunks appear once, so each new text is only embedded once.
+    """
+    missing_hashes = {}
+    for chunk, content_hash in zip(chunks, content_hashes):
+        if content_hash not in reusable_embeddings:
+            missing_hashes.setdefault(content_hash, chunk)
+    return missing_hashes
+
+
+def embed_chunks_reusing(
+    chunks,
+    content_hashes,
+    reusable_embeddings,
+    embedding_stats=None,
+):
+    """Embed only chunks whose content hash has no reusable embedding.
+
+    ``reusable_embeddings`` maps content hashes to embeddings stored for the
+    same model. Identical new chunks are embedded once. Returns
+    ``(embeddings, embedded_count)`` in chunk order.
+    """
+    missing_hashes = chunks_to_embed(chunks, content_hashes, reusable_embeddings)
+
+    embeddings_by_hash = dict(reusable_embeddings)
+    if missing_hashes:
+        new_embeddings = embed_chunks(
+            list(missing_hashes.values()),
+            embedding_stats=embedding_stats,
+        )
+        embeddings_by_hash.update(zip(missing_hashes, new_embeddings))
+
+    embeddings = np.array(
+        [embeddings_by_hash[content_hash] for content_hash in content_hashes],
+        dtype=np.float32,
+    )
+    return embeddings, len(missing_hashes)
@@ -0,0 +1,163 @@
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+
+# Transcriptions are small text files, so the default budget holds thousands
+# of pages. The PostgreSQL table is shared by every app process and deploy.
+VISION_CACHE_DIR = Path(
+    os.getenv(
+        "VISION_CACHE_DIR",
+        Path(tempfile.gettempdir()) / "saidia-vision-cache",
+    )
+)
+VISION_CACHE_MAX_BYTES = int(os.getenv("VISION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+VISION_CACHE_MAX_ROWS = int(os.getenv("VISION_CACHE_MAX_ROWS", "50000"))
+VISION_CACHE_USE_DATABASE = os.getenv("VISION_CACHE_USE_DATABASE", "1") != "0"
+
+# Eviction trims the local cache to this share of its budget, so it runs
+# once per many writes rather than on every write near the limit.
+VISION_CACHE_EVICTION_TARGET_RATIO = 0.9
+
+_eviction_lock = threading.Lock()
+# Sizes of the local cache files, read from disk once per process and then
+# kept up to date on every write, so a write never has to list the directory.
+_disk_index = {"directory": None, "sizes": {}, "total_bytes": 0}
+
+
+def vision_cache_key(image_bytes, model, prompt_version, extractor_version=""):
+    """Return the cache key for one image, vision model, prompt, and extractor."""
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(
+        f"\0{model}\0{prompt_version}\0{extractor_version}".encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+def _cache_file(cache_key):
+    return VISION_CACHE_DIR / f"{cache_key}.txt"
+
+
+def _read_disk_entry(cache_key):
+    cache_file = _cache_file(cache_key)
+    try:
+        transcription = cache_file.read_text(encoding="utf-8")
+        # The modification time records the last use for LRU eviction.
+        os.utime(cache_file)
+        return transcription
+    except (FileNotFoundError, OSError, UnicodeDecodeError):
+        return None
+
+
+def _write_disk_entry(cache_key, transcription):
+    try:
+        VISION_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_file = _cache_file(cache_key)
+        temporary_file = cache_file.with_suffix(f".{threading.get_ident()}.tmp")
+        temporary_file.write_text(transcription, encoding="utf-8")
+        size_bytes = temporary_file.stat().st_size
+        os.replace(temporary_file, cache_file)
+        _record_disk_entry(cache_key, size_bytes)
+    except OSError as exc:
+        print("Vision cache write failed:", type(exc).__name__)
+
+
+def _scan_disk_entries():
+    """Return ``[(last_used, size_bytes, cache_file)]`` for every cached file."""
+    entries = []
+    for cache_file in VISION_CACHE_DIR.glob("*.txt"):
+        try:
+            file_stat = cache_file.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((file_stat.st_mtime, file_stat.st_size, cache_file))
+    return entries
+
+
+def _index_disk_entries(entries):
+    _disk_index["directory"] = VISION_CACHE_DIR
+    _disk_index["sizes"] = {
+        cache_file.stem: size_bytes for _last_used, size_bytes, cache_file in entries
+    }
+    _disk_index["total_bytes"] = sum(_disk_index["sizes"].values())
+
+
+def _record_disk_entry(cache_key, size_bytes):
+    """Add one written file to the size index and evict once over budget."""
+    with _eviction_lock:
+        if _disk_index["directory"] != VISION_CACHE_DIR:
+            _index_disk_entries(_scan_disk_entries())
+        else:
+            sizes = _disk_index["sizes"]
+            _disk_index["total_bytes"] += size_bytes - sizes.get(cache_key, 0)
+            sizes[cache_key] = size_bytes
+
+        if _disk_index["total_bytes"] > VISION_CACHE_MAX_BYTES:
+            _evict_disk_entries()
+
+
+def _evict_disk_entries():
+    """Delete least recently used entries until the cache is below its target.
+
+    The directory is listed again here, because other processes share it and
+    the last-use times are only known on disk. Called with the lock held.
+    """
+    entries = _scan_disk_entries()
+    total_bytes = sum(size_bytes for _last_used, size_bytes, _file in entries)
+    target_bytes = VISION_CACHE_MAX_BYTES * VISION_CACHE_EVICTION_TARGET_RATIO
+
+    remaining_entries = []
+    for last_used, size_bytes, cache_file in sorted(entries):
+        if total_bytes > target_bytes:
+            cache_file.unlink(missing_ok=True)
+            total_bytes -= size_bytes
+        else:
+            remaining_entries.append((last_used, size_bytes, cache_file))
+    _index_disk_entries(remaining_entries)
+
+
+def read_cached_transcription(cache_key):
+    """Return a cached transcription from disk or PostgreSQL, or None."""
+    transcription = _read_disk_entry(cache_key)
+    if transcription is not None:
+        return transcription
+
+    if not VISION_CACHE_USE_DATABASE:
+        return None
+
+    try:
+        from database import find_vision_transcription
+
+        transcription = find_vision_transcription(cache_key)
+    except Exception as exc:
+        # The database tier is optional; a miss only costs a vision call.
+        print("Vision cache lookup failed:", type(exc).__name__)
+        return None
+
+    if transcription is not None:
+        _write_disk_entry(cache_key, transcription)
+    return transcription
+
+
+def store_transcription(cache_key, transcription, *, model, prompt_version):
+    """Save a transcription to the local cache and, when configured, PostgreSQL."""
+    _write_disk_entry(cache_key, transcription)
+
+    if not VISION_CACHE_USE_DATABASE:
+        return
+
+    try:
+        from database import save_vision_transcription
+
+        save_vision_transcription(
+            cache_key=cache_key,
+            model=model,
+            prompt_version=prompt_version,
+            transcription=transcription,
+            max_rows=VISION_CACHE_MAX_ROWS,
+        )
+    except Exception as exc:
+        print("Vision cache write failed:", type(exc).__name__)
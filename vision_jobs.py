@@ -0,0 +1,168 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from pathlib import Path
+
+from database import (
+    finish_vision_job,
+    get_vision_job_progress,
+    save_vision_job_page,
+    start_vision_job,
+)
+from document_indexing import process_and_index_document
+from rag_pipeline import EXTRACTOR_VERSION, process_document
+from vision_engine import vision_job_version
+
+
+# Background jobs may run for many minutes, so they accept far larger scans
+# than an interactive request. Each page is saved as soon as it is finished.
+MAX_BACKGROUND_VISION_PDF_PAGES = 300
+
+_background_executor = ThreadPoolExecutor(
+    max_workers=2,
+    thread_name_prefix="saidia-vision-job",
+)
+_background_jobs = {}
+
+
+class PostgresVisionCheckpoint:
+    """Persist the pages of one scanned-PDF vision job in PostgreSQL."""
+
+    def __init__(self, document_hash, file_name):
+        self.document_hash = document_hash
+        self.file_name = file_name
+
+    def begin(self, page_numbers):
+        """Start or resume the job and return ``{page_number: text}`` done so far."""
+        return start_vision_job(
+            document_hash=self.document_hash,
+            file_name=self.file_name,
+            page_count=len(page_numbers),
+            job_version=vision_job_version(EXTRACTOR_VERSION),
+        )
+
+    def save_page(self, page_number, page_text):
+        """Save one finished page; a failed save only costs a repeat later."""
+        try:
+            save_vision_job_page(
+                document_hash=self.document_hash,
+                page_number=page_number,
+                page_text=page_text,
+            )
+        except Exception as exc:
+            print("Vision checkpoint save failed:", type(exc).__name__)
+
+    def finish(self, error=None):
+        """Record the final job status without hiding the original outcome."""
+        try:
+            finish_vision_job(
+                document_hash=self.document_hash,
+                status="failed" if error else "completed",
+                error=error,
+            )
+        except Exception as exc:
+            print("Vision job status update failed:", type(exc).__name__)
+
+
+def process_document_resumably(
+    file_data,
+    file_name,
+    *,
+    document_hash=None,
+    document_id=None,
+    max_vision_pages=None,
+):
+    """Process an upload, resuming any scanned pages finished by an earlier run.
+
+    With a ``document_id``, pages are chunked, embedded, and saved as they
+    are extracted, and the result also contains the saved ``chunks``.
+    """
+    document_hash = document_hash or hashlib.sha256(file_data).hexdigest()
+    checkpoint = PostgresVisionCheckpoint(document_hash, file_name)
+
+    try:
+        if document_id is None:
+            result = process_document(
+                file_data,
+                file_name=file_name,
+                vision_checkpoint=checkpoint,
+                max_vision_pages=max_vision_pages,
+            )
+        else:
+            result = process_and_index_document(
+                file_data,
+                document_id=document_id,
+                file_name=file_name,
+                vision_checkpoint=checkpoint,
+                max_vision_pages=max_vision_pages,
+            )
+    except Exception as exc:
+        checkpoint.finish(error=str(exc) or type(exc).__name__)
+        raise
+
+    checkpoint.finish()
+    return result
+
+
+def start_background_vision_job(file_data, file_name, *, document_hash=None):
+    """Transcribe a large scan in a background thread and return its future.
+
+    A job that is still running for the same file is returned instead of
+    starting a second one. Finished jobs are forgotten; their progress and
+    errors stay in PostgreSQL (see ``vision_job_progress``).
+    """
+    document_hash = document_hash or hashlib.sha256(file_data).hexdigest()
+    running_job = _background_jobs.get(document_hash)
+    if running_job is not None and not running_job.done():
+        return running_job
+
+    job = _background_executor.submit(
+        process_document_resumably,
+        file_data,
+        file_name,
+        document_hash=document_hash,
+        max_vision_pages=MAX_BACKGROUND_VISION_PDF_PAGES,
+    )
+    _background_jobs[document_hash] = job
+
+    def forget_finished_job(finished_job):
+        if _background_jobs.get(document_hash) is finished_job:
+            _background_jobs.pop(document_hash, None)
+
+    job.add_done_callback(forget_finished_job)
+    return job
+
+
+def vision_job_progress(document_hash):
+    """Return the stored progress of a vision job, or None if there is none."""
+    try:
+        return get_vision_job_progress(document_hash)
+    except Exception as exc:
+        print("Vision job progress lookup failed:", type(exc).__name__)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transcribe a large scanned PDF as a resumable vision job.",
+    )
+    parser.add_argument("pdf_path", type=Path)
+    arguments = parser.parse_args()
+
+    file_data = arguments.pdf_path.read_bytes()
+    result = process_document_resumably(
+        file_data,
+        arguments.pdf_path.name,
+        max_vision_pages=MAX_BACKGROUND_VISION_PDF_PAGES,
+    )
+    metadata = result["metadata"]
+
+    print(
+        f"Transcribed {metadata.get('vision_page_count', 0)} scanned page(s) of "
+        f"{arguments.pdf_path.name}; {metadata.get('vision_resumed_pages', 0)} "
+        "were resumed from an earlier run."
+    )
+
+
+if __name__ == "__main__":
+    main()